@@ -0,0 +1,232 @@
+import csv
+import io
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+
+from db import EVENT_FIELDS, add_events_bulk, iter_event_rows
+from instrumentation import import_module, timed
+from metrics import minutes_of_day
+from recurrence import format_exdates, ics_rrule, parse_exdates, parse_rrule
+
+# ----------------------------
+# Import (CSV / ICS) -> add_events_bulk
+# ----------------------------
+def rows_from_csv(data):
+    """Event rows from a CSV like the one produced by the export (id/user_id are ignored)."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8-sig")
+    df = pd.read_csv(io.StringIO(data), dtype=str, keep_default_na=False)
+    missing = [c for c in ("title", "date", "start", "end") if c not in df.columns]
+    if missing:
+        raise ValueError(f"faltan columnas en el CSV: {', '.join(missing)}")
+    cols = [c for c in EVENT_FIELDS if c in df.columns]
+    return df[cols].to_dict("records")
+
+def _raw_vevents(data):
+    # ics 0.7 lee las horas flotantes como UTC y deja RRULE/EXDATE sin interpretar:
+    # las líneas originales de cada VEVENT, por UID
+    parse = import_module("ics.grammar.parse")
+    raw = {}
+    for cal in parse.string_to_container(data):
+        for block in cal:
+            if block.name == "VEVENT":
+                lines = {}
+                for line in block:
+                    lines.setdefault(line.name, []).append(line)
+                uid = lines.get("UID")
+                if uid:
+                    raw.setdefault(uid[0].value, lines)
+    return raw
+
+def _is_absolute(line):
+    return line is not None and (line.value.upper().endswith("Z") or "TZID" in line.params)
+
+def _wall_clock(moment, line):
+    # UTC (Z) o TZID -> hora local del servidor; flotante -> tal como viene
+    dt = moment.datetime
+    return dt.astimezone().replace(tzinfo=None) if _is_absolute(line) else dt.replace(tzinfo=None)
+
+def _exdates(lines):
+    days = []
+    for line in lines:
+        for v in line.value.split(","):
+            v = v.strip()
+            if v.upper().endswith("Z"):
+                days.append(datetime.strptime(v, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc).astimezone().date())
+            elif v:
+                days.append(date(int(v[:4]), int(v[4:6]), int(v[6:8])))
+    return format_exdates(days)
+
+def rows_from_ics(data):
+    """Event rows from an iCalendar file; RRULE/EXDATE become a series.
+
+    Floating times are kept as written; UTC (Z) and TZID times are converted to the server's local time."""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    Calendar = import_module("ics").Calendar   # solo al importar un .ics (la exportación no usa la librería)
+    raw = _raw_vevents(data)
+    rows = []
+    for ev in Calendar(data).events:
+        lines = raw.get(ev.uid, {})
+        start = _wall_clock(ev.begin, (lines.get("DTSTART") or [None])[0])
+        end = _wall_clock(ev.end, (lines.get("DTEND") or lines.get("DTSTART") or [None])[0]) if ev.end else start
+        row = {
+            "title": ev.name,
+            "category": next(iter(ev.categories), "Otro") if getattr(ev, "categories", None) else "Otro",
+            "date": start.date(),
+            "start": start.time(),
+            "end": end.time(),
+            "fixed": 0,
+            "notes": ev.description or "",
+            "priority": "Media",
+        }
+        if "RRULE" in lines:
+            try:
+                parse_rrule(lines["RRULE"][0].value)
+            except ValueError as e:
+                raise ValueError(f"evento repetido «{ev.name}»: {e}")
+            row["rrule"] = lines["RRULE"][0].value
+            row["exdates"] = _exdates(lines.get("EXDATE", []))
+        rows.append(row)
+    rows.sort(key=lambda r: (r["date"], r["start"]))
+    return rows
+
+@timed("import.events")
+def import_events(user_id, filename, data):
+    """Parse an uploaded .csv/.ics file and bulk-insert it; returns the number of events."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        rows = rows_from_csv(data)
+    elif name.endswith(".ics") or name.endswith(".ical"):
+        rows = rows_from_ics(data)
+    else:
+        raise ValueError("formato no soportado (usa .csv o .ics)")
+    return add_events_bulk(user_id, rows)
+
+# ----------------------------
+# Streaming export (CSV / ICS)
+# ----------------------------
+EXPORT_COLUMNS = ("id", "user_id") + EVENT_FIELDS
+ICS_UID_DOMAIN = "agenda-pro"
+
+@timed("export.csv")
+def iter_csv(user_id, date_from=None, date_to=None, categories=None, chunk_size=1000):
+    """CSV export as bytes chunks, same columns as the events table."""
+    buf = io.StringIO()
+    w = csv.writer(buf, lineterminator="\n")
+    w.writerow(EXPORT_COLUMNS)
+    for rows in iter_event_rows(user_id, date_from, date_to, categories, chunk_size):
+        w.writerows([r[c] for c in EXPORT_COLUMNS] for r in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+def event_uid(event_id):
+    # estable entre exportaciones: los clientes pueden sincronizar incrementalmente
+    return f"event-{int(event_id)}@{ICS_UID_DOMAIN}"
+
+def _ics_escape(value):
+    return (str(value or "").replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _ics_fold(line):
+    # RFC 5545: líneas de máx. 75 octetos, continuación con espacio inicial
+    raw = line.encode("utf-8")
+    if len(raw) <= 75:
+        return line + "\r\n"
+    parts, cur = [], b""
+    for ch in line:
+        b = ch.encode("utf-8")
+        if len(cur) + len(b) > (75 if not parts else 74):
+            parts.append(cur.decode("utf-8"))
+            cur = b""
+        cur += b
+    parts.append(cur.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+def _ics_utc(iso):
+    # "2025-12-01T10:00:00Z" (created_at/updated_at) -> "20251201T100000Z"
+    return str(iso).replace("-", "").replace(":", "")
+
+def _vevent_lines(row, start_m, end_m, stamp):
+    d = date.fromisoformat(str(row["date"])[:10])
+    start_dt = datetime.combine(d, datetime.min.time()) + timedelta(minutes=int(start_m))
+    end_dt = datetime.combine(d, datetime.min.time()) + timedelta(minutes=int(end_m))
+    if end_dt <= start_dt:
+        end_dt += timedelta(days=1)
+    lines = ["BEGIN:VEVENT", f"UID:{event_uid(row['id'])}", f"DTSTAMP:{stamp}",
+             f"DTSTART:{start_dt:%Y%m%dT%H%M%S}", f"DTEND:{end_dt:%Y%m%dT%H%M%S}",
+             f"SUMMARY:{_ics_escape(row['title'])}", f"SEQUENCE:{int(row.get('sequence') or 0)}"]
+    if row.get("created_at"):
+        lines.append(f"CREATED:{_ics_utc(row['created_at'])}")
+    if row.get("updated_at"):
+        lines.append(f"LAST-MODIFIED:{_ics_utc(row['updated_at'])}")
+    if row.get("rrule"):
+        # serie: un solo VEVENT con RRULE nativo (y EXDATE a la misma hora local)
+        lines.append(f"RRULE:{ics_rrule(row['rrule'])}")
+        ex = [datetime.combine(x, start_dt.time()) for x in parse_exdates(row.get("exdates"))]
+        if ex:
+            lines.append("EXDATE:" + ",".join(f"{x:%Y%m%dT%H%M%S}" for x in ex))
+    if row["category"]:
+        lines.append(f"CATEGORIES:{_ics_escape(row['category'])}")
+    if row["notes"]:
+        lines.append(f"DESCRIPTION:{_ics_escape(row['notes'])}")
+    lines.append("END:VEVENT")
+    return lines
+
+@timed("export.ics")
+def iter_ics(user_id, date_from=None, date_to=None, categories=None, chunk_size=1000):
+    """iCalendar export as bytes chunks, one VEVENT per row (series with RRULE) and a stable UID."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield _ics_header()
+    for rows in iter_event_rows(user_id, date_from, date_to, categories, chunk_size):
+        yield _vevents(rows, stamp)
+    yield _ics_fold("END:VCALENDAR").encode("utf-8")
+
+def _vevents(rows, stamp):
+    valid = [r for r in rows if r["date"]]
+    start_m = minutes_of_day([r["start"] for r in valid])
+    end_m = minutes_of_day([r["end"] for r in valid])
+    out = []
+    for r, s, e in zip(valid, start_m, end_m):
+        out.extend(_ics_fold(l) for l in _vevent_lines(r, s, e, stamp))
+    return "".join(out).encode("utf-8")
+
+def _ics_header():
+    return "".join(_ics_fold(l) for l in ("BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Agenda Academica PRO//ES", "CALSCALE:GREGORIAN")).encode("utf-8")
+
+@timed("export.ics_changes")
+def ics_changes(changes):
+    """iCalendar bytes for db.changes_since(): changed VEVENTs plus STATUS:CANCELLED ones for deletions."""
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out = [_ics_header(), _vevents(changes["changed"], stamp)]
+    for t in changes["deleted"]:
+        out.append("".join(_ics_fold(l) for l in (
+            "BEGIN:VEVENT", f"UID:{event_uid(t['id'])}", f"DTSTAMP:{stamp}", f"SEQUENCE:{int(t['sequence'])}",
+            f"LAST-MODIFIED:{_ics_utc(t['deleted_at'])}", "STATUS:CANCELLED", "END:VEVENT")).encode("utf-8"))
+    out.append(_ics_fold("END:VCALENDAR").encode("utf-8"))
+    return b"".join(out)
+
+class IterStream(io.RawIOBase):
+    """Read-only file object over an iterator of bytes chunks (for st.download_button)."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buf:
+            try:
+                self._buf = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
@@ -0,0 +1,125 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from instrumentation import timed
+from metrics import EPOCH, STUDY_CATEGORIES
+from recurrence import SERIES_IN_WINDOW, expand_series
+from storage import engine
+
+# ----------------------------
+# Weekly load aggregates (tabla week_load)
+# ----------------------------
+# Minutos por usuario, semana ISO (lunes) y grupo de categoría. db.py los
+# actualiza en la misma transacción que cada escritura de events, así los
+# indicadores semanales se leen sin recorrer el historial. Un evento cuenta
+# entero en la semana de su inicio (también si cruza medianoche). Los
+# eventos recurrentes no se materializan aquí: se expanden al leer, solo
+# para las semanas pedidas (_series_minutes).
+LOAD_GROUPS = ("study", "work", "sleep", "other")
+
+def category_group(category):
+    if category in STUDY_CATEGORIES:
+        return "study"
+    if category == "Trabajo":
+        return "work"
+    if category == "Sueño":
+        return "sleep"
+    return "other"
+
+def week_start(d):
+    """Monday of the ISO week containing d (date or ISO string)."""
+    if not isinstance(d, date):
+        d = date.fromisoformat(str(d).strip()[:10])
+    return d - timedelta(days=d.weekday())
+
+def week_of(start_at):
+    # 1970-01-01 fue jueves: (día + 3) % 7 es el weekday() de ese día
+    day = int(start_at) // 1440
+    return EPOCH + timedelta(days=day - (day + 3) % 7)
+
+def load_deltas(rows, sign=1, acc=None):
+    """Accumulate {(user_id, week_start, group): minutes} from rows with user_id/category/start_at/end_at."""
+    acc = {} if acc is None else acc
+    for r in rows:
+        if r.get("rrule") or r["start_at"] is None or r["end_at"] is None:
+            continue   # serie (se suma al leer) o sin fecha válida
+        key = (int(r["user_id"]), week_of(r["start_at"]).isoformat(), category_group(r["category"]))
+        acc[key] = acc.get(key, 0) + sign * (int(r["end_at"]) - int(r["start_at"]))
+    return acc
+
+def apply_load_deltas(conn, deltas):
+    params = [{"u": u, "w": w, "g": g, "m": m} for (u, w, g), m in deltas.items() if m]
+    if params:
+        conn.execute(text("""
+        INSERT INTO week_load (user_id, week_start, grp, minutes) VALUES (:u, :w, :g, :m)
+        ON CONFLICT (user_id, week_start, grp) DO UPDATE SET minutes = week_load.minutes + excluded.minutes
+        """), params)
+
+def rebuild_week_load(conn, user_id=None):
+    """Recompute week_load from events (all users, or one)."""
+    where, params = ("WHERE user_id=:u", {"u": user_id}) if user_id is not None else ("", {})
+    conn.execute(text(f"DELETE FROM week_load {where}"), params)
+    # la columna rrule llega en la migración 6; antes no hay series
+    one_off = "rrule IS NULL" if "rrule" in {c["name"] for c in inspect(conn).get_columns("events")} else "1=1"
+    rows = conn.execute(text(f"SELECT user_id, category, start_at, end_at FROM events WHERE {one_off}" + (" AND user_id=:u" if where else "")),
+                        params).mappings()
+    apply_load_deltas(conn, load_deltas(rows))
+
+# ----------------------------
+# Lecturas
+# ----------------------------
+def _occurrence_minutes(occ):
+    """DataFrame week_start/grp/minutes from expanded occurrences."""
+    if occ.empty:
+        return pd.DataFrame({"week_start": pd.Series(dtype=object), "grp": pd.Series(dtype=object), "minutes": pd.Series(dtype=np.int64)})
+    day = occ["start_at"].to_numpy(dtype=np.int64) // 1440
+    weeks = pd.to_datetime(day - (day + 3) % 7, unit="D").strftime("%Y-%m-%d")
+    out = pd.DataFrame({"week_start": weeks, "grp": occ["category"].map(category_group).to_numpy(),
+                        "minutes": occ["end_at"].to_numpy(dtype=np.int64) - occ["start_at"].to_numpy(dtype=np.int64)})
+    return out.groupby(["week_start", "grp"], as_index=False)["minutes"].sum()
+
+def _series_minutes(conn, user_id, first, last):
+    series = pd.read_sql(text(SERIES_IN_WINDOW), conn, params={"id": int(user_id), "a": first.isoformat(), "b": last.isoformat()})
+    return _occurrence_minutes(expand_series(series, first, last))
+
+@timed("aggregates.week_hours")
+def week_hours(user_id, week):
+    """{group: hours} for the ISO week containing `week`."""
+    first = week_start(week)
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT grp, minutes FROM week_load WHERE user_id=:u AND week_start=:w"),
+                            {"u": int(user_id), "w": first.isoformat()}).all()
+        series = _series_minutes(conn, user_id, first, first + timedelta(days=6))
+    hours = dict.fromkeys(LOAD_GROUPS, 0.0)
+    for grp, minutes in list(rows) + list(zip(series["grp"], series["minutes"])):
+        hours[grp] += minutes / 60.0
+    return hours
+
+@timed("aggregates.total_hours")
+def total_hours(user_id):
+    """All registered hours; series count their occurrences up to today (bounded or not)."""
+    today = date.today()
+    with engine.connect() as conn:
+        minutes = conn.execute(text("SELECT COALESCE(SUM(minutes), 0) FROM week_load WHERE user_id=:u"), {"u": int(user_id)}).scalar()
+        series = pd.read_sql(text("SELECT * FROM events WHERE user_id=:u AND rrule IS NOT NULL AND date <= :t"), conn,
+                             params={"u": int(user_id), "t": today.isoformat()})
+    if not series.empty:
+        # un UNTIL lejano (p.ej. 2099) no debe expandir ni contar décadas de ocurrencias futuras
+        minutes += _occurrence_minutes(expand_series(series, date_to=today))["minutes"].sum()
+    return minutes / 60.0
+
+@timed("aggregates.load_trend")
+def load_trend(user_id, until=None, weeks=8):
+    """Hours per group for the `weeks` ISO weeks ending at `until` (index: Monday; missing weeks are 0)."""
+    last = week_start(until or date.today())
+    first = last - timedelta(weeks=weeks - 1)
+    q = text("SELECT week_start, grp, minutes FROM week_load WHERE user_id=:u AND week_start BETWEEN :a AND :b")
+    with engine.connect() as conn:
+        df = pd.read_sql(q, conn, params={"u": int(user_id), "a": first.isoformat(), "b": last.isoformat()})
+        df = pd.concat([df, _series_minutes(conn, user_id, first, last + timedelta(days=6))], ignore_index=True)
+    index = pd.Index([(first + timedelta(weeks=i)).isoformat() for i in range(weeks)], name="week_start")
+    trend = df.pivot_table(index="week_start", columns="grp", values="minutes", aggfunc="sum") if not df.empty else pd.DataFrame()
+    return (trend.reindex(index=index, columns=list(LOAD_GROUPS)).fillna(0) / 60.0)
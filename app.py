@@ -1,11 +1,10 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import plotly.express as px
-from datetime import datetime, date, time, timedelta
-import os, textwrap
-from ics import Calendar, Event
-from sqlalchemy import create_engine, text
+from datetime import date, time, timedelta
+import os, uuid
+from instrumentation import DEBUG_PANEL, begin_rerun, end_rerun, import_table, prometheus_text, rerun_table, start_metrics_server, timed_imports
+from auth import authenticate, create_user, seed_demo_user, LoginRateLimited
+from migrations import migrate
+from storage import engine
 
 # ----------------------------
 # CONFIG
@@ -13,83 +12,28 @@ from sqlalchemy import create_engine, text
 st.set_page_config(page_title="Agenda Académica Inteligente — PRO", layout="wide")
 st.title("📚 Agenda Académica Inteligente — PRO (Estudiantes TIC)")
 
-# DB (SQLite local file)
-# Ruta absoluta para que SIEMPRE use la misma base de datos
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_FILE = os.path.join(BASE_DIR, "agenda_pro.db")
+# DB helpers (SQLite + caché de eventos por usuario) -> db.py
 
-engine = create_engine(f"sqlite:///{DB_FILE}", echo=False, future=True)
-
-# ----------------------------
-# DB HELPERS
-# ----------------------------
-def init_db():
-    with engine.begin() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password TEXT
-        )
-        """))
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT,
-            category TEXT,
-            date TEXT,
-            start TEXT,
-            end TEXT,
-            fixed INTEGER,
-            notes TEXT,
-            priority TEXT
-        )
-        """))
-
-def add_user(username, password):
-    with engine.begin() as conn:
-        conn.execute(text("""
-        INSERT OR IGNORE INTO users (username, password) VALUES (:u, :p)
-        """), {"u": username, "p": password})
-
-def get_user(username, password):
-    q = text("SELECT * FROM users WHERE username=:u AND password=:p")
-    df = pd.read_sql(q, engine, params={"u": username, "p": password})
-    return df.iloc[0].to_dict() if not df.empty else None
-
-def get_user_by_name(username):
-    q = text("SELECT * FROM users WHERE username=:u")
-    df = pd.read_sql(q, engine, params={"u": username})
-    return df.iloc[0].to_dict() if not df.empty else None
-
-def add_event(user_id, title, category, date_s, start_s, end_s, fixed, notes, priority):
-    with engine.begin() as conn:
-        conn.execute(text("""
-        INSERT INTO events (user_id, title, category, date, start, end, fixed, notes, priority)
-        VALUES (:uid,:t,:c,:d,:s,:e,:f,:n,:pr)
-        """), {"uid": user_id, "t": title, "c": category, "d": date_s, "s": start_s, "e": end_s, "f": int(fixed), "n": notes, "pr": priority})
-
-def update_event(eid, title, category, date_s, start_s, end_s, fixed, notes, priority):
-    with engine.begin() as conn:
-        conn.execute(text("""
-        UPDATE events SET title=:t, category=:c, date=:d, start=:s, end=:e, fixed=:f, notes=:n, priority=:pr WHERE id=:id
-        """), {"t": title, "c": category, "d": date_s, "s": start_s, "e": end_s, "f": int(fixed), "n": notes, "pr": priority, "id": eid})
-
-def delete_event(eid):
-    with engine.begin() as conn:
-        conn.execute(text("DELETE FROM events WHERE id=:id"), {"id": eid})
-
-def get_events(user_id):
-    q = text("SELECT * FROM events WHERE user_id=:id ORDER BY date,start")
-    return pd.read_sql(q, engine, params={"id": user_id})
+# perfil por rerun (opt-in con AGENDA_INSTRUMENT=1, ver instrumentation.py)
+if "perf_session" not in st.session_state:
+    st.session_state.perf_session = uuid.uuid4().hex[:8]
+_perf_user = (st.session_state.get("user") or {}).get("id")
+begin_rerun(f"{st.session_state.perf_session}/u{_perf_user}" if _perf_user else st.session_state.perf_session)
 
 # ----------------------------
 # INIT
 # ----------------------------
-init_db()
-# demo user
-add_user("estudiante", "1234")
+@st.cache_resource
+def _startup():
+    # una vez por proceso (no en cada rerun): migraciones + usuario demo
+    migrate(engine)   # = db.init_db, sin cargar db.py (pandas) en la pantalla de acceso
+    seed_demo_user()
+    start_metrics_server()
+    from feed import start_feed_server
+    start_feed_server()
+    return True
+
+_startup()
 
 # ----------------------------
 # AUTH
@@ -104,7 +48,11 @@ if st.session_state.user is None:
         user_in = st.text_input("Usuario")
         pw_in = st.text_input("Contraseña", type="password")
         if st.button("Iniciar sesión"):
-            u = get_user(user_in, pw_in)
+            try:
+                u = authenticate(user_in, pw_in)
+            except LoginRateLimited as e:
+                st.error(f"Acceso bloqueado temporalmente: {e}")
+                st.stop()
             if u:
                 st.session_state.user = u
                 st.success("Sesión iniciada.")
@@ -119,11 +67,39 @@ if st.session_state.user is None:
         if st.button("Crear cuenta"):
             if not new_user or not new_pw:
                 st.warning("Completa usuario y contraseña.")
-            else:
-                add_user(new_user, new_pw)
+                st.stop()
+            try:
+                created = create_user(new_user, new_pw)
+            except LoginRateLimited as e:
+                st.error(f"No se pudo crear la cuenta ahora: {e}")
+                st.stop()
+            if created:
                 st.success("Cuenta creada. Inicia sesión arriba.")
+            else:
+                st.warning("Ese usuario ya existe.")
     st.stop()
 
+# ----------------------------
+# Módulos de la agenda (después del acceso)
+# ----------------------------
+# La pantalla de acceso solo necesita auth/users/migrations (SQLAlchemy, sin
+# pandas/numpy): db.py y el resto se importan al entrar
+# (una vez por proceso; en los reruns siguientes ya está en sys.modules).
+# plotly, ics y google.generativeai se difieren más aún, a la sección que los
+# usa (instrumentation.import_module). Coste medido en el panel de depuración.
+with timed_imports("app.modules"):
+    import pandas as pd
+    from db import add_event, skip_occurrence, latest_batch_result, add_events_bulk, update_event, move_event, delete_event, get_event_set, get_event_categories, search_events, count_events, search_terms, search_text, get_feed_key
+    from metrics import parse_time_str_safe, burnout_from_load
+    from charts import week_figure
+    from conflicts import describe_conflicts
+    from aggregates import week_hours, total_hours, load_trend
+    from agenda_io import import_events, iter_csv, iter_ics, IterStream
+    from feed import FEED_PORT, feed_url
+    from freebusy import GROUP_MAX_DAYS, GROUP_MAX_USERS, SLOT_MINUTES, common_free_slots, group_candidates, set_share_freebusy, shares_freebusy
+    from jobs import submit_optimization, get_job, cancel_job
+    from llm import backend_name, submit_analysis, get_analysis, LLMRateLimited
+
 # ----------------------------
 # Sidebar - info & Gemini (opcional)
 # ----------------------------
@@ -141,75 +117,6 @@ if gem_key_env:
 else:
     st.sidebar.info("GEMINI_API_KEY no configurada (usar optimizador local)")
 
-# ----------------------------
-# HELPERS: parse time / durations / energy / burnout
-# ----------------------------
-def parse_time_str_safe(s):
-    """Return datetime.time from multiple input formats, fallback to 00:00."""
-    if isinstance(s, time):
-        return s
-    if not isinstance(s, str):
-        return datetime.strptime("00:00", "%H:%M").time()
-    # try likely formats
-    for fmt in ("%H:%M", "%H:%M:%S"):
-        try:
-            return datetime.strptime(s, fmt).time()
-        except:
-            pass
-    try:
-        return datetime.fromisoformat(s).time()
-    except:
-        return datetime.strptime("00:00", "%H:%M").time()
-
-def dur_hours(start_s, end_s):
-    s = parse_time_str_safe(start_s)
-    e = parse_time_str_safe(end_s)
-    start_dt = datetime.combine(date.min, s)
-    end_dt = datetime.combine(date.min, e)
-    if end_dt <= start_dt:
-        end_dt += timedelta(days=1)
-    return (end_dt - start_dt).total_seconds()/3600.0
-
-def hour_energy(h):
-    # heuristic energy factor (0..1)
-    if 9 <= h < 12: return 0.95
-    if 16 <= h < 20: return 0.92
-    if 6 <= h < 9: return 0.75
-    if 12 <= h < 16: return 0.78
-    if 20 <= h < 23: return 0.6
-    return 0.35
-
-def event_energy_score(row):
-    start_dt = datetime.combine(date.min, parse_time_str_safe(row["start"]))
-    end_dt = datetime.combine(date.min, parse_time_str_safe(row["end"]))
-    if end_dt <= start_dt: end_dt += timedelta(days=1)
-    t = start_dt
-    vals = []
-    while t < end_dt:
-        vals.append(hour_energy(t.hour))
-        t += timedelta(hours=1)
-    return float(np.mean(vals)) if vals else 0.0
-
-def burnout_score(events_df):
-    if events_df.empty:
-        return {"score": 0.2, "risk": "Bajo", "notes": "No hay datos."}
-    df = events_df.copy()
-    df["dur"] = df.apply(lambda r: dur_hours(r["start"], r["end"]), axis=1)
-    total_study = df[df["category"].isin(["Estudio","Tarea","Tesis","Clase","Proyecto TI","Investigación"])]["dur"].sum()
-    total_work = df[df["category"]=="Trabajo"]["dur"].sum()
-    sleep = df[df["category"]=="Sueño"]["dur"].sum()
-    desired_sleep = 7 * 7.0  # 49h/week -> 7h/night
-    sleep_factor = min(1.0, sleep / desired_sleep)
-    study_factor = min(1.0, total_study / 20.0)
-    work_factor = min(1.0, total_work / 30.0)
-    score = 0.5*(1 - sleep_factor) + 0.3*(study_factor) + 0.2*(work_factor)
-    score = float(max(0.0, min(1.0, score)))
-    if score < 0.3: risk = "Bajo"
-    elif score < 0.6: risk = "Medio"
-    else: risk = "Alto"
-    notes = f"Semana: Estudio {total_study:.1f}h, Trabajo {total_work:.1f}h, Sueño {sleep:.1f}h."
-    return {"score": score, "risk": risk, "notes": notes}
-
 # ----------------------------
 # CRUD UI: add / edit / delete
 # ----------------------------
@@ -217,6 +124,8 @@ st.markdown("## 🗓️ Agenda — Crear / Editar / Eliminar")
 
 colA, colB = st.columns([2,1])
 with colA:
+    if st.session_state.get("conflict_flash"):
+        st.warning(st.session_state.pop("conflict_flash"))
     with st.form("add_event_form", clear_on_submit=False):
         title = st.text_input("Título", value="Estudiar")
         category = st.selectbox("Categoría", ["Estudio","Tarea","Clase","Tesis","Trabajo","Proyecto TI","Investigación","Deporte","Sueño","Ocio","Otro"])
@@ -226,61 +135,140 @@ with colA:
         fixed = st.checkbox("Evento fijo (no mover)", value=False)
         priority = st.selectbox("Prioridad", ["Baja","Media","Alta"])
         notes = st.text_area("Notas / Detalles", value="")
+        repeat_opts = {"No se repite": None, "Diario": "FREQ=DAILY", "Lunes a viernes": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR", "Semanal": "FREQ=WEEKLY"}
+        repeat = st.selectbox("Repetir", list(repeat_opts))
+        repeat_until = st.date_input("Repetir hasta", value=date.today() + timedelta(days=90))
+        reject_fixed = st.checkbox("Rechazar si choca con un evento fijo", value=False, key="add_reject_fixed")
         if st.form_submit_button("➕ Añadir a mi agenda"):
-            add_event(st.session_state.user["id"], title, category, str(date_ev), start_ev.strftime("%H:%M"), end_ev.strftime("%H:%M"), fixed, notes, priority)
-            st.success("Evento guardado.")
-            st.rerun()
+            # una serie se guarda como una sola fila con su regla (ver recurrence.py)
+            rrule = f"{repeat_opts[repeat]};UNTIL={repeat_until:%Y%m%d}" if repeat_opts[repeat] else None
+            try:
+                clashes = add_event(st.session_state.user["id"], title, category, str(date_ev), start_ev.strftime("%H:%M"), end_ev.strftime("%H:%M"), fixed, notes, priority,
+                                    rrule=rrule, reject_fixed_conflicts=reject_fixed)
+                if not clashes.empty:
+                    st.session_state.conflict_flash = f"Evento guardado, pero se solapa con: {describe_conflicts(clashes)}"
+                st.success("Evento guardado.")
+                st.rerun()
+            except ValueError as e:
+                st.error(f"No se pudo guardar: {e}")
 
 with colB:
     st.write("Eventos actuales (selecciona para editar o eliminar).")
-    events_df = get_events(st.session_state.user["id"])
-    if events_df.empty:
+    n_events = len(get_event_set(st.session_state.user["id"]))
+    if not n_events:
         st.info("Aún no tienes eventos; añade algunos para probar las funciones PRO.")
     else:
-        events_df["dur_h"] = events_df.apply(lambda r: dur_hours(r["start"], r["end"]), axis=1)
-        st.metric("Total horas (registradas)", f"{events_df['dur_h'].sum():.1f} h")
-        st.metric("Eventos registrados", len(events_df))
+        st.metric("Total horas (registradas)", f"{total_hours(st.session_state.user['id']):.1f} h")
+        st.metric("Eventos registrados", n_events)
+
+# Full-text search (título y notas)
+st.markdown("### 🔎 Buscar en la agenda")
+# fragmento: escribir en la búsqueda solo vuelve a ejecutar esta sección, no toda la página
+@st.fragment
+def _search_panel():
+    search_q = st.text_input("Palabras del título o las notas (p.ej. tesis Miraflores)", key="search_q")
+    if search_terms(search_q):
+        found = search_text(st.session_state.user["id"], search_q)
+        if found.empty:
+            st.info("Sin coincidencias.")
+        else:
+            st.caption(f"{len(found)} resultados (los más relevantes primero)")
+            for r in found.itertuples(index=False):
+                rep = " 🔁" if isinstance(r.rrule, str) else ""
+                extra = f" — {r.snippet}" if isinstance(r.snippet, str) and r.snippet.strip() else ""
+                st.markdown(f"- `{r.id}` **{r.date} {r.start}-{r.end}** · {r.title} ({r.category}){rep}{extra}")
+_search_panel()
 
 # Edit / delete panel
 st.markdown("### ✏️ Editar / Eliminar evento")
-events_df = get_events(st.session_state.user["id"])
-if not events_df.empty:
-    select_options = [0] + events_df["id"].tolist()
-    select_id = st.selectbox("Selecciona evento (id) para editar/eliminar", options=select_options, format_func=lambda x: ("-- ninguno --" if x==0 else f"{int(x)} - " + events_df[events_df["id"]==int(x)]["title"].iloc[0] if int(x) in events_df["id"].values else str(x)))
-    if select_id and select_id != 0:
-        row = events_df[events_df["id"]==int(select_id)].iloc[0]
-        col1, col2 = st.columns(2)
-        with col1:
-            new_title = st.text_input("Título", value=row["title"])
-            categories_list = ["Estudio","Tarea","Clase","Tesis","Trabajo","Proyecto TI","Investigación","Deporte","Sueño","Ocio","Otro"]
-            new_category = st.selectbox("Categoría", categories_list, index=categories_list.index(row["category"]) if row["category"] in categories_list else 0)
-            new_priority = st.selectbox("Prioridad", ["Baja","Media","Alta"], index=["Baja","Media","Alta"].index(row["priority"]) if row["priority"] in ["Baja","Media","Alta"] else 1)
-        with col2:
-            # safe parse start/end
-            try:
-                parsed_start = parse_time_str_safe(row["start"])
-            except:
-                parsed_start = time(18,0)
-            try:
-                parsed_end = parse_time_str_safe(row["end"])
-            except:
-                parsed_end = time(19,30)
-            new_date = st.date_input("Fecha", value=pd.to_datetime(row["date"]).date())
-            new_start = st.time_input("Inicio", value=parsed_start)
-            new_end = st.time_input("Fin", value=parsed_end)
-            new_fixed = st.checkbox("Fijo (no mover)", value=bool(int(row["fixed"]) if pd.notna(row["fixed"]) else False))
-            new_notes = st.text_area("Notas", value=row["notes"] or "")
-        if st.button("💾 Guardar cambios"):
-            update_event(int(select_id), new_title, new_category, str(new_date), new_start.strftime("%H:%M"), new_end.strftime("%H:%M"), 1 if new_fixed else 0, new_notes, new_priority)
-            st.success("Evento actualizado.")
+# filtros y páginas en SQL (db.search_events): no se carga la agenda entera
+# fragmento: filtros, páginas y el formulario de edición no rehacen la página entera;
+# las escrituras terminan en st.rerun() (toda la app) para refrescar métricas y gráficos
+@st.fragment
+def _edit_panel():
+    f_text, f_cats, f_range = st.columns([2,2,2])
+    edit_text = f_text.text_input("Buscar en título o notas", key="edit_text")
+    edit_cats = f_cats.multiselect("Categorías", get_event_categories(st.session_state.user["id"]), key="edit_cats")
+    edit_range = f_range.date_input("Rango de fechas", value=(), key="edit_range")
+    edit_from = edit_range[0] if len(edit_range) > 0 else None
+    edit_to = edit_range[1] if len(edit_range) > 1 else None
+    edit_filters = (edit_text, tuple(edit_cats), edit_from, edit_to)
+    if st.session_state.get("edit_filters") != edit_filters:
+        st.session_state.edit_filters = edit_filters
+        st.session_state.edit_cursors = [None]   # cursor de inicio de cada página visitada
+    edit_total = count_events(st.session_state.user["id"], edit_from, edit_to, edit_cats, edit_text)
+    edit_page, edit_next = search_events(st.session_state.user["id"], edit_from, edit_to, edit_cats, edit_text,
+                                         after=st.session_state.edit_cursors[-1])
+    if not edit_page and len(st.session_state.edit_cursors) > 1:
+        st.session_state.edit_cursors = [None]   # la última página se vació (p.ej. tras eliminar)
+        st.rerun()
+    if edit_page:
+        n_page = len(st.session_state.edit_cursors)
+        p_prev, p_info, p_next = st.columns([1,3,1])
+        if p_prev.button("◀ Anterior", disabled=n_page == 1):
+            st.session_state.edit_cursors.pop()
             st.rerun()
-
-        if st.button("🗑 Eliminar evento"):
-            delete_event(int(select_id))
-            st.warning("Evento eliminado.")
+        p_info.caption(f"Página {n_page} · {edit_total} eventos")
+        if p_next.button("Siguiente ▶", disabled=edit_next is None):
+            st.session_state.edit_cursors.append(edit_next)
             st.rerun()
-else:
-    st.info("No hay eventos para editar.")
+        select_options = [0] + list(edit_page)
+        select_id = st.selectbox("Selecciona evento (id) para editar/eliminar", options=select_options,
+                                 format_func=lambda x: "-- ninguno --" if x==0 else f"{x} - {edit_page[x]['date']} {edit_page[x]['start']} · {edit_page[x]['title']}")
+        if select_id and select_id != 0:
+            row = edit_page[select_id]
+            col1, col2 = st.columns(2)
+            with col1:
+                new_title = st.text_input("Título", value=row["title"])
+                categories_list = ["Estudio","Tarea","Clase","Tesis","Trabajo","Proyecto TI","Investigación","Deporte","Sueño","Ocio","Otro"]
+                new_category = st.selectbox("Categoría", categories_list, index=categories_list.index(row["category"]) if row["category"] in categories_list else 0)
+                new_priority = st.selectbox("Prioridad", ["Baja","Media","Alta"], index=["Baja","Media","Alta"].index(row["priority"]) if row["priority"] in ["Baja","Media","Alta"] else 1)
+            with col2:
+                # safe parse start/end
+                try:
+                    parsed_start = parse_time_str_safe(row["start"])
+                except:
+                    parsed_start = time(18,0)
+                try:
+                    parsed_end = parse_time_str_safe(row["end"])
+                except:
+                    parsed_end = time(19,30)
+                new_date = st.date_input("Fecha", value=pd.to_datetime(row["date"]).date())
+                new_start = st.time_input("Inicio", value=parsed_start)
+                new_end = st.time_input("Fin", value=parsed_end)
+                new_fixed = st.checkbox("Fijo (no mover)", value=bool(int(row["fixed"]) if pd.notna(row["fixed"]) else False))
+                new_notes = st.text_area("Notas", value=row["notes"] or "")
+                new_rrule = st.text_input("Repetición (RRULE, vacío = no se repite)", value=row["rrule"] if isinstance(row.get("rrule"), str) else "")
+                new_exdates = st.text_input("Fechas excluidas (YYYY-MM-DD, separadas por coma)", value=row["exdates"] if isinstance(row.get("exdates"), str) else "")
+                edit_reject_fixed = st.checkbox("Rechazar si choca con un evento fijo", value=False, key="edit_reject_fixed")
+            if st.button("💾 Guardar cambios"):
+                try:
+                    clashes = update_event(int(select_id), new_title, new_category, str(new_date), new_start.strftime("%H:%M"), new_end.strftime("%H:%M"), 1 if new_fixed else 0, new_notes, new_priority,
+                                           rrule=new_rrule, exdates=new_exdates, reject_fixed_conflicts=edit_reject_fixed)
+                    if clashes is not None and not clashes.empty:
+                        st.session_state.conflict_flash = f"Evento actualizado, pero se solapa con: {describe_conflicts(clashes)}"
+                    st.success("Evento actualizado.")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"No se pudo actualizar: {e}")
+
+            if isinstance(row.get("rrule"), str):
+                c_skip, c_skip_btn = st.columns([2,1])
+                skip_date = c_skip.date_input("Quitar una ocurrencia de la serie", value=date.today())
+                if c_skip_btn.button("➖ Quitar ocurrencia"):
+                    skip_occurrence(int(select_id), skip_date)
+                    st.success(f"Ocurrencia del {skip_date} eliminada de la serie.")
+                    st.rerun()
+
+            if st.button("🗑 Eliminar evento"):
+                delete_event(int(select_id))
+                st.warning("Evento eliminado.")
+                st.rerun()
+    elif any((edit_text, edit_cats, edit_from, edit_to)):
+        st.info("Ningún evento coincide con los filtros.")
+    else:
+        st.info("No hay eventos para editar.")
+_edit_panel()
 
 # ----------------------------
 # Calendar Week View
@@ -291,218 +279,236 @@ week_start = st.date_input(
     "📅 Selecciona semana (Elige el Lunes)",
     value=(date.today() - timedelta(days=date.today().weekday()))
 )
-week_days = [week_start + timedelta(days=i) for i in range(7)]
+timeline_modes = {"Automática": None, "Por actividad": False, "Compacta (por categoría)": True}
+timeline_mode = st.selectbox("Vista del timeline", list(timeline_modes))
 
-events_week = get_events(st.session_state.user["id"])
+# la figura se cachea por (usuario, semana, versión de la agenda): ver charts.py
+fig, n_week = week_figure(st.session_state.user["id"], week_start, compact=timeline_modes[timeline_mode])
+if n_week == 0:
+    st.warning("📌 No hay eventos programados para esta semana.")
+else:
+    st.plotly_chart(fig, use_container_width=True)
 
-if not events_week.empty:
-    events_week["date_dt"] = pd.to_datetime(events_week["date"], errors="coerce").dt.date
-    evw = events_week[events_week["date_dt"].isin(week_days)].copy()
-    if evw.empty:
-        st.warning("📌 No hay eventos programados para esta semana.")
+# ----------------------------
+# Group free slots (mapas de ocupación, ver freebusy.py)
+# ----------------------------
+st.markdown("## 👥 Huecos libres en común (grupos de estudio / tesis)")
+
+@st.fragment
+def _group_free_panel():
+    me = st.session_state.user["id"]
+    shared = shares_freebusy(me)
+    if st.checkbox("Compartir mi disponibilidad (solo libre/ocupado) con otros usuarios", value=shared, key="group_share") != shared:
+        set_share_freebusy(me, not shared)
+    # solo yo y quienes comparten su disponibilidad
+    usernames = group_candidates(me)
+    g_users, g_days = st.columns([3,1])
+    members = g_users.multiselect("Integrantes", list(usernames), default=[me], format_func=lambda u: usernames.get(u, str(u)),
+                                  max_selections=GROUP_MAX_USERS, key="group_members")
+    n_days = g_days.number_input("Días desde la semana elegida", min_value=1, max_value=GROUP_MAX_DAYS, value=7, key="group_days")
+    g_len, g_from, g_to = st.columns(3)
+    min_len = g_len.number_input("Duración mínima (min)", min_value=SLOT_MINUTES, max_value=720, value=60, step=SLOT_MINUTES, key="group_min")
+    day_from = g_from.time_input("Desde", value=time(8,0), step=timedelta(minutes=SLOT_MINUTES), key="group_from")
+    day_to = g_to.time_input("Hasta", value=time(22,0), step=timedelta(minutes=SLOT_MINUTES), key="group_to")
+    if not members:
+        st.info("Elige al menos un integrante.")
+        return
+    try:
+        free = common_free_slots(me, members, week_start, week_start + timedelta(days=int(n_days) - 1), min_len,
+                                 day_from.strftime("%H:%M"), day_to.strftime("%H:%M"))
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if free.empty:
+        st.warning("No hay ningún hueco común con esas condiciones.")
     else:
-        def to_dt(row):
-            d = row["date_dt"]
-            s = parse_time_str_safe(row["start"])
-            e = parse_time_str_safe(row["end"])
-            start_dt = datetime.combine(d, s)
-            end_dt = datetime.combine(d, e)
-            if end_dt <= start_dt:
-                end_dt += timedelta(days=1)
-            return start_dt, end_dt
-
-        evw["start_dt"], evw["end_dt"] = zip(*evw.apply(lambda r: to_dt(r), axis=1))
-        if "notes" not in evw.columns:
-            evw["notes"] = ""
-        fig = px.timeline(
-            evw,
-            x_start="start_dt",
-            x_end="end_dt",
-            y="title",
-            color="category",
-            hover_data={"notes": True, "date": True, "start": True, "end": True}
-        )
-        fig.update_layout(title="🧠 Distribución semanal de actividades")
-        fig.update_yaxes(title="Actividad", autorange="reversed")
-        st.plotly_chart(fig, use_container_width=True)
-else:
-    st.info("⏳ Aún no tienes actividades registradas. Agrega una arriba para comenzar.")
+        st.caption(f"{len(free)} huecos libres para todos los integrantes ({len(members)}); en cuartos de hora completos, series incluidas.")
+        st.dataframe(free.rename(columns={"date": "Fecha", "start": "Inicio", "end": "Fin", "minutes": "Minutos"}),
+                     use_container_width=True, hide_index=True)
+_group_free_panel()
 
 # ----------------------------
 # Optimizer: local + Gemini (optional)
 # ----------------------------
 st.markdown("## 🤖 Optimización y Recomendaciones")
 
-def local_optimizer_impl(user_id, goals_text="", block_hours=1.5):
-    df = get_events(user_id)
-    if df.empty:
-        return {"suggestions": [], "study_blocks": [], "target_week": 12.0, "existing_study": 0.0}
-    df["dur_h"] = df.apply(lambda r: dur_hours(r["start"], r["end"]), axis=1)
-    df["energy"] = df.apply(lambda r: event_energy_score(r), axis=1)
-    suggestions = []
-    low = df[(df["fixed"]==0) & (df["energy"]<0.6)].sort_values("energy")
-    for _, r in low.iterrows():
-        d = pd.to_datetime(r["date"]).date()
-        day_ev = df[pd.to_datetime(df["date"]).dt.date==d]
-        busy = []
-        for _, b in day_ev.iterrows():
-            busy.append((parse_time_str_safe(b["start"]), parse_time_str_safe(b["end"])))
-        dur_min = int(r["dur_h"]*60)
-        candidates=[]
-        for hour in range(6,22):
-            a = time(hour,0)
-            btime = (datetime.combine(date.min,a)+timedelta(minutes=dur_min)).time()
-            sa = datetime.combine(date.min,a); sb = datetime.combine(date.min,btime)
-            overlaps=False
-            for (x,y) in busy:
-                xa = datetime.combine(date.min,x); yb = datetime.combine(date.min,y)
-                if not (sb <= xa or sa >= yb):
-                    overlaps=True; break
-            if not overlaps:
-                t=sa; vals=[]
-                while t<sb:
-                    vals.append(hour_energy(t.hour)); t+=timedelta(minutes=30)
-                avg = np.mean(vals) if vals else 0
-                candidates.append((a,btime,avg))
-        for a,btime,avg in sorted(candidates, key=lambda x:-x[2]):
-            if avg >= r["energy"] + 0.15:
-                suggestions.append({"event_id": r["id"], "from": f"{r['date']} {r['start']}-{r['end']}", "to": f"{d} {a.strftime('%H:%M')}-{btime.strftime('%H:%M')}", "reason": f"Mejor energía ({avg:.2f} vs {r['energy']:.2f})"})
-                break
-    total_study = df[df["category"].isin(["Estudio","Tarea","Tesis","Clase","Investigación","Proyecto TI"])]["dur_h"].sum()
-    target_week = max(12.0, total_study)
-    remaining = max(0.0, target_week - total_study)
-    study_blocks = []
-    if remaining > 0:
-        today = date.today()
-        for i in range(7):
-            if remaining <= 0: break
-            d = today + timedelta(days=i)
-            day_ev = df[pd.to_datetime(df["date"]).dt.date==d]
-            busy=[]
-            for _,b in day_ev.iterrows(): busy.append((parse_time_str_safe(b["start"]), parse_time_str_safe(b["end"])))
-            for hour in range(18,22):
-                a = time(hour,0)
-                btime = (datetime.combine(date.min,a)+timedelta(minutes=int(block_hours*60))).time()
-                sa = datetime.combine(date.min,a); sb = datetime.combine(date.min,btime)
-                conflict=False
-                for x,y in busy:
-                    if not (sb <= datetime.combine(date.min,x) or sa >= datetime.combine(date.min,y)):
-                        conflict=True; break
-                if not conflict:
-                    t=sa; vals=[]
-                    while t<sb:
-                        vals.append(hour_energy(t.hour)); t+=timedelta(minutes=30)
-                    avg = np.mean(vals) if vals else 0
-                    if avg >= 0.6:
-                        study_blocks.append({"date":d,"start":a.strftime("%H:%M"),"end":btime.strftime("%H:%M"),"avg_energy":avg})
-                        remaining -= block_hours
-                        break
-    return {"suggestions": suggestions, "study_blocks": study_blocks, "target_week": target_week, "existing_study": total_study}
-
-col_opt1, col_opt2 = st.columns([3,1])
-with col_opt1:
-    goals = st.text_area("Objetivos / restricciones (p.ej. 'mantener trabajo, dormir 7h, aumentar estudio a 15h/sem')", height=100)
-    if st.button("🔎 Generar optimización (local + Gemini si disponible)"):
-        try:
-            result = local_optimizer_impl(st.session_state.user["id"], goals_text=goals)
-        except Exception as e:
-            st.error(f"Error ejecutando optimizador local: {e}")
-            result = {"suggestions": [], "study_blocks": [], "target_week": 12.0, "existing_study": 0.0}
-
-        if result["suggestions"]:
-            st.markdown("### ✅ Sugerencias de reubicación de eventos flexibles")
-            for s in result["suggestions"]:
-                st.markdown(f"- Evento {s['event_id']}: mover **{s['from']}** → **{s['to']}** ({s['reason']})")
-        else:
-            st.info("No hay sugerencias de reubicación de eventos flexibles (o no se encontró ventana mejor).")
+# fragmento: escribir los objetivos o cambiar el modo no rehace la vista semanal
+@st.fragment
+def _optimization_panel():
+    col_opt1, col_opt2 = st.columns([3,1])
+    with col_opt1:
+        goals = st.text_area("Objetivos / restricciones (p.ej. 'mantener trabajo, dormir 7h, aumentar estudio a 15h/sem')", height=100)
+        opt_modes = {"Rápido (greedy)": "greedy", "Búsqueda local (recocido simulado)": "anneal", "Exacto (semanas pequeñas)": "exact"}
+        c_mode, c_budget = st.columns([2,1])
+        opt_mode = c_mode.selectbox("Modo de optimización", list(opt_modes))
+        opt_budget = c_budget.number_input("Tiempo máximo (s)", min_value=0.5, max_value=30.0, value=2.0, step=0.5)
+        if st.button("🔎 Generar optimización (local + Gemini si disponible)"):
+            # se ejecuta en segundo plano: el plan sobrevive a los reruns (p.ej. al añadir bloques)
+            st.session_state.opt_job = submit_optimization(st.session_state.user["id"], goals_text=goals, mode=opt_modes[opt_mode], time_budget=opt_budget)
+
+        job = get_job(st.session_state.get("opt_job"))
+        if job is not None and job.user_id != st.session_state.user["id"]:
+            job = None
+        if job is not None and not job.finished:
+            @st.fragment(run_every=1.0)
+            def _optimization_progress():
+                j = get_job(job.id)
+                if j is None or j.finished:
+                    st.rerun()
+                st.progress(j.progress, text=f"Optimizando… {j.message}")
+                if st.button("⏹ Cancelar optimización"):
+                    cancel_job(j.id)
+            _optimization_progress()
+        elif job is not None:
+            result = job.result or {"suggestions": [], "study_blocks": [], "target_week": 12.0, "existing_study": 0.0}
+            if job.status == "error":
+                st.error(f"Error ejecutando optimizador local: {job.error}")
+            elif job.status == "cancelled":
+                st.warning("Optimización cancelada: se muestra el mejor plan encontrado hasta ese momento.")
+            stale = job.is_stale()
+            if stale:
+                st.warning("Tu agenda cambió desde que se calculó este plan; vuelve a generar la optimización.")
+            if "objective" in result:
+                st.caption(f"Puntaje semanal (prioridad × horas × energía): {result['objective']:.1f}" + (" — óptimo" if result["optimal"] else ""))
+
+            if result["suggestions"]:
+                st.markdown("### ✅ Sugerencias de reubicación de eventos flexibles")
+                for s in result["suggestions"]:
+                    st.markdown(f"- Evento {s['event_id']}: mover **{s['from']}** → **{s['to']}** ({s['reason']})")
+                if st.button("↪️ Aplicar reubicaciones sugeridas", disabled=stale):
+                    for s in result["suggestions"]:
+                        move_event(s["event_id"], str(s["date"]), s["start"], s["end"])
+                    st.session_state.opt_job = None
+                    st.success("Eventos reubicados.")
+                    st.rerun()
+            else:
+                st.info("No hay sugerencias de reubicación de eventos flexibles (o no se encontró ventana mejor).")
 
-        if result["study_blocks"]:
-            st.markdown("### 📚 Bloques de estudio sugeridos")
-            for b in result["study_blocks"]:
-                st.markdown(f"- {b['date']} {b['start']}–{b['end']} (energía ~ {b['avg_energy']:.2f})")
-            if st.button("➕ Añadir bloques sugeridos a la agenda"):
+            if result["study_blocks"]:
+                st.markdown("### 📚 Bloques de estudio sugeridos")
                 for b in result["study_blocks"]:
-                    add_event(st.session_state.user["id"], "Bloque de estudio (sugerido)", "Estudio", str(b["date"]), b["start"], b["end"], 0, "Sugerido por optimizador local", "Media")
-                st.success("Bloques añadidos a la agenda.")
-                st.rerun()
-        else:
-            st.info("No hay bloques sugeridos para añadir.")
+                    st.markdown(f"- {b['date']} {b['start']}–{b['end']} (energía ~ {b['avg_energy']:.2f})")
+                if st.button("➕ Añadir bloques sugeridos a la agenda", disabled=stale):
+                    add_events_bulk(st.session_state.user["id"], [
+                        {"title": "Bloque de estudio (sugerido)", "category": "Estudio", "date": b["date"], "start": b["start"], "end": b["end"],
+                         "fixed": 0, "notes": "Sugerido por optimizador local", "priority": "Media"}
+                        for b in result["study_blocks"]])
+                    st.session_state.opt_job = None
+                    st.success("Bloques añadidos a la agenda.")
+                    st.rerun()
+            else:
+                st.info("No hay bloques sugeridos para añadir.")
 
-with col_opt2:
-    st.markdown("### AI / Gemini")
-    gem_text = "(Gemini no configurado)"
-    if os.environ.get("GEMINI_API_KEY"):
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-            gem_text = "Gemini configurado. Se usará para consultas más avanzadas."
-        except Exception as e:
-            gem_text = f"Gemini detectado pero error: {e}"
-    st.info(gem_text)
-
-    if st.button("🔁 Ejecutar análisis avanzado (Gemini)"):
-        if not os.environ.get("GEMINI_API_KEY"):
-            st.error("GEMINI_API_KEY no configurada en el entorno.")
-        else:
-            df = get_events(st.session_state.user["id"])
-            schedule_text = df.to_string(index=False)
-            prompt = textwrap.dedent(f"""
-            Eres un asistente experto en productividad para estudiantes universitarios de carreras TIC.
-            Analiza la siguiente agenda y los objetivos:
-            AGENDA:
-            {schedule_text}
-
-            OBJETIVOS:
-            {goals}
-
-            Devuelve: diagnóstico (breve), riesgos de burnout, recomendaciones priorizadas y un calendario alternativo de bloques (formato tabla).
-            """)
+    with col_opt2:
+        st.markdown("### AI / Gemini")
+        # resumen compacto + llamada en segundo plano con caché (ver llm.py)
+        llm_backend = backend_name()
+        st.info({"gemini": "Gemini configurado. Se usará para consultas más avanzadas.",
+                 "stub": "Backend de prueba (stub): respuestas locales, sin red."}.get(llm_backend, "(Gemini no configurado)"))
+
+        if st.button("🔁 Ejecutar análisis avanzado (Gemini)"):
             try:
-                import google.generativeai as genai
-                genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
-                resp = genai.generate_text(model="models/gemini-2.5-flash", prompt=prompt, max_output_tokens=600)
-                text = getattr(resp, "text", None) or getattr(resp, "output_text", None) or str(resp)
-                st.subheader("Respuesta (Gemini)")
-                st.write(text)
-            except Exception as e:
-                st.error(f"Error llamando a Gemini: {e}")
+                st.session_state.llm_req = submit_analysis(st.session_state.user["id"], goals)
+            except LLMRateLimited as e:
+                st.warning(f"Demasiadas solicitudes: {e}.")
+            except RuntimeError as e:
+                st.error(str(e))
+
+        analysis = get_analysis(st.session_state.get("llm_req"))
+        if analysis is not None and not analysis.finished:
+            @st.fragment(run_every=1.0)
+            def _analysis_progress():
+                a = get_analysis(analysis.key)
+                if a is None or a.finished:
+                    st.rerun()
+                st.caption("⏳ Analizando agenda…")
+            _analysis_progress()
+        elif analysis is not None:
+            if analysis.status == "error":
+                st.error(f"Error llamando a Gemini: {analysis.error}")
+            else:
+                st.subheader("Respuesta (Gemini)" if analysis.backend == "gemini" else "Respuesta (stub)")
+                if analysis.hits:
+                    st.caption("Respuesta reutilizada (misma agenda y objetivos).")
+                st.write(analysis.text)
+_optimization_panel()
 
 # ----------------------------
 # Burnout & indicators
 # ----------------------------
 st.markdown("## 🩺 Indicadores de carga y riesgo")
 
-events_all = get_events(st.session_state.user["id"])
-burn = burnout_score(events_all)
+# el riesgo se calcula sobre la semana seleccionada (agregados de week_load)
+burn = burnout_from_load(week_hours(st.session_state.user["id"], week_start))
 st.metric("Riesgo de burnout", burn["risk"], delta=f"{burn['score']*100:.0f}%")
 st.write(burn["notes"])
+nightly = latest_batch_result(st.session_state.user["id"])
+if nightly is not None:
+    # calculado por batch.py (lote nocturno); aquí solo se lee
+    res, sugg = nightly
+    with st.expander(f"🌙 Informe nocturno del {res['run_date']}"):
+        if res["error"]:
+            st.error(f"El lote falló para tu usuario: {res['error']}")
+        else:
+            st.write(f"Riesgo: **{res['risk']}** ({res['score']*100:.0f}%) — {res['notes']}")
+            st.write(f"Estudio en la semana: {res['existing_study']:.1f}h de {res['target_week']:.1f}h objetivo.")
+            if not sugg.empty:
+                st.dataframe(sugg, use_container_width=True)
+with st.expander("📈 Tendencia de carga (últimas 8 semanas)"):
+    trend = load_trend(st.session_state.user["id"], until=week_start, weeks=8)
+    st.line_chart(trend.rename(columns={"study": "Estudio", "work": "Trabajo", "sleep": "Sueño", "other": "Otros"}))
 
 # ----------------------------
 # Export (CSV / ICS)
 # ----------------------------
 st.markdown("## ⤓ Exportar / Compartir")
-if not events_all.empty:
-    csv_bytes = events_all.to_csv(index=False).encode("utf-8")
-    st.download_button("📥 Descargar CSV de agenda", data=csv_bytes, file_name="agenda.csv", mime="text/csv")
-    c = Calendar()
-    for _, ev in events_all.iterrows():
-        e = Event()
-        e.name = ev["title"]
-        start_dt = datetime.combine(pd.to_datetime(ev["date"]).date(), parse_time_str_safe(ev["start"]))
-        end_dt = datetime.combine(pd.to_datetime(ev["date"]).date(), parse_time_str_safe(ev["end"]))
-        if end_dt <= start_dt:
-            end_dt += timedelta(days=1)
-        e.begin = start_dt
-        e.end = end_dt
-        e.description = ev.get("notes","")
-        c.events.add(e)
-    st.download_button("📥 Descargar .ics (iCal)", data=str(c), file_name="agenda.ics", mime="text/calendar")
+export_categories = get_event_categories(st.session_state.user["id"])
+if export_categories:
+    c_range, c_cats = st.columns(2)
+    export_range = c_range.date_input("Rango de fechas (opcional)", value=(), key="export_range")
+    export_cats = c_cats.multiselect("Categorías (opcional)", export_categories, key="export_cats")
+    export_from, export_to = (export_range + (None, None))[:2] if len(export_range) else (None, None)
+    export_to = export_to or export_from
+    export_args = (st.session_state.user["id"], export_from, export_to, export_cats or None)
+    # se genera al hacer clic, por bloques desde el cursor SQL (sin DataFrame ni Calendar en memoria)
+    st.download_button("📥 Descargar CSV de agenda", data=lambda: IterStream(iter_csv(*export_args)), file_name="agenda.csv", mime="text/csv")
+    st.download_button("📥 Descargar .ics (iCal)", data=lambda: IterStream(iter_ics(*export_args)), file_name="agenda.ics", mime="text/calendar")
+    if FEED_PORT:
+        # suscripción: el calendario externo consulta la URL y recibe 304 si no hubo cambios
+        st.caption("Suscríbete desde Google Calendar / Outlook / Apple Calendar con esta URL (privada):")
+        st.code(feed_url(get_feed_key(st.session_state.user["id"])), language=None)
+        if st.button("Regenerar enlace", help="La URL anterior deja de funcionar."):
+            get_feed_key(st.session_state.user["id"], rotate=True)
+            st.rerun()
 else:
     st.info("No hay eventos para exportar.")
 
+with st.expander("⤒ Importar eventos (CSV / ICS)"):
+    st.caption("Acepta el mismo CSV que se exporta arriba (las columnas id/user_id se ignoran) o un archivo .ics.")
+    up = st.file_uploader("Archivo", type=["csv", "ics"])
+    if up is not None and st.button("Importar a mi agenda"):
+        try:
+            n = import_events(st.session_state.user["id"], up.name, up.getvalue())
+            st.success(f"{n} eventos importados.")
+            st.rerun()
+        except ValueError as e:
+            st.error(f"No se pudo importar: {e}")
+
 # ----------------------------
 # Footer / help
 # ----------------------------
 st.markdown("---")
 st.caption("PRO: Este prototipo se puede extender: integración OAuth Google Calendar, notificaciones push, reconcilación de disponibilidad docentes, o versión multiusuario con roles.")
 
+# ----------------------------
+# Debug: perfil del rerun
+# ----------------------------
+perf = end_rerun()
+if perf is not None and (DEBUG_PANEL or st.query_params.get("debug") == "1"):
+    with st.sidebar.expander("⏱️ Perfil del rerun"):
+        st.write(f"{perf.queries} consultas SQL ({perf.query_seconds*1000:.0f} ms), {perf.fetched_rows()} filas leídas de la base, "
+                 f"{perf.slow_queries} consultas lentas.")
+        st.dataframe(pd.DataFrame(rerun_table(perf)), use_container_width=True)
+        st.caption("Imports en frío de este proceso (primer uso):")
+        st.dataframe(pd.DataFrame(import_table()), use_container_width=True)
+        st.download_button("Métricas del proceso (Prometheus)", prometheus_text(), file_name="agenda_metrics.prom", mime="text/plain")
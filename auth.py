@@ -0,0 +1,130 @@
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from instrumentation import timed
+from users import add_user, get_user_by_name, set_password_hash
+
+# ----------------------------
+# Password hashing (scrypt)
+# ----------------------------
+# Formato guardado en users.password: scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>.
+# El coste se ajusta por entorno; los hashes viejos con otro coste se rehacen
+# al iniciar sesión, igual que las contraseñas en texto plano heredadas.
+SCRYPT_N = int(os.environ.get("AGENDA_SCRYPT_N", str(2**14)))
+SCRYPT_R = int(os.environ.get("AGENDA_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("AGENDA_SCRYPT_P", "1"))
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * r * n, dklen=HASH_BYTES)
+
+def hash_password(password):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+def verify_password(password, stored):
+    """(ok, needs_rehash): stored is a scrypt$ hash or a legacy plaintext password."""
+    stored = stored or ""
+    if not stored.startswith("scrypt$"):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8")), True
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        ok = hmac.compare_digest(_scrypt(password, base64.b64decode(salt), n, r, p), base64.b64decode(digest))
+    except (ValueError, TypeError):
+        return False, False
+    return ok, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+# usuario inexistente: se verifica igual contra un hash fijo para no delatar
+# por tiempo de respuesta qué nombres existen (se calcula al primer uso, no al importar)
+@functools.lru_cache(maxsize=1)
+def _dummy_hash():
+    return hash_password(secrets.token_hex(8))
+
+# ----------------------------
+# Login (rate limit + pool de verificación)
+# ----------------------------
+# scrypt es caro a propósito: se ejecuta en un pool pequeño (libera el GIL),
+# así una ráfaga de logins encola ahí en vez de frenar los reruns de las
+# demás sesiones. Los fallos por usuario se limitan con una ventana deslizante.
+AUTH_WORKERS = int(os.environ.get("AGENDA_AUTH_WORKERS", "2"))
+AUTH_TIMEOUT = 10.0
+LOGIN_MAX_FAILURES = 5
+LOGIN_WINDOW = 300.0   # segundos
+
+class LoginRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"demasiados intentos; vuelve a intentar en {int(retry_after) + 1} s")
+        self.retry_after = retry_after
+
+_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+_failures_lock = threading.Lock()
+_failures = {}   # username -> deque de timestamps de intentos fallidos
+
+def _check_rate(username, now):
+    with _failures_lock:
+        q = _failures.get(username)
+        if q is None:
+            return
+        while q and now - q[0] > LOGIN_WINDOW:
+            q.popleft()
+        if not q:
+            del _failures[username]
+        elif len(q) >= LOGIN_MAX_FAILURES:
+            raise LoginRateLimited(LOGIN_WINDOW - (now - q[0]))
+
+def _record_failure(username, now):
+    with _failures_lock:
+        _failures.setdefault(username, deque()).append(now)
+
+def _verify_user(username, password):
+    user = get_user_by_name(username)
+    ok, needs_rehash = verify_password(password, user["password"] if user else _dummy_hash())
+    if not user or not ok:
+        return None
+    if needs_rehash:
+        # texto plano heredado (o coste viejo): se guarda el hash nuevo
+        set_password_hash(user["id"], hash_password(password))
+    user.pop("password", None)
+    return user
+
+def _submit(fn, *args):
+    try:
+        return _executor.submit(fn, *args).result(timeout=AUTH_TIMEOUT)
+    except FutureTimeout:
+        raise LoginRateLimited(AUTH_TIMEOUT)
+
+@timed("auth.authenticate")
+def authenticate(username, password):
+    """User dict (without password) or None; raises LoginRateLimited after repeated failures."""
+    username = (username or "").strip()
+    now = time.monotonic()
+    _check_rate(username, now)
+    user = _submit(_verify_user, username, password or "")
+    if user is None:
+        _record_failure(username, now)
+    return user
+
+def create_user(username, password):
+    """Store a new user with a hashed password; False if the username is taken."""
+    return add_user(username.strip(), _submit(hash_password, password))
+
+DEMO_USER = ("estudiante", "1234")
+
+def seed_demo_user():
+    # idempotente; se llama una vez al arrancar, no en cada rerun
+    if get_user_by_name(DEMO_USER[0]) is None:
+        add_user(DEMO_USER[0], hash_password(DEMO_USER[1]))
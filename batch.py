@@ -0,0 +1,86 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from aggregates import week_start
+from db import batch_report, get_all_events_range, get_user_ids, init_db, save_batch_run
+from eventset import EventSet
+from metrics import STUDY_CATEGORIES, burnout_score
+from optimizer import HORIZON_DAYS, TIME_BUDGET, optimize_schedule
+from storage import engine
+
+# ----------------------------
+# Lote nocturno: optimizador + burnout para todos los usuarios
+# ----------------------------
+# Uso (p.ej. cron del lunes 05:00):
+#   python batch.py [--date 2025-12-01] [--mode greedy] [--workers 4]
+# Lee los eventos de todos en una sola consulta, reparte por usuario en un
+# pool de procesos (el optimizador es CPU puro) y guarda riesgo y sugerencias
+# en batch_runs / batch_results / batch_suggestions; la UI solo los lee.
+
+def _worker_init():
+    # tras el fork, las conexiones heredadas del padre no se usan en el hijo
+    engine.dispose(close=False)
+
+def _run_user(args):
+    user_id, events, today, mode, time_budget = args
+    ws = week_start(today)
+    out = {"user_id": user_id, "week_start": ws.isoformat(), "suggestions": []}
+    try:
+        week = events.window(ws, ws + timedelta(days=6))
+        burn = burnout_score(week)
+        study = week.hours(week.category_mask(STUDY_CATEGORIES))
+        horizon = events.window(today - timedelta(days=1), today + timedelta(days=HORIZON_DAYS - 1))
+        res = optimize_schedule(horizon, today=today, mode=mode, time_budget=time_budget, existing_study=study)
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+        return out
+    out.update(score=burn["score"], risk=burn["risk"], notes=burn["notes"], existing_study=res["existing_study"],
+               target_week=res["target_week"], objective=float(res["objective"]))
+    out["suggestions"] = (
+        [{"kind": "move", "event_id": s["event_id"], "date": str(s["date"]), "start": s["start"], "end": s["end"], "detail": s["reason"]}
+         for s in res["suggestions"]]
+        + [{"kind": "block", "event_id": None, "date": str(b["date"]), "start": b["start"], "end": b["end"], "detail": f"energía {b['avg_energy']:.2f}"}
+           for b in res["study_blocks"]])
+    return out
+
+def run_batch(today=None, mode="greedy", workers=None, time_budget=TIME_BUDGET):
+    """Optimize + score every user; returns (run_id, results)."""
+    today = today or date.today()
+    started = datetime.now().isoformat(timespec="seconds")
+    ws = week_start(today)
+    first = min(ws, today - timedelta(days=1))
+    last = max(ws + timedelta(days=6), today + timedelta(days=HORIZON_DAYS - 1))
+    events = get_all_events_range(first, last)   # una consulta para todos, no N get_events
+    # EventSet por usuario: arrays compactos que se serializan baratos hacia los procesos
+    groups = {uid: EventSet.from_frame(g) for uid, g in events.groupby("user_id", sort=False)}
+    empty = EventSet.empty()
+    tasks = [(uid, groups.get(uid, empty), today, mode, time_budget) for uid in get_user_ids()]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_run_user(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+            results = list(pool.map(_run_user, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    return save_batch_run(today, mode, started, results), results
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Optimización y riesgo de burnout para todos los estudiantes.")
+    p.add_argument("--date", type=date.fromisoformat, default=None, help="día de referencia (YYYY-MM-DD, por defecto hoy)")
+    p.add_argument("--mode", choices=["greedy", "anneal", "exact"], default="greedy")
+    p.add_argument("--workers", type=int, default=None, help="procesos (por defecto, núcleos de la CPU)")
+    p.add_argument("--budget", type=float, default=TIME_BUDGET, help="segundos máximos por usuario")
+    p.add_argument("--top", type=int, default=20, help="filas del informe")
+    args = p.parse_args(argv)
+    init_db()
+    run_id, results = run_batch(args.date, args.mode, args.workers, args.budget)
+    report = batch_report(run_id)
+    print(f"📌 Lote {run_id}: {len(results)} usuarios, {int(report['error'].notna().sum())} con error.")
+    with pd.option_context("display.width", 160):
+        print(report.head(args.top).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# la base del benchmark es temporal salvo que se indique AGENDA_DB_URL:
+# tiene que fijarse antes de importar storage (crea el engine al importarse)
+if "AGENDA_DB_URL" not in os.environ:
+    os.environ["AGENDA_DB_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='agenda-bench-'), 'bench.db')}"
+
+import pandas as pd
+
+import charts
+from agenda_io import iter_csv, iter_ics
+from aggregates import week_hours, week_start
+from datos_sinteticos import populate
+from freebusy import common_free_slots, set_share_freebusy
+from db import get_event_set, get_events, get_events_range, init_db, invalidate_events
+from metrics import burnout_from_load, burnout_score, dur_hours, durations_hours, energy_scores, event_energy_score
+from optimizer import local_optimizer_impl
+from storage import DATABASE_URL
+
+# ----------------------------
+# Benchmark de las rutas calientes
+# ----------------------------
+# Genera agendas sintéticas (datos_sinteticos.py) a varias escalas y mide
+# cada operación; el resultado es JSON para comparar contra una línea base:
+#   python benchmark.py --scales 1x1,1x6,1x24 --out bench.json
+#   python benchmark.py --compare bench.json --fail-above 1.25
+DEFAULT_SCALES = "1x1,1x6,1x24"   # usuarios x meses de historial
+
+def _timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"min_s": min(times), "median_s": statistics.median(times), "repeat": repeat}
+
+def _cold(uid, fn):
+    def run():
+        invalidate_events(uid)
+        return fn()
+    return run
+
+def _cold_import(modules):
+    # proceso nuevo: mide el arranque en frío (intérprete + imports), no la caché de sys.modules
+    here = os.path.dirname(os.path.abspath(__file__))
+    return lambda: subprocess.run([sys.executable, "-c", f"import {modules}"], cwd=here, check=True)
+
+def _operations(uid, ids, today, opt_budget):
+    df = get_events(uid)
+    ws = week_start(today)
+    week = get_events_range(uid, ws, ws + timedelta(days=6))
+    week_set = get_event_set(uid, ws, ws + timedelta(days=6))
+    def figure_build():
+        charts._fig_cache.clear()
+        charts.week_figure(uid, ws)
+    return df, [
+        ("get_events.cold", _cold(uid, lambda: get_events(uid))),
+        ("get_events.warm", lambda: get_events(uid)),
+        ("get_events_range.week.cold", _cold(uid, lambda: get_events_range(uid, ws, ws + timedelta(days=6)))),
+        ("get_event_set.week.cold", _cold(uid, lambda: get_event_set(uid, ws, ws + timedelta(days=6)))),
+        ("burnout_score.week.eventset", lambda: burnout_score(week_set)),
+        ("dur_hours.rowwise", lambda: df.apply(lambda r: dur_hours(r["start"], r["end"]), axis=1)),
+        ("durations_hours", lambda: durations_hours(df)),
+        ("event_energy_score.rowwise", lambda: df.apply(event_energy_score, axis=1)),
+        ("energy_scores", lambda: energy_scores(df)),
+        ("burnout_score.history", lambda: burnout_score(df)),
+        ("burnout_score.week", lambda: burnout_score(week)),
+        ("burnout_from_load.week", lambda: burnout_from_load(week_hours(uid, today))),
+        ("local_optimizer_impl.greedy", lambda: local_optimizer_impl(uid, mode="greedy", time_budget=opt_budget)),
+        ("week_figure.build", figure_build),
+        ("week_figure.cached", lambda: charts.week_figure(uid, ws)),
+        ("export.ics", lambda: b"".join(iter_ics(uid))),
+        ("export.csv", lambda: b"".join(iter_csv(uid))),
+        ("common_free_slots.month", lambda: common_free_slots(uid, ids, ws, ws + timedelta(days=29), 60)),
+        ("import.login.cold", _cold_import("auth")),
+        ("import.app_modules.cold", _cold_import("auth, charts, agenda_io, feed, jobs, llm")),
+    ]
+
+def run_benchmark(scales, repeat=5, seed=0, density=6.0, overlap=0.1, opt_budget=2.0):
+    init_db()
+    today = date.today()
+    results = []
+    for scale in scales:
+        n_users, months = (int(x) for x in scale.lower().split("x"))
+        # el historial termina dos semanas después de hoy: la semana actual y el horizonte tienen datos
+        start = today + timedelta(days=14 - months * 30)
+        counts = populate(n_users, months, start, density, overlap, seed, prefix=f"bench_{scale}")
+        if not counts:
+            raise SystemExit(f"la escala {scale} ya existe en {DATABASE_URL}; usa una base nueva")
+        for u in counts:
+            set_share_freebusy(u, True)   # common_free_slots.month consulta a todos los usuarios de la escala
+        uid = next(iter(counts))
+        df, ops = _operations(uid, list(counts), today, opt_budget)
+        for name, fn in ops:
+            fn()   # calentamiento (imports, cachés de plotly, etc.)
+            results.append(dict(_timed(fn, repeat), scale=scale, op=name, n_events=len(df), n_rows=int(counts[uid])))
+            print(f"{scale:>8} {name:<30} {results[-1]['median_s'] * 1000:9.2f} ms", file=sys.stderr)
+    return {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                 "pandas": pd.__version__, "platform": platform.platform(), "seed": seed, "density": density,
+                 "overlap": overlap, "repeat": repeat, "database": DATABASE_URL.split("://")[0]},
+        "results": results,
+    }
+
+def compare(current, baseline, fail_above=None):
+    """Print median ratios current/baseline per (scale, op); True if any exceeds fail_above."""
+    base = {(r["scale"], r["op"]): r for r in baseline["results"]}
+    worse = False
+    for r in current["results"]:
+        b = base.get((r["scale"], r["op"]))
+        if b is None or not b["median_s"]:
+            continue
+        ratio = r["median_s"] / b["median_s"]
+        flag = ""
+        if fail_above is not None and ratio > fail_above:
+            flag, worse = "  ⚠️", True
+        print(f"{r['scale']:>8} {r['op']:<30} {ratio:6.2f}x{flag}")
+    return worse
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Mide las rutas calientes sobre agendas sintéticas; salida JSON.")
+    p.add_argument("--scales", default=DEFAULT_SCALES, help="lista USUARIOSxMESES separada por comas")
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--density", type=float, default=6.0)
+    p.add_argument("--overlap", type=float, default=0.1)
+    p.add_argument("--opt-budget", type=float, default=2.0, help="segundos máximos del optimizador")
+    p.add_argument("--out", help="archivo JSON (por defecto stdout)")
+    p.add_argument("--compare", help="JSON de una ejecución anterior para comparar")
+    p.add_argument("--fail-above", type=float, default=None, help="sale con código 1 si alguna operación empeora más de este factor")
+    args = p.parse_args(argv)
+    report = run_benchmark(args.scales.split(","), args.repeat, args.seed, args.density, args.overlap, args.opt_budget)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            if compare(report, json.load(f), args.fail_above):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
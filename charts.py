@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+
+from db import events_version, get_event_notes, get_event_set
+from instrumentation import import_module, timed
+from metrics import event_datetimes
+
+# ----------------------------
+# Weekly timeline figure (cache por versión de agenda)
+# ----------------------------
+# Los reruns de Streamlit que no tocan la agenda (p.ej. escribir en los
+# objetivos) reutilizan la figura ya construida: la clave incluye la versión
+# de eventos del usuario (db.events_version, el token persistido), que cambia
+# con cada escritura de cualquier proceso.
+FIGURE_CACHE_MAX_ENTRIES = 128
+# por encima de esto una fila por título es ilegible y lenta: una fila por categoría
+TIMELINE_MAX_EVENTS = 150
+TIMELINE_MAX_ROWS = 40
+
+_fig_lock = threading.Lock()
+_fig_cache = OrderedDict()   # (user_id, week_start, version, compact) -> (figure, n_events)
+
+@timed("charts.build_timeline")
+def _timeline(evw, compact):
+    px = import_module("plotly.express")   # ~75 ms en frío: fuera del arranque y de la pantalla de acceso
+    if compact:
+        fig = px.timeline(evw, x_start="start_dt", x_end="end_dt", y="category", color="category",
+                          hover_name="title", hover_data={"category": False, "start_dt": False, "end_dt": False})
+        fig.update_yaxes(title="Categoría", autorange="reversed")
+        fig.update_traces(marker_line_width=0)
+    else:
+        fig = px.timeline(evw, x_start="start_dt", x_end="end_dt", y="title", color="category",
+                          hover_data={"notes": True, "date": True, "start": True, "end": True})
+        fig.update_yaxes(title="Actividad", autorange="reversed")
+    fig.update_layout(title="🧠 Distribución semanal de actividades")
+    return fig
+
+@timed("charts.week_figure")
+def week_figure(user_id, week_start, compact=None):
+    """(figure or None, n_events) for the 7 days from week_start; compact=None picks by size."""
+    uid = int(user_id)
+    key = (uid, str(week_start), events_version(uid), compact)
+    with _fig_lock:
+        hit = _fig_cache.get(key)
+        if hit is not None:
+            _fig_cache.move_to_end(key)
+            return hit
+    events = get_event_set(uid, week_start, week_start + timedelta(days=6))
+    fig = None
+    if len(events):
+        use_compact = compact if compact is not None else (len(events) > TIMELINE_MAX_EVENTS or len(np.unique(events.title)) > TIMELINE_MAX_ROWS)
+        # frontera con Plotly: aquí se pasa a DataFrame (y las notas solo si van en el hover)
+        evw = events.to_frame()
+        evw["start_dt"], evw["end_dt"] = event_datetimes(evw)
+        if not use_compact:
+            evw["notes"] = evw["id"].map(get_event_notes(evw["id"])).fillna("")
+        fig = _timeline(evw, use_compact)
+    with _fig_lock:
+        # una escritura durante la construcción cambia la versión: la entrada vieja nunca se vuelve a pedir
+        _fig_cache[key] = (fig, len(events))
+        _fig_cache.move_to_end(key)
+        while len(_fig_cache) > FIGURE_CACHE_MAX_ENTRIES:
+            _fig_cache.popitem(last=False)
+    return fig, len(events)
@@ -0,0 +1,93 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from instrumentation import timed
+from metrics import EPOCH, epoch_span
+from recurrence import SERIES_IN_WINDOW, expand_series, occurrence_days, parse_exdates, parse_rrule
+from storage import engine
+
+# ----------------------------
+# Conflict detection (al escribir)
+# ----------------------------
+# Todo se compara en minutos epoch absolutos (start_at/end_at): un evento que
+# cruza la medianoche ("Dormir" 23:30-07:00) ya tiene end_at al día siguiente.
+# Ningún evento dura más de un día, así que los que pueden solaparse con
+# [a, b) empiezan en (a - MAX_EVENT_MINUTES, b): un rango acotado sobre el
+# índice (user_id, start_at), sin importar el tamaño del historial. Las series
+# se expanden solo dentro de esa ventana.
+MAX_EVENT_MINUTES = 1440
+CONFLICT_SERIES_DAYS = 180   # una serie nueva se compara en sus primeros 180 días
+CONFLICT_COLUMNS = ["id", "title", "category", "date", "start", "end", "fixed", "priority", "start_at", "end_at", "rrule"]
+
+class EventConflict(ValueError):
+    """Raised by writes that reject overlaps with fixed events; .conflicts holds the clashing rows."""
+    def __init__(self, conflicts):
+        super().__init__(f"choca con evento(s) fijo(s): {describe_conflicts(conflicts)}")
+        self.conflicts = conflicts
+
+def describe_conflicts(conflicts, limit=3):
+    """Short Spanish list of clashing rows for messages."""
+    shown = "; ".join(f"'{r.title}' {r.date} {r.start}-{r.end}" for r in conflicts.head(limit).itertuples(index=False))
+    return shown + (f" (+{len(conflicts) - limit})" if len(conflicts) > limit else "")
+
+def occurrence_spans(date_s, start_s, end_s, rrule=None, exdates=None):
+    """Sorted (start_at, end_at) int arrays of an event's occurrences (a series: its first CONFLICT_SERIES_DAYS days)."""
+    sa, ea = epoch_span(date_s, start_s, end_s)
+    if not rrule:
+        return np.array([sa], dtype=np.int64), np.array([ea], dtype=np.int64)
+    d0 = date.fromisoformat(str(date_s).strip()[:10])
+    days = occurrence_days(d0, parse_rrule(rrule), parse_exdates(exdates), d0, d0 + timedelta(days=CONFLICT_SERIES_DAYS - 1))
+    starts = days * 1440 + sa % 1440
+    return starts, starts + (ea - sa)
+
+def _overlapping(df, starts, ends):
+    # ocurrencias de una misma serie no se solapan entre sí: starts y ends van ordenados
+    if df.empty or not len(starts):
+        return df
+    cs = df["start_at"].to_numpy(dtype=np.int64)
+    ce = df["end_at"].to_numpy(dtype=np.int64)
+    i = np.searchsorted(ends, cs, side="right")   # primera ocurrencia que termina después de que empiece el candidato
+    hit = i < len(starts)
+    hit[hit] = starts[i[hit]] < ce[hit]
+    return df[hit]
+
+def _find(conn, user_id, starts, ends, exclude_id):
+    lo, hi = int(starts[0]) - MAX_EVENT_MINUTES, int(ends[-1])
+    params = {"id": int(user_id), "lo": lo, "hi": hi, "x": -1 if exclude_id is None else int(exclude_id)}
+    singles = pd.read_sql(text("""
+    SELECT id, title, category, date, start, "end", fixed, priority, start_at, end_at, rrule FROM events
+    WHERE user_id=:id AND start_at > :lo AND start_at < :hi AND rrule IS NULL AND id != :x
+    """), conn, params=params)
+    a = (EPOCH + timedelta(days=lo // 1440)).isoformat()
+    b = (EPOCH + timedelta(days=hi // 1440)).isoformat()
+    series = pd.read_sql(text(SERIES_IN_WINDOW + " AND id != :x"), conn, params={"id": int(user_id), "a": a, "b": b, "x": params["x"]})
+    occ = expand_series(series, a, b)
+    if not occ.empty:
+        occ = occ[(occ["start_at"] > lo) & (occ["start_at"] < hi)][CONFLICT_COLUMNS]
+    frames = [f for f in (_overlapping(singles, starts, ends), _overlapping(occ, starts, ends)) if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=CONFLICT_COLUMNS)
+    out = pd.concat(frames, ignore_index=True)
+    return out.sort_values(["fixed", "start_at"], ascending=[False, True], ignore_index=True)
+
+@timed("conflicts.find")
+def find_conflicts(user_id, date_s, start_s, end_s, rrule=None, exdates=None, exclude_id=None, conn=None):
+    """Existing events overlapping the given one (one row per clashing occurrence, fixed first).
+
+    exclude_id skips the event being edited; conn lets a write check inside its own transaction."""
+    try:
+        starts, ends = occurrence_spans(date_s, start_s, end_s, rrule, exdates)
+    except (ValueError, TypeError):
+        return pd.DataFrame(columns=CONFLICT_COLUMNS)   # sin intervalo válido no hay con qué comparar
+    if not len(starts):
+        return pd.DataFrame(columns=CONFLICT_COLUMNS)
+    if conn is not None:
+        return _find(conn, user_id, starts, ends, exclude_id)
+    with engine.connect() as c:
+        return _find(c, user_id, starts, ends, exclude_id)
+
+def fixed_conflicts(conflicts):
+    return conflicts[conflicts["fixed"] == 1]
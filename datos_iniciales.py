@@ -1,21 +1,27 @@
-import sqlite3
 from datetime import datetime, timedelta
 import random
 
-DB = "agenda_pro.db"
-conn = sqlite3.connect(DB)
-cur = conn.cursor()
+from sqlalchemy import text
+
+from auth import hash_password
+from db import EVENT_FIELDS, add_events_bulk, init_db
+from storage import engine
+from users import get_user_by_name
+
+# todo por el engine de storage.py: usuario y eventos van a la misma base (AGENDA_DB_URL)
+init_db()
 
 print("📌 Insertando datos para DICIEMBRE 2025...")
 
 # ---------- Crear usuario base ----------
-cur.execute("""
-INSERT OR IGNORE INTO users (username, password, nombre, carrera, semestre)
-VALUES ('javier_gamboa', 'limaperu2025', 'Javier Gamboa', 'Ingeniería de Software', 10)
-""")
+with engine.begin() as conn:
+    conn.execute(text("""
+    INSERT INTO users (username, password, nombre, carrera, semestre)
+    VALUES ('javier_gamboa', :p, 'Javier Gamboa', 'Ingeniería de Software', 10)
+    ON CONFLICT (username) DO NOTHING
+    """), {"p": hash_password("limaperu2025")})
 
-cur.execute("SELECT id FROM users WHERE username='javier_gamboa'")
-user_id = cur.fetchone()[0]
+user_id = int(get_user_by_name("javier_gamboa")["id"])
 
 
 # ===========================================================
@@ -27,6 +33,19 @@ eventos = []
 inicio = datetime(2025, 12, 1)
 dias_mes = 31
 
+# ---------- Rutinas: una fila por serie (ver recurrence.py) ----------
+fin_mes = (inicio + timedelta(days=dias_mes - 1)).strftime("%Y%m%d")
+DIARIO = f"FREQ=DAILY;UNTIL={fin_mes}"
+LABORABLES = f"FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR;UNTIL={fin_mes}"
+fecha0 = inicio.strftime("%Y-%m-%d")
+series = [
+    ("Dormir", "Rutina", fecha0, "23:30", "07:00", 1, "Sueño", "Baja", DIARIO),
+    ("Viaje al campus", "Transporte", fecha0, "07:00", "07:50", 0, "", "Baja", LABORABLES),
+    ("Trabajo de programación", "Laboral", fecha0, "14:00", "18:00", 0, "Desarrollo web / backend", "Alta", LABORABLES),
+    ("Investigación de tesis", "Proyecto académico", fecha0, "18:00", "20:00", 0, "Análisis de datos / redacción", "Alta", DIARIO),
+    ("Estudio personal", "Académico", fecha0, "20:00", "22:00", 0, "Repaso de cursos", "Alta", DIARIO),
+]
+
 # Catálogos de actividades
 charlas = [
     "Charla de IA aplicada",
@@ -84,14 +103,9 @@ for i in range(dias_mes):
     fecha = dia.strftime("%Y-%m-%d")
     dow = dia.weekday()       # 0=Lunes ... 6=Domingo
 
-    # 💤 Dormir
-    eventos.append(("Dormir", "Rutina", fecha, "23:30", "07:00", 1, "Sueño", "Baja"))
+    # 💤 Dormir, viaje, trabajo, tesis y estudio nocturno: series de arriba
 
     # ---------------------- MAÑANA ----------------------
-    # Viaje
-    if dow < 5:
-        eventos.append(("Viaje al campus", "Transporte", fecha, "07:00", "07:50", 0, "", "Baja"))
-
     # Clases (rotan)
     clases_lista = [
         ("Arquitectura de Software Avanzada", "08:00", "10:00"),
@@ -109,15 +123,6 @@ for i in range(dias_mes):
         eventos.append((title, "Aprendizaje", fecha, "11:30", "13:00", 0, "", "Media"))
 
     # ---------------------- TARDE ----------------------
-    # Trabajo part-time (lunes a viernes)
-    if dow < 5:
-        eventos.append(("Trabajo de programación", "Laboral", fecha,
-                        "14:00", "18:00", 0, "Desarrollo web / backend", "Alta"))
-
-    # Investigación de tesis
-    eventos.append(("Investigación de tesis", "Proyecto académico", fecha,
-                    "18:00", "20:00", 0, "Análisis de datos / redacción", "Alta"))
-
     # Charla / conferencia en Lima
     if random.random() < 0.5:
         title = random.choice(charlas)
@@ -126,10 +131,6 @@ for i in range(dias_mes):
                         "15:00", "17:00", 0, f"Auditorio en {distrito}", "Media"))
 
     # ---------------------- NOCHE ----------------------
-    # Estudio nocturno
-    eventos.append(("Estudio personal", "Académico", fecha,
-                    "20:00", "22:00", 0, "Repaso de cursos", "Alta"))
-
     # Ocio
     title = random.choice(ocio)
     eventos.append((title, "Ocio", fecha, "22:00", "23:00", 0, "", "Baja"))
@@ -149,13 +150,7 @@ for i in range(dias_mes):
 #   INSERTAR EN LA BASE
 # ============================
 
-for ev in eventos:
-    cur.execute("""
-    INSERT INTO events (user_id, title, category, date, start, end, fixed, notes, priority)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (user_id, *ev))
-
-conn.commit()
-conn.close()
+# una sola transacción (executemany) que además mantiene week_load y las series
+n = add_events_bulk(user_id, [dict(zip(EVENT_FIELDS, ev)) for ev in series + eventos])
 
-print(f"🎉 {len(eventos)} eventos agregados correctamente para diciembre 2025.")
+print(f"🎉 {n} eventos agregados correctamente para diciembre 2025 ({len(series)} series recurrentes).")
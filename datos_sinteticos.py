@@ -0,0 +1,94 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from auth import hash_password
+from db import add_events_bulk, init_db
+from metrics import minutes_to_hhmm
+from users import add_user, get_user_by_name
+
+# ----------------------------
+# Generador de agendas sintéticas (reproducible)
+# ----------------------------
+# N usuarios × M meses con densidad (eventos/día) y tasa de solapamiento
+# configurables. Misma semilla => mismas agendas. Pensado para benchmark.py
+# y pruebas de carga; por defecto escribe en la base de AGENDA_DB_URL.
+#   AGENDA_DB_URL=sqlite:////tmp/sint.db python datos_sinteticos.py --users 50 --months 3
+
+CATALOGO = [
+    # (categoría, peso, títulos, duración min-max en minutos)
+    ("Estudio", 5, ["Repaso de cursos", "Lectura", "Ejercicios", "Preparar examen"], (45, 150)),
+    ("Tarea", 4, ["Tarea de cálculo", "Informe de laboratorio", "Ensayo"], (30, 120)),
+    ("Clase", 4, ["Bases de datos", "Redes", "Compiladores", "Estadística"], (90, 120)),
+    ("Proyecto TI", 2, ["Sprint del proyecto", "Code review", "Deploy"], (60, 180)),
+    ("Tesis", 1, ["Redacción de tesis", "Reunión con asesor"], (60, 120)),
+    ("Investigación", 1, ["Revisión bibliográfica", "Análisis de datos"], (60, 150)),
+    ("Trabajo", 3, ["Turno de trabajo", "Reunión de equipo"], (120, 240)),
+    ("Deporte", 2, ["Gimnasio", "Fútbol", "Correr"], (45, 90)),
+    ("Ocio", 2, ["Series", "Videojuegos", "Salir con amigos"], (60, 150)),
+    ("Otro", 1, ["Trámites", "Compras", "Limpieza"], (30, 90)),
+]
+PRIORIDADES = ["Baja", "Media", "Alta"]
+SYNTHETIC_PASSWORD = "sintetico"
+
+def generate_agenda(rng, start, months=1, density=6.0, overlap=0.1, recurring=True):
+    """Event row dicts for one user: ~density events/day, a fraction `overlap` starting inside the previous one."""
+    days = months * 30
+    rows = []
+    if recurring:
+        until = (start + timedelta(days=days - 1)).strftime("%Y%m%d")
+        rows.append({"title": "Dormir", "category": "Sueño", "date": start, "start": "23:30", "end": "07:00",
+                     "fixed": 1, "priority": "Baja", "rrule": f"FREQ=DAILY;UNTIL={until}"})
+        rows.append({"title": "Clase troncal", "category": "Clase", "date": start, "start": "08:00", "end": "10:00",
+                     "fixed": 1, "priority": "Alta", "rrule": f"FREQ=WEEKLY;BYDAY=MO,WE,FR;UNTIL={until}"})
+    weights = [c[1] for c in CATALOGO]
+    for i in range(days):
+        d = start + timedelta(days=i)
+        cur = 10 * 60 if recurring and d.weekday() in (0, 2, 4) else 7 * 60 + 30
+        prev = None
+        for _ in range(max(0, round(rng.gauss(density, density / 4)))):
+            cat, _, titles, (lo, hi) = rng.choices(CATALOGO, weights)[0]
+            dur = rng.randrange(lo, hi + 1, 15)
+            if prev is not None and rng.random() < overlap:
+                s = prev[0] + rng.randrange(0, max(15, prev[1] - prev[0]), 15)   # empieza dentro del anterior
+            else:
+                s = cur + rng.choice((0, 0, 15, 30, 60))
+            if s + dur > 23 * 60:
+                break
+            rows.append({"title": rng.choice(titles), "category": cat, "date": d, "start": minutes_to_hhmm(s), "end": minutes_to_hhmm(s + dur),
+                         "fixed": int(cat in ("Clase", "Trabajo")), "notes": "", "priority": rng.choice(PRIORIDADES)})
+            prev = (s, s + dur)
+            cur = max(cur, s + dur)
+    return rows
+
+def populate(n_users, months=1, start=None, density=6.0, overlap=0.1, seed=0, recurring=True, prefix="sint"):
+    """Create n_users synthetic users with their agendas (existing names are skipped); returns {user_id: n_events}."""
+    start = start or date.today().replace(day=1)
+    pw_hash = hash_password(SYNTHETIC_PASSWORD)   # un solo hash: scrypt por usuario sería el cuello de botella
+    out = {}
+    for i in range(n_users):
+        name = f"{prefix}_{i:04d}"
+        if not add_user(name, pw_hash):
+            continue   # ya generado antes: no se duplica su agenda
+        uid = int(get_user_by_name(name)["id"])
+        rng = random.Random(f"{seed}-{name}")
+        out[uid] = add_events_bulk(uid, generate_agenda(rng, start, months, density, overlap, recurring))
+    return out
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Genera agendas sintéticas reproducibles.")
+    p.add_argument("--users", type=int, default=10)
+    p.add_argument("--months", type=int, default=1)
+    p.add_argument("--start", type=date.fromisoformat, default=None, help="primer día (YYYY-MM-DD)")
+    p.add_argument("--density", type=float, default=6.0, help="eventos por día (media)")
+    p.add_argument("--overlap", type=float, default=0.1, help="fracción de eventos que se solapan con el anterior")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--no-recurring", dest="recurring", action="store_false", help="sin series (sueño/clases) recurrentes")
+    p.add_argument("--prefix", default="sint")
+    args = p.parse_args(argv)
+    init_db()
+    counts = populate(args.users, args.months, args.start, args.density, args.overlap, args.seed, args.recurring, args.prefix)
+    print(f"🎉 {sum(counts.values())} eventos para {len(counts)} usuarios ({args.prefix}_*, contraseña '{SYNTHETIC_PASSWORD}').")
+
+if __name__ == "__main__":
+    main()
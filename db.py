@@ -0,0 +1,594 @@
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time, timezone
+
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from aggregates import apply_load_deltas, load_deltas
+from conflicts import EventConflict, find_conflicts, fixed_conflicts
+from eventset import EventSet
+from freebusy import busy_days, refresh_busy
+from instrumentation import timed
+from metrics import epoch_span
+from migrations import migrate
+from recurrence import SERIES_WINDOW, expand_series, format_exdates, format_rrule, parse_exdates, parse_rrule, series_end
+from storage import engine
+
+# engine: SQLite (WAL, busy_timeout, pool) o PostgreSQL, ver storage.py
+# usuarios (alta, contraseña, búsqueda por nombre): users.py
+
+# ----------------------------
+# DB HELPERS
+# ----------------------------
+def init_db():
+    # esquema versionado: ver migrations.py
+    migrate(engine)
+
+def _epoch_or_none(date_s, start_s, end_s):
+    try:
+        return epoch_span(date_s, start_s, end_s)
+    except (ValueError, TypeError):
+        return None, None
+
+def series_fields(date_s, rrule, exdates=None):
+    """(rrule, exdates, until_date) normalized for storage; all None for a one-off event."""
+    if _blank(rrule) or not str(rrule).strip():
+        return None, None, None
+    rule = parse_rrule(rrule)
+    end = series_end(date.fromisoformat(str(date_s).strip()[:10]), rule)
+    return format_rrule(rule), format_exdates(parse_exdates(exdates)), end.isoformat() if end else None
+
+@timed("db.add_event")
+def add_event(user_id, title, category, date_s, start_s, end_s, fixed, notes, priority, rrule=None, exdates=None, reject_fixed_conflicts=False):
+    """Insert one event; returns the existing events it overlaps (see conflicts.find_conflicts).
+
+    reject_fixed_conflicts: raise EventConflict (nothing is written) if it overlaps a fixed event."""
+    sa, ea = _epoch_or_none(date_s, start_s, end_s)
+    rr, ex, ud = series_fields(date_s, rrule, exdates)
+    with engine.begin() as conn:
+        rev, now = _bump_rev(conn, user_id)   # primero: toma el lock de escritura (ver _check_conflicts)
+        clashes = _check_conflicts(conn, user_id, date_s, start_s, end_s, rr, ex, None, reject_fixed_conflicts)
+        conn.execute(text(INSERT_EVENT_SQL), {"uid": user_id, "t": title, "c": category, "d": date_s, "s": start_s, "e": end_s, "f": int(fixed), "n": notes,
+                                              "pr": priority, "sa": sa, "ea": ea, "rr": rr, "ex": ex, "ud": ud, "rev": rev, "now": now})
+        new = {"user_id": user_id, "category": category, "start_at": sa, "end_at": ea, "rrule": rr}
+        apply_load_deltas(conn, load_deltas([new]))
+        refresh_busy(conn, user_id, busy_days([new]))
+    invalidate_events(user_id)
+    return clashes
+
+INSERT_EVENT_SQL = """
+INSERT INTO events (user_id, title, category, date, start, "end", fixed, notes, priority, start_at, end_at, rrule, exdates, until_date,
+                    created_at, updated_at, rev, sequence)
+VALUES (:uid,:t,:c,:d,:s,:e,:f,:n,:pr,:sa,:ea,:rr,:ex,:ud,:now,:now,:rev,0)
+"""
+
+EVENT_FIELDS = ("title", "category", "date", "start", "end", "fixed", "notes", "priority", "rrule", "exdates")
+PRIORITIES = ["Baja","Media","Alta"]
+
+def _blank(v):
+    return v is None or (isinstance(v, float) and pd.isna(v)) or v is pd.NaT
+
+def _as_date_str(v):
+    if isinstance(v, datetime):
+        return v.date().isoformat()
+    if isinstance(v, date):
+        return v.isoformat()
+    try:
+        return date.fromisoformat(str(v).strip()[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f"fecha inválida: {v!r}")
+
+def _as_time_str(v):
+    if isinstance(v, (time, datetime)):
+        return v.strftime("%H:%M")
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.strptime(str(v).strip(), fmt).strftime("%H:%M")
+        except ValueError:
+            pass
+    raise ValueError(f"hora inválida: {v!r}")
+
+def clean_event_row(row):
+    """Validate/normalize one event mapping into INSERT parameters (ValueError if invalid)."""
+    title = "" if _blank(row.get("title")) else str(row.get("title")).strip()
+    if not title:
+        raise ValueError("título vacío")
+    fixed = row.get("fixed")
+    if isinstance(fixed, str):
+        fixed = fixed.strip().lower() in ("1", "true", "sí", "si", "yes")
+    priority = row.get("priority")
+    p = {
+        "t": title,
+        "c": "Otro" if _blank(row.get("category")) else str(row.get("category")),
+        "d": _as_date_str(row.get("date")),
+        "s": _as_time_str(row.get("start")),
+        "e": _as_time_str(row.get("end")),
+        "f": 0 if _blank(fixed) else int(bool(int(fixed))),
+        "n": "" if _blank(row.get("notes")) else str(row.get("notes")),
+        "pr": priority if priority in PRIORITIES else "Media",
+    }
+    p["sa"], p["ea"] = epoch_span(p["d"], p["s"], p["e"])
+    p["rr"], p["ex"], p["ud"] = series_fields(p["d"], row.get("rrule"), row.get("exdates"))
+    return p
+
+@timed("db.add_events_bulk")
+def add_events_bulk(user_id, rows):
+    """Validate all rows, then insert them in one transaction (executemany).
+
+    All-or-nothing: a ValueError listing the bad rows is raised before writing."""
+    params, errors = [], []
+    for i, row in enumerate(rows, start=1):
+        try:
+            p = clean_event_row(row)
+        except (ValueError, TypeError) as e:
+            errors.append(f"fila {i}: {e}")
+            continue
+        p["uid"] = user_id
+        params.append(p)
+    if errors:
+        raise ValueError(f"{len(errors)} fila(s) inválida(s): " + "; ".join(errors[:5]) + (" …" if len(errors) > 5 else ""))
+    if not params:
+        return 0
+    with engine.begin() as conn:
+        rev, now = _bump_rev(conn, user_id)
+        for p in params:
+            p["rev"], p["now"] = rev, now
+        conn.execute(text(INSERT_EVENT_SQL), params)
+        new = [{"user_id": user_id, "category": p["c"], "start_at": p["sa"], "end_at": p["ea"], "rrule": p["rr"]} for p in params]
+        apply_load_deltas(conn, load_deltas(new))
+        refresh_busy(conn, user_id, busy_days(new))
+    invalidate_events(user_id)
+    return len(params)
+
+@timed("db.update_event")
+def update_event(eid, title, category, date_s, start_s, end_s, fixed, notes, priority, rrule=None, exdates=None, reject_fixed_conflicts=False):
+    """Rewrite one event; returns the other events it now overlaps (reject_fixed_conflicts as in add_event)."""
+    sa, ea = _epoch_or_none(date_s, start_s, end_s)
+    rr, ex, ud = series_fields(date_s, rrule, exdates)
+    with engine.begin() as conn:
+        locked = _lock_event(conn, eid)
+        if locked is None:
+            return None
+        old, rev, now = locked
+        clashes = _check_conflicts(conn, old["user_id"], date_s, start_s, end_s, rr, ex, eid, reject_fixed_conflicts)
+        conn.execute(text("""
+        UPDATE events SET title=:t, category=:c, date=:d, start=:s, "end"=:e, fixed=:f, notes=:n, priority=:pr, start_at=:sa, end_at=:ea,
+               rrule=:rr, exdates=:ex, until_date=:ud, updated_at=:now, rev=:rev, sequence=sequence+1 WHERE id=:id
+        """), {"t": title, "c": category, "d": date_s, "s": start_s, "e": end_s, "f": int(fixed), "n": notes, "pr": priority, "sa": sa, "ea": ea,
+               "rr": rr, "ex": ex, "ud": ud, "id": eid, "rev": rev, "now": now})
+        _move_load(conn, old, {"user_id": old["user_id"], "category": category, "start_at": sa, "end_at": ea, "rrule": rr})
+    invalidate_events(old["user_id"])
+    return clashes
+
+@timed("db.move_event")
+def move_event(eid, date_s, start_s, end_s):
+    sa, ea = _epoch_or_none(date_s, start_s, end_s)
+    with engine.begin() as conn:
+        locked = _lock_event(conn, eid)
+        if locked is None:
+            return
+        old, rev, now = locked
+        conn.execute(text('UPDATE events SET date=:d, start=:s, "end"=:e, start_at=:sa, end_at=:ea, updated_at=:now, rev=:rev, sequence=sequence+1 WHERE id=:id'),
+                     {"d": date_s, "s": start_s, "e": end_s, "sa": sa, "ea": ea, "id": eid, "rev": rev, "now": now})
+        _move_load(conn, old, dict(old, start_at=sa, end_at=ea))
+    invalidate_events(old["user_id"])
+
+@timed("db.skip_occurrence")
+def skip_occurrence(eid, date_s):
+    """Add an exception date to a recurring event (that occurrence disappears)."""
+    with engine.begin() as conn:
+        locked = _lock_event(conn, eid)
+        if locked is None:
+            return
+        old, rev, now = locked
+        if not old["rrule"]:
+            return
+        exdates = conn.execute(text("SELECT exdates FROM events WHERE id=:id"), {"id": eid}).scalar()
+        ex = format_exdates(parse_exdates(exdates) + [date.fromisoformat(str(date_s)[:10])])
+        conn.execute(text("UPDATE events SET exdates=:ex, updated_at=:now, rev=:rev, sequence=sequence+1 WHERE id=:id"),
+                     {"ex": ex, "id": eid, "rev": rev, "now": now})
+    invalidate_events(old["user_id"])
+
+@timed("db.delete_event")
+def delete_event(eid):
+    with engine.begin() as conn:
+        locked = _lock_event(conn, eid)
+        if locked is None:
+            return
+        old, rev, now = locked
+        conn.execute(text("DELETE FROM events WHERE id=:id"), {"id": eid})
+        # lápida: los clientes que sincronizan por rev se enteran del borrado
+        conn.execute(text("INSERT INTO event_tombstones (id, user_id, rev, sequence, deleted_at) VALUES (:id, :u, :rev, :seq, :now)"),
+                     {"id": eid, "u": old["user_id"], "rev": rev, "seq": int(old["sequence"] or 0) + 1, "now": now})
+        apply_load_deltas(conn, load_deltas([old], sign=-1))
+        refresh_busy(conn, old["user_id"], busy_days([old]))
+    invalidate_events(old["user_id"])
+
+def _check_conflicts(conn, user_id, date_s, start_s, end_s, rrule, exdates, exclude_id, reject_fixed):
+    # después de _bump_rev: el UPDATE de users toma el lock de escritura (toda la base
+    # en SQLite, donde pysqlite abre la transacción en la primera escritura; la fila
+    # del usuario en PostgreSQL), así dos escrituras del mismo usuario no pasan las
+    # dos la comprobación antes de insertar
+    clashes = find_conflicts(user_id, date_s, start_s, end_s, rrule, exdates, exclude_id=exclude_id, conn=conn)
+    if reject_fixed and not fixed_conflicts(clashes).empty:
+        raise EventConflict(fixed_conflicts(clashes))
+    return clashes
+
+def _event_load_row(conn, eid):
+    # dueño + lo que cuenta para week_load/day_busy, leído antes de modificar la fila
+    row = conn.execute(text("SELECT user_id, category, start_at, end_at, rrule, sequence FROM events WHERE id=:id"), {"id": eid}).mappings().first()
+    return dict(row) if row is not None else None
+
+def _lock_event(conn, eid):
+    # (fila anterior, rev, now) o None si no existe. La fila se vuelve a leer después
+    # de _bump_rev (lock de escritura, ver _check_conflicts): dos ediciones a la vez
+    # del mismo evento no restan la misma fila vieja de week_load/day_busy
+    owner = conn.execute(text("SELECT user_id FROM events WHERE id=:id"), {"id": eid}).scalar()
+    if owner is None:
+        return None
+    rev, now = _bump_rev(conn, owner)
+    old = _event_load_row(conn, eid)
+    return (old, rev, now) if old is not None else None
+
+def _move_load(conn, old, new):
+    apply_load_deltas(conn, load_deltas([new], acc=load_deltas([old], sign=-1)))
+    refresh_busy(conn, old["user_id"], busy_days([old, new]))
+
+EVENT_SET_COLUMNS = "id, title, category, priority, fixed, start_at, end_at, rrule"
+
+@timed("db.fetch_events")
+def _read_events(user_id, date_from=None, date_to=None):
+    # sin notas ni textos de fecha/hora: solo lo que guarda EventSet
+    if date_from is None:
+        q = text(f"SELECT {EVENT_SET_COLUMNS} FROM events WHERE user_id=:id")
+        return EventSet.from_frame(pd.read_sql(q, engine, params={"id": user_id}))
+    return EventSet.from_frame(_read_window("user_id=:id AND ", {"id": user_id, "a": date_from, "b": date_to}, columns=EVENT_SET_COLUMNS))
+
+def _read_window(where, params, order=None, columns="*"):
+    # fechas ISO (YYYY-MM-DD): el rango usa idx_events_user_date; las series
+    # (una fila cada una) se expanden solo dentro de la ventana
+    order_sql = f" ORDER BY {','.join(order)}" if order else ""
+    singles = pd.read_sql(text(f"SELECT {columns} FROM events WHERE {where}rrule IS NULL AND date BETWEEN :a AND :b{order_sql}"), engine, params=params)
+    series = pd.read_sql(text(f"SELECT * FROM events WHERE {where}{SERIES_WINDOW}"), engine, params=params)
+    if series.empty:
+        return singles
+    occ = expand_series(series, params["a"], params["b"])
+    if columns != "*":
+        occ = occ[list(singles.columns)]
+    df = pd.concat([singles, occ], ignore_index=True) if not singles.empty else occ
+    return df.sort_values(order, kind="stable").reset_index(drop=True) if order else df
+
+@timed("db.fetch_all_events")
+def get_all_events_range(date_from, date_to):
+    """Every user's events in [date_from, date_to] in one query (series expanded); for batch runs."""
+    return _read_window("", {"a": str(date_from), "b": str(date_to)}, ["user_id", "date", "start"])
+
+def get_user_ids():
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text("SELECT id FROM users ORDER BY id"))]
+
+@timed("db.get_event_categories")
+def get_event_categories(user_id):
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT DISTINCT category FROM events WHERE user_id=:id"), {"id": user_id})
+        return sorted((r[0] or "") for r in rows)
+
+@timed("db.fetch_export_rows")
+def iter_event_rows(user_id, date_from=None, date_to=None, categories=None, chunk_size=1000):
+    """Yield lists of event row mappings straight from a server-side cursor, chunk by chunk."""
+    sql = "SELECT * FROM events WHERE user_id=:id"
+    params = {"id": user_id}
+    # las series salen una vez (sin expandir) si alguna ocurrencia cae en el rango
+    if date_from is not None:
+        sql += " AND (date >= :a OR (rrule IS NOT NULL AND (until_date IS NULL OR until_date >= :a)))"
+        params["a"] = str(date_from)
+    if date_to is not None:
+        sql += " AND date <= :b"
+        params["b"] = str(date_to)
+    q = text(sql + (" AND category IN :cats" if categories else "") + " ORDER BY date,start,id")
+    if categories:
+        q = q.bindparams(bindparam("cats", expanding=True))
+        params["cats"] = list(categories)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(q, params).mappings()
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+# ----------------------------
+# Búsqueda paginada (panel de edición)
+# ----------------------------
+# Filtra y pagina en SQL: el panel nunca carga la agenda entera. Paginación por
+# clave (date, start, id): cada página es un rango del índice, sin OFFSET.
+EDIT_PAGE_SIZE = 50
+
+def _search_where(user_id, date_from, date_to, categories, text_q):
+    where, params = ["user_id=:id"], {"id": user_id}
+    if date_from is not None:
+        where.append("(date >= :a OR (rrule IS NOT NULL AND (until_date IS NULL OR until_date >= :a)))")
+        params["a"] = str(date_from)
+    if date_to is not None:
+        where.append("date <= :b")
+        params["b"] = str(date_to)
+    if categories:
+        where.append("category IN :cats")
+        params["cats"] = list(categories)
+    text_q = (text_q or "").strip()
+    if text_q:
+        where.append(_like_clause("q"))
+        params["q"] = _like_pattern(text_q)
+    return " AND ".join(where), params
+
+def _like_pattern(text_q):
+    return "%" + text_q.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _like_clause(name):
+    return f"(LOWER(title) LIKE :{name} ESCAPE '\\' OR LOWER(COALESCE(notes, '')) LIKE :{name} ESCAPE '\\')"
+
+def _search_query(sql, params):
+    q = text(sql)
+    return q.bindparams(bindparam("cats", expanding=True)) if "cats" in params else q
+
+@timed("db.fetch_search")
+def search_events(user_id, date_from=None, date_to=None, categories=None, text_q=None, after=None, limit=EDIT_PAGE_SIZE):
+    """One page of raw event rows as {id: row dict} (series once, unexpanded) and the cursor of the next page or None.
+
+    `after` is the cursor returned by the previous page; filters match iter_event_rows plus text in title/notes."""
+    where, params = _search_where(int(user_id), date_from, date_to, categories, text_q)
+    if after is not None:
+        where += " AND (date > :cd OR (date = :cd AND (start > :cs OR (start = :cs AND id > :ci))))"
+        params.update(cd=after[0], cs=after[1], ci=after[2])
+    params["lim"] = int(limit) + 1
+    with engine.connect() as conn:
+        rows = conn.execute(_search_query(f"SELECT * FROM events WHERE {where} ORDER BY date,start,id LIMIT :lim", params), params).mappings().all()
+    page = {int(r["id"]): dict(r) for r in rows[:limit]}
+    nxt = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        nxt = (last["date"], last["start"], int(last["id"]))
+    return page, nxt
+
+@timed("db.count_search")
+def count_events(user_id, date_from=None, date_to=None, categories=None, text_q=None):
+    where, params = _search_where(int(user_id), date_from, date_to, categories, text_q)
+    with engine.connect() as conn:
+        return conn.execute(_search_query(f"SELECT COUNT(*) FROM events WHERE {where}", params), params).scalar()
+
+# ----------------------------
+# Búsqueda de texto (FTS5 / tsvector)
+# ----------------------------
+# Índice creado en la migración 8: en SQLite events_fts (FTS5, sincronizada por
+# triggers); en PostgreSQL un índice GIN. Si el SQLite no trae FTS5 se cae a LIKE.
+SEARCH_LIMIT = 50
+SEARCH_COLUMNS = ["id", "title", "category", "date", "start", "end", "rrule", "snippet"]
+_fts_available = None
+
+def _has_fts(conn):
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = conn.dialect.name == "postgresql" or conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='events_fts'")).first() is not None
+    return _fts_available
+
+def search_terms(query):
+    """Words of a free-text query (punctuation and FTS operators dropped)."""
+    return re.findall(r"\w+", query or "")
+
+@timed("db.fetch_text_search")
+def search_text(user_id, query, limit=SEARCH_LIMIT):
+    """Events of user_id whose title/notes contain every word of query (prefixes match), best first."""
+    terms = search_terms(query)
+    if not terms:
+        return pd.DataFrame(columns=SEARCH_COLUMNS)
+    params = {"id": int(user_id), "lim": int(limit)}
+    with engine.connect() as conn:
+        if not _has_fts(conn):
+            # una condición LIKE por palabra (todas deben aparecer)
+            where = " AND ".join(["user_id=:id"] + [_like_clause(f"q{i}") for i in range(len(terms))])
+            params.update({f"q{i}": _like_pattern(t) for i, t in enumerate(terms)})
+            sql = f'SELECT id, title, category, date, start, "end", rrule, SUBSTR(notes, 1, 120) AS snippet FROM events WHERE {where} ORDER BY date DESC, start LIMIT :lim'
+        elif conn.dialect.name == "postgresql":
+            params["q"] = " & ".join(t + ":*" for t in terms)
+            sql = """
+            SELECT id, title, category, date, start, "end", rrule,
+                   ts_headline('simple', COALESCE(notes, ''), q, 'StartSel=**, StopSel=**, MaxWords=12, MinWords=4') AS snippet
+            FROM events, to_tsquery('simple', :q) q
+            WHERE user_id=:id AND to_tsvector('simple', COALESCE(title, '') || ' ' || COALESCE(notes, '')) @@ q
+            ORDER BY ts_rank(to_tsvector('simple', COALESCE(title, '') || ' ' || COALESCE(notes, '')), q) DESC, date DESC
+            LIMIT :lim
+            """
+        else:
+            # cada palabra entre comillas (sin sintaxis FTS del usuario) y como prefijo
+            params["q"] = " ".join('"' + t + '"*' for t in terms)
+            sql = """
+            SELECT e.id, e.title, e.category, e.date, e.start, e."end", e.rrule,
+                   snippet(events_fts, 1, '**', '**', '…', 12) AS snippet
+            FROM events_fts JOIN events e ON e.id = events_fts.rowid
+            WHERE events_fts MATCH :q AND e.user_id=:id
+            ORDER BY bm25(events_fts, 5.0, 1.0), e.date DESC
+            LIMIT :lim
+            """
+        rows = conn.execute(text(sql), params).all()
+    return pd.DataFrame(rows, columns=SEARCH_COLUMNS)
+
+# ----------------------------
+# Change feed (sincronización incremental)
+# ----------------------------
+# Cada escritura sube users.events_rev una vez (en su misma transacción) y
+# marca con esa rev las filas tocadas; los borrados dejan una lápida en
+# event_tombstones. El token de sincronización es la rev: changes_since(uid, t)
+# devuelve lo cambiado después de t con dos consultas sobre (user_id, rev).
+def _utc_now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _bump_rev(conn, user_id):
+    # la fila del usuario hace de contador: las escrituras de un mismo usuario se serializan aquí
+    now = _utc_now()
+    rev = conn.execute(text("UPDATE users SET events_rev = events_rev + 1, events_modified=:t WHERE id=:u RETURNING events_rev"),
+                       {"u": int(user_id), "t": now}).scalar()
+    return (rev or 1), now
+
+@timed("db.fetch_changes")
+def changes_since(user_id, token=None):
+    """{"token", "full", "changed": [row dicts], "deleted": [{id, sequence, deleted_at}]}.
+
+    token=None (or a token from the future) gives a full snapshot; pass the returned token next time."""
+    uid = int(user_id)
+    with engine.connect() as conn:
+        current = conn.execute(text("SELECT events_rev FROM users WHERE id=:u"), {"u": uid}).scalar() or 0
+        full = token is None or int(token) > current
+        since = 0 if full else int(token)
+        changed = conn.execute(text("SELECT * FROM events WHERE user_id=:u AND rev > :t ORDER BY rev, id"), {"u": uid, "t": since}).mappings().all()
+        deleted = [] if full else conn.execute(text("""
+        SELECT id, sequence, deleted_at FROM event_tombstones WHERE user_id=:u AND rev > :t ORDER BY rev, id
+        """), {"u": uid, "t": since}).mappings().all()
+    return {"token": current, "full": full, "changed": [dict(r) for r in changed], "deleted": [dict(r) for r in deleted]}
+
+def get_feed_key(user_id, rotate=False):
+    """Secret key of the user's ICS feed URL (created on first use; rotate=True invalidates the old URL)."""
+    if not rotate:
+        # lectura en cada rerun; solo se escribe la primera vez
+        with engine.connect() as conn:
+            key = conn.execute(text("SELECT feed_key FROM users WHERE id=:u"), {"u": int(user_id)}).scalar()
+        if key:
+            return key
+    key = secrets.token_urlsafe(18)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET feed_key=:k WHERE id=:u"), {"k": key, "u": int(user_id)})
+    return key
+
+def feed_user(feed_key):
+    """(user_id, token, last modification) for a feed key, or None; the only query of a 304 poll."""
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT id, events_rev, events_modified FROM users WHERE feed_key=:k"), {"k": feed_key}).first()
+    return (int(row[0]), int(row[1]), row[2]) if row is not None else None
+
+# ----------------------------
+# EVENT CACHE (write-through)
+# ----------------------------
+# Vive a nivel de módulo (no en app.py) para sobrevivir a los reruns de
+# Streamlit y compartirse entre sesiones del mismo usuario. La versión es el
+# token persistido users.events_rev (ver Change feed): lo sube cada escritura,
+# también las de otro proceso (CLI de datos, batch, otro worker u otro nodo con
+# PostgreSQL), así que una consulta escalar por clave primaria basta para no
+# servir nunca un conjunto viejo. invalidate_events además libera en el acto
+# las entradas locales tras una escritura de este proceso.
+# Se guardan EventSet (arrays de solo lectura, ver eventset.py), no DataFrames:
+# se comparten sin copiar entre sesiones.
+EVENTS_CACHE_MAX_ENTRIES = 512
+
+_cache_lock = threading.Lock()
+_events_cache = OrderedDict()   # (user_id, date_from, date_to) -> (version, EventSet)
+
+def events_version(user_id):
+    """Persisted sync token of the user's events (changes with every write, from any process)."""
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT events_rev FROM users WHERE id=:u"), {"u": int(user_id)}).scalar() or 0
+
+def invalidate_events(user_id):
+    uid = int(user_id)
+    with _cache_lock:
+        for key in [k for k in _events_cache if k[0] == uid]:
+            del _events_cache[key]
+
+def _cached_events(uid, date_from=None, date_to=None):
+    key = (uid, date_from, date_to)
+    # leída antes que los eventos: si alguien escribe durante la lectura, la
+    # entrada queda con la versión vieja y la siguiente consulta no la usa
+    version = events_version(uid)
+    with _cache_lock:
+        hit = _events_cache.get(key)
+        if hit is not None and hit[0] == version:
+            _events_cache.move_to_end(key)
+            return hit[1]
+    events = _read_events(uid, date_from, date_to)
+    with _cache_lock:
+        _events_cache[key] = (version, events)
+        _events_cache.move_to_end(key)
+        while len(_events_cache) > EVENTS_CACHE_MAX_ENTRIES:
+            _events_cache.popitem(last=False)
+    return events
+
+@timed("db.get_event_set")
+def get_event_set(user_id, date_from=None, date_to=None):
+    """Cached EventSet of the user's events: all rows (series once) or [date_from, date_to] with series expanded."""
+    if date_from is None:
+        return _cached_events(int(user_id))
+    return _cached_events(int(user_id), str(date_from), str(date_to))
+
+@timed("db.get_events")
+def get_events(user_id):
+    return get_event_set(user_id).to_frame()
+
+@timed("db.get_events_range")
+def get_events_range(user_id, date_from, date_to):
+    """Events with date_from <= date <= date_to (both inclusive), recurring events expanded, as a DataFrame."""
+    return get_event_set(user_id, date_from, date_to).to_frame()
+
+@timed("db.fetch_notes")
+def get_event_notes(ids):
+    """{id: notes} for a few events (notes are not kept in EventSet)."""
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return {}
+    q = text("SELECT id, notes FROM events WHERE id IN :ids").bindparams(bindparam("ids", expanding=True))
+    with engine.connect() as conn:
+        return {r[0]: r[1] or "" for r in conn.execute(q, {"ids": ids})}
+
+# ----------------------------
+# BATCH RESULTS (lote nocturno, ver batch.py)
+# ----------------------------
+BATCH_RESULT_FIELDS = ("user_id", "week_start", "score", "risk", "notes", "existing_study", "target_week", "objective", "error")
+
+def save_batch_run(run_date, mode, started_at, results):
+    """Store one batch run (results: dicts with BATCH_RESULT_FIELDS + 'suggestions'); returns the run id."""
+    with engine.begin() as conn:
+        run_id = conn.execute(text("""
+        INSERT INTO batch_runs (run_date, mode, started_at, finished_at, n_users, n_errors) VALUES (:d, :m, :s, :f, :n, :e) RETURNING id
+        """), {"d": str(run_date), "m": mode, "s": started_at, "f": datetime.now().isoformat(timespec="seconds"),
+               "n": len(results), "e": sum(1 for r in results if r.get("error"))}).scalar()
+        if results:
+            conn.execute(text(f"""
+            INSERT INTO batch_results (run_id, {", ".join(BATCH_RESULT_FIELDS)}) VALUES (:run_id, {", ".join(":" + f for f in BATCH_RESULT_FIELDS)})
+            """), [dict({f: r.get(f) for f in BATCH_RESULT_FIELDS}, run_id=run_id) for r in results])
+        sugg = [dict(s, run_id=run_id, user_id=r["user_id"]) for r in results for s in r.get("suggestions", [])]
+        if sugg:
+            conn.execute(text("""
+            INSERT INTO batch_suggestions (run_id, user_id, kind, event_id, date, start, "end", detail)
+            VALUES (:run_id, :user_id, :kind, :event_id, :date, :start, :end, :detail)
+            """), sugg)
+    return run_id
+
+@timed("db.latest_batch_result")
+def latest_batch_result(user_id):
+    """(run row, result row, suggestions DataFrame) of the latest batch run that covered user_id, or None."""
+    with engine.connect() as conn:
+        res = conn.execute(text("""
+        SELECT r.*, b.run_date, b.finished_at FROM batch_results r JOIN batch_runs b ON b.id = r.run_id
+        WHERE r.user_id=:u ORDER BY r.run_id DESC LIMIT 1
+        """), {"u": int(user_id)}).mappings().first()
+        if res is None:
+            return None
+        sugg = pd.read_sql(text('SELECT kind, event_id, date, start, "end", detail FROM batch_suggestions WHERE run_id=:r AND user_id=:u ORDER BY date, start'),
+                           conn, params={"r": res["run_id"], "u": int(user_id)})
+    sugg["event_id"] = sugg["event_id"].astype("Int64")   # NULL en los bloques nuevos
+    return dict(res), sugg
+
+def batch_report(run_id=None):
+    """Per-student summary of one run (default: latest), highest burnout score first."""
+    with engine.connect() as conn:
+        if run_id is None:
+            run_id = conn.execute(text("SELECT MAX(id) FROM batch_runs")).scalar()
+        q = text("""
+        SELECT u.username, r.user_id, r.risk, r.score, r.existing_study, r.target_week,
+               (SELECT COUNT(*) FROM batch_suggestions s WHERE s.run_id = r.run_id AND s.user_id = r.user_id) AS suggestions, r.error
+        FROM batch_results r LEFT JOIN users u ON u.id = r.user_id
+        WHERE r.run_id=:r ORDER BY r.score IS NULL, r.score DESC
+        """)
+        return pd.read_sql(q, conn, params={"r": run_id})
+
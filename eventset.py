@@ -0,0 +1,124 @@
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from metrics import EPOCH
+
+# ----------------------------
+# Compact event container
+# ----------------------------
+# Lo que se cachea por usuario (db.get_event_set) y consumen la vista semanal,
+# el burnout y el optimizador: arrays numpy de solo lectura, una entrada por
+# ocurrencia, ordenadas por inicio. Día en int32 (días epoch), minutos en
+# int16, categoría/prioridad como códigos sobre tablas pequeñas y títulos
+# internados (el mismo str se comparte entre usuarios y sesiones). Las notas
+# no se guardan: se piden a la base solo en la frontera (hover del gráfico).
+# to_frame() convierte a DataFrame solo para Plotly/pandas.
+_HHMM = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(1440)], dtype=object)
+FRAME_COLUMNS = ["id", "title", "category", "date", "start", "end", "fixed", "priority", "start_at", "end_at", "recurring"]
+
+def _codes(values):
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object).fillna("").astype(str))
+    dtype = np.int8 if len(uniques) < 128 else np.int16 if len(uniques) < 32768 else np.int32
+    return codes.astype(dtype), tuple(sys.intern(u) for u in uniques)
+
+class EventSet:
+    """Read-only array-backed events (one entry per occurrence) sorted by (start, id)."""
+
+    __slots__ = ("id", "day", "start_m", "dur_m", "cat", "prio", "title", "fixed", "recurring",
+                 "categories", "priorities", "titles")
+
+    def __init__(self, id, day, start_m, dur_m, cat, prio, title, fixed, recurring, categories, priorities, titles):
+        self.id, self.day, self.start_m, self.dur_m = id, day, start_m, dur_m
+        self.cat, self.prio, self.title = cat, prio, title
+        self.fixed, self.recurring = fixed, recurring
+        self.categories, self.priorities, self.titles = categories, priorities, titles
+        for a in (id, day, start_m, dur_m, cat, prio, title, fixed, recurring):
+            a.setflags(write=False)   # compartido entre sesiones: nadie lo modifica
+
+    @classmethod
+    def empty(cls):
+        z = np.empty(0, dtype=np.int8)
+        return cls(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int16),
+                   z, z.copy(), np.empty(0, dtype=np.int32), np.empty(0, dtype=bool), np.empty(0, dtype=bool), (), (), ())
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build from an events frame (db rows or expanded occurrences); rows without start_at/end_at are skipped."""
+        if df.empty or "start_at" not in df.columns:
+            return cls.empty()
+        df = df[df["start_at"].notna() & df["end_at"].notna()]
+        start_at = df["start_at"].to_numpy(dtype=np.int64)
+        ids = df["id"].to_numpy(dtype=np.int64)
+        order = np.lexsort((ids, start_at))
+        df, start_at = df.iloc[order], start_at[order]
+        cat, categories = _codes(df["category"])
+        prio, priorities = _codes(df["priority"] if "priority" in df.columns else [""] * len(df))
+        title, titles = _codes(df["title"])
+        recurring = df["rrule"].notna().to_numpy() if "rrule" in df.columns else np.zeros(len(df), dtype=bool)
+        return cls(ids[order].astype(np.int32), (start_at // 1440).astype(np.int32), (start_at % 1440).astype(np.int16),
+                   (df["end_at"].to_numpy(dtype=np.int64) - start_at).astype(np.int16), cat, prio, title.astype(np.int32),
+                   df["fixed"].fillna(0).to_numpy(dtype=np.int64) == 1, recurring, categories, priorities, titles)
+
+    def __len__(self):
+        return len(self.id)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.id, self.day, self.start_m, self.dur_m, self.cat, self.prio, self.title, self.fixed, self.recurring))
+
+    @property
+    def start_at(self):
+        return self.day.astype(np.int64) * 1440 + self.start_m
+
+    @property
+    def end_at(self):
+        return self.start_at + self.dur_m
+
+    def take(self, index):
+        """Subset by boolean mask or positions (tables are shared, not copied)."""
+        return EventSet(self.id[index], self.day[index], self.start_m[index], self.dur_m[index], self.cat[index], self.prio[index],
+                        self.title[index], self.fixed[index], self.recurring[index], self.categories, self.priorities, self.titles)
+
+    def window(self, date_from, date_to):
+        """Events whose day is in [date_from, date_to] (both inclusive); a slice, sorted input."""
+        a = (date.fromisoformat(str(date_from)[:10]) - EPOCH).days
+        b = (date.fromisoformat(str(date_to)[:10]) - EPOCH).days
+        return self.take(slice(np.searchsorted(self.day, a, "left"), np.searchsorted(self.day, b, "right")))
+
+    def category_mask(self, names):
+        codes = [i for i, c in enumerate(self.categories) if c in names]
+        return np.isin(self.cat, codes)
+
+    def hours(self, mask=None):
+        dur = self.dur_m if mask is None else self.dur_m[mask]
+        return float(dur.sum()) / 60.0
+
+    def row(self, i):
+        """Plain dict for entry i (the few rows that leave the arrays, e.g. optimizer suggestions)."""
+        s = int(self.start_m[i])
+        return {"id": int(self.id[i]), "title": self.titles[self.title[i]], "category": self.categories[self.cat[i]],
+                "date": date.fromordinal(EPOCH.toordinal() + int(self.day[i])).isoformat(), "start": _HHMM[s],
+                "end": _HHMM[(s + int(self.dur_m[i])) % 1440], "fixed": int(self.fixed[i]),
+                "priority": self.priorities[self.prio[i]] if len(self.priorities) else "", "recurring": bool(self.recurring[i])}
+
+    def to_frame(self):
+        """DataFrame with FRAME_COLUMNS (Plotly/pandas boundary only)."""
+        if not len(self):
+            return pd.DataFrame(columns=FRAME_COLUMNS)
+        start_at = self.start_at
+        return pd.DataFrame({
+            "id": self.id.astype(np.int64),
+            "title": np.array(self.titles, dtype=object)[self.title],
+            "category": np.array(self.categories, dtype=object)[self.cat],
+            "date": pd.to_datetime(self.day, unit="D").strftime("%Y-%m-%d"),
+            "start": _HHMM[self.start_m],
+            "end": _HHMM[(self.start_m.astype(np.int32) + self.dur_m) % 1440],
+            "fixed": self.fixed.astype(np.int64),
+            "priority": np.array(self.priorities, dtype=object)[self.prio],
+            "start_at": start_at,
+            "end_at": start_at + self.dur_m,
+            "recurring": self.recurring,
+        })
@@ -0,0 +1,102 @@
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from instrumentation import timed
+
+# ----------------------------
+# ICS feed (suscripción de calendario)
+# ----------------------------
+# GET /feed/<feed_key>.ics        agenda completa
+# GET /feed/<feed_key>.ics?since=N solo lo cambiado después del token N
+# (VEVENTs con el mismo UID y SEQUENCE mayor; los borrados como CANCELLED).
+# ETag = token actual: un cliente al día recibe 304 tras una sola consulta
+# indexada (feed_user), sin serializar nada. X-Sync-Token trae el token para
+# el siguiente ?since=. AGENDA_FEED_PORT=0 lo deja apagado.
+# db/agenda_io (pandas) se importan en la primera petición, no al arrancar el
+# servidor: app._startup lo arranca antes de la pantalla de acceso.
+FEED_PORT = int(os.environ.get("AGENDA_FEED_PORT", "0"))
+FEED_HOST = os.environ.get("AGENDA_FEED_HOST", "0.0.0.0")
+FEED_PUBLIC_URL = os.environ.get("AGENDA_FEED_PUBLIC_URL", "")   # p.ej. https://agenda.example.edu (detrás de un proxy)
+_PATH = re.compile(r"^/feed/([A-Za-z0-9_-]+)\.ics$")
+
+def feed_url(feed_key):
+    base = FEED_PUBLIC_URL.rstrip("/") or f"http://localhost:{FEED_PORT}"
+    return f"{base}/feed/{feed_key}.ics"
+
+def _http_date(iso):
+    if not iso:
+        return None
+    return format_datetime(datetime.strptime(iso, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc), usegmt=True)
+
+def _not_modified(headers, etag, last_modified):
+    inm = headers.get("If-None-Match")
+    if inm is not None:
+        # If-None-Match manda sobre If-Modified-Since (RFC 9110)
+        return inm.strip() == "*" or etag in [t.strip() for t in inm.split(",")]
+    ims = headers.get("If-Modified-Since")
+    if ims and last_modified:
+        try:
+            return parsedate_to_datetime(ims) >= parsedate_to_datetime(last_modified)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+@timed("feed.request")
+def render_feed(feed_key, since=None, headers=None):
+    """(status, headers dict, body bytes) for a feed request."""
+    from agenda_io import ics_changes, iter_ics
+    from db import changes_since, feed_user
+    state = feed_user(feed_key)
+    if state is None:
+        return 404, {}, b""
+    user_id, token, modified = state
+    etag = f'"{token}"' if since is None else f'"{token}-{since}"'
+    out_headers = {"ETag": etag, "X-Sync-Token": str(token), "Cache-Control": "private, no-cache"}
+    last_modified = _http_date(modified)
+    if last_modified:
+        out_headers["Last-Modified"] = last_modified
+    if _not_modified(headers or {}, etag, last_modified):
+        return 304, out_headers, b""
+    # el cuerpo puede ser más nuevo que el token leído arriba (escritura en medio):
+    # el siguiente ?since= lo vuelve a incluir, nunca se pierde un cambio
+    out_headers["Content-Type"] = "text/calendar; charset=utf-8"
+    if since is None:
+        return 200, out_headers, b"".join(iter_ics(user_id))
+    return 200, out_headers, ics_changes(changes_since(user_id, since))
+
+class _FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        m = _PATH.match(url.path)
+        since = parse_qs(url.query).get("since", [None])[0]
+        if m is None or (since is not None and not since.isdigit()):
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = render_feed(m.group(1), int(since) if since is not None else None, self.headers)
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_lock = threading.Lock()
+_server = None
+
+def start_feed_server(port=FEED_PORT):
+    """Serve /feed/<key>.ics on `port` in a daemon thread (once per process); no-op if port is 0."""
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return _server
+        _server = ThreadingHTTPServer((FEED_HOST, port), _FeedHandler)
+    threading.Thread(target=_server.serve_forever, name="agenda-feed", daemon=True).start()
+    return _server
@@ -0,0 +1,228 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from conflicts import MAX_EVENT_MINUTES
+from instrumentation import timed
+from metrics import EPOCH, minutes_to_hhmm, parse_time_str_safe, time_to_minutes
+from recurrence import SERIES_WINDOW, expand_series
+from storage import engine
+
+# ----------------------------
+# Free/busy bitmaps (tabla day_busy)
+# ----------------------------
+# Una fila por usuario y día con algo ocupado: 96 bits de cuarto de hora
+# (12 bytes, bit más alto = 00:00-00:15). Un cuarto cuenta como ocupado si
+# cualquier evento lo toca, así que los huecos libres son conservadores. db.py
+# recalcula los días que toca cada escritura en la misma transacción (un OR no
+# se puede "restar": se rehace el día desde events, con la misma consulta
+# acotada sobre (user_id, start_at) que conflicts.py). Un evento que cruza la
+# medianoche marca los dos días. Igual que week_load, las series no se
+# materializan: se expanden al leer, solo dentro de la ventana pedida.
+# Huecos comunes de un grupo = OR de las matrices ocupadas de los miembros.
+# Privacidad: common_free_slots exige que quien consulta sea integrante y que
+# los demás hayan activado users.share_freebusy (busy_grid no comprueba nada).
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 1440 // SLOT_MINUTES
+BITMAP_BYTES = SLOTS_PER_DAY // 8
+DAY_GAP = 7              # días sueltos a más de una semana se recalculan con consultas separadas
+GROUP_MAX_USERS = 200
+GROUP_MAX_DAYS = 92
+FREE_COLUMNS = ["date", "start", "end", "minutes"]
+SERIES_COLUMNS = "user_id, date, start_at, end_at, rrule, exdates, until_date"   # lo que usa expand_series
+
+def epoch_day(d):
+    if not isinstance(d, date):
+        d = date.fromisoformat(str(d).strip()[:10])
+    return (d - EPOCH).days
+
+def busy_days(rows):
+    """Epoch days whose bitmap changes with these rows (one-off events only; series are read-time)."""
+    days = set()
+    for r in rows:
+        if r.get("rrule") or r.get("start_at") is None or r.get("end_at") is None:
+            continue
+        days.update(range(int(r["start_at"]) // 1440, (int(r["end_at"]) - 1) // 1440 + 1))
+    return days
+
+def _grid(rows_idx, start_at, end_at, n_rows, day0, n_days):
+    """Bool (n_rows, n_days, SLOTS_PER_DAY) busy grid from minute spans (clipped to the window)."""
+    n = n_days * SLOTS_PER_DAY
+    lo = day0 * SLOTS_PER_DAY
+    s = np.clip(start_at // SLOT_MINUTES - lo, 0, n)
+    e = np.clip(-(-end_at // SLOT_MINUTES) - lo, 0, n)
+    keep = e > s
+    # +1 / -1 en los bordes de cada intervalo; suma acumulada > 0 = ocupado
+    diff = np.zeros((n_rows, n + 1), dtype=np.int32)
+    np.add.at(diff, (rows_idx[keep], s[keep]), 1)
+    np.add.at(diff, (rows_idx[keep], e[keep]), -1)
+    return (np.cumsum(diff[:, :-1], axis=1) > 0).reshape(n_rows, n_days, SLOTS_PER_DAY)
+
+def _spans(df):
+    return df["start_at"].to_numpy(dtype=np.int64), df["end_at"].to_numpy(dtype=np.int64)
+
+def _clusters(days):
+    days = sorted(days)
+    group = [days[0]]
+    for d in days[1:]:
+        if d - group[-1] > DAY_GAP:
+            yield group
+            group = []
+        group.append(d)
+    yield group
+
+def refresh_busy(conn, user_id, days):
+    """Recompute the day_busy rows of these epoch days from the user's one-off events."""
+    if not days:
+        return
+    uid = int(user_id)
+    for group in _clusters(days):
+        day0, n_days = group[0], group[-1] - group[0] + 1
+        lo, hi = day0 * 1440, (day0 + n_days) * 1440
+        df = pd.read_sql(text("""
+        SELECT start_at, end_at FROM events
+        WHERE user_id=:u AND start_at > :lo AND start_at < :hi AND rrule IS NULL AND end_at IS NOT NULL
+        """), conn, params={"u": uid, "lo": lo - MAX_EVENT_MINUTES, "hi": hi})
+        sa, ea = _spans(df)
+        grid = _grid(np.zeros(len(df), dtype=np.intp), sa, ea, 1, day0, n_days)[0]
+        idx = np.array(group) - day0
+        busy = grid[idx].any(axis=1)
+        packed = np.packbits(grid[idx], axis=1)
+        rows = [{"u": uid, "d": int(d), "b": packed[i].tobytes()} for i, d in enumerate(group) if busy[i]]
+        empty = [int(d) for i, d in enumerate(group) if not busy[i]]
+        if rows:
+            conn.execute(text("""
+            INSERT INTO day_busy (user_id, day, bits) VALUES (:u, :d, :b)
+            ON CONFLICT (user_id, day) DO UPDATE SET bits = excluded.bits
+            """), rows)
+        if empty:
+            conn.execute(text("DELETE FROM day_busy WHERE user_id=:u AND day IN :days").bindparams(bindparam("days", expanding=True)),
+                         {"u": uid, "days": empty})
+
+def rebuild_busy(conn, user_id=None):
+    """Recompute day_busy from events (all users, or one)."""
+    where, params = ("WHERE user_id=:u", {"u": int(user_id)}) if user_id is not None else ("", {})
+    conn.execute(text(f"DELETE FROM day_busy {where}"), params)
+    df = pd.read_sql(text(f"""
+    SELECT user_id, start_at, end_at FROM events WHERE rrule IS NULL AND start_at IS NOT NULL AND end_at IS NOT NULL
+    {"AND user_id=:u" if where else ""}
+    """), conn, params=params)
+    for uid, ev in df.groupby("user_id"):
+        sa, ea = _spans(ev)
+        day0 = int(sa.min()) // 1440
+        n_days = (int(ea.max()) - 1) // 1440 - day0 + 1
+        grid = _grid(np.zeros(len(ev), dtype=np.intp), sa, ea, 1, day0, n_days)[0]
+        busy = np.flatnonzero(grid.any(axis=1))
+        packed = np.packbits(grid[busy], axis=1)
+        rows = [{"u": int(uid), "d": int(day0 + d), "b": packed[i].tobytes()} for i, d in enumerate(busy)]
+        if rows:
+            conn.execute(text("INSERT INTO day_busy (user_id, day, bits) VALUES (:u, :d, :b)"), rows)
+
+# ----------------------------
+# Quién comparte su disponibilidad
+# ----------------------------
+def shares_freebusy(user_id):
+    with engine.connect() as conn:
+        return bool(conn.execute(text("SELECT share_freebusy FROM users WHERE id=:u"), {"u": int(user_id)}).scalar())
+
+def set_share_freebusy(user_id, share):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET share_freebusy=:s WHERE id=:u"), {"s": int(bool(share)), "u": int(user_id)})
+
+def group_candidates(requester):
+    """{user_id: username} that `requester` may add to a group: themself plus the users who share their free/busy."""
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT id, username FROM users WHERE id=:me OR share_freebusy=1 ORDER BY username"),
+                                 {"me": int(requester)}).all())
+
+def _check_group(requester, ids):
+    if int(requester) not in ids:
+        raise ValueError("debes estar entre los integrantes")
+    with engine.connect() as conn:
+        allowed = set(conn.execute(text("SELECT id FROM users WHERE id IN :ids AND (id=:me OR share_freebusy=1)")
+                                   .bindparams(bindparam("ids", expanding=True)), {"ids": sorted(ids), "me": int(requester)}).scalars())
+    if ids - allowed:
+        raise ValueError("hay integrantes que no comparten su disponibilidad")
+
+# ----------------------------
+# Lecturas
+# ----------------------------
+def _series_grid(conn, ids, day0, n_days):
+    # ocurrencias de series en la ventana (desde el día anterior: las que cruzan la medianoche)
+    a = (EPOCH + timedelta(days=day0 - 1)).isoformat()
+    b = (EPOCH + timedelta(days=day0 + n_days - 1)).isoformat()
+    series = pd.read_sql(text(f"SELECT {SERIES_COLUMNS} FROM events WHERE user_id IN :ids AND {SERIES_WINDOW}").bindparams(bindparam("ids", expanding=True)),
+                         conn, params={"ids": ids, "a": a, "b": b})
+    occ = expand_series(series, a, b)
+    if occ.empty:
+        return None
+    pos = {u: i for i, u in enumerate(ids)}
+    sa, ea = _spans(occ)
+    return _grid(occ["user_id"].map(pos).to_numpy(dtype=np.intp), sa, ea, len(ids), day0, n_days)
+
+@timed("freebusy.busy_grid")
+def busy_grid(user_ids, date_from, date_to):
+    """Bool array (users, days, SLOTS_PER_DAY): True where each user is busy in [date_from, date_to]."""
+    ids = [int(u) for u in dict.fromkeys(user_ids)]
+    day0 = epoch_day(date_from)
+    n_days = epoch_day(date_to) - day0 + 1
+    grid = np.zeros((len(ids), max(n_days, 0), SLOTS_PER_DAY), dtype=bool)
+    if not ids or n_days <= 0:
+        return grid
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT user_id, day, bits FROM day_busy WHERE user_id IN :ids AND day BETWEEN :a AND :b")
+                            .bindparams(bindparam("ids", expanding=True)), {"ids": ids, "a": day0, "b": day0 + n_days - 1}).all()
+        series = _series_grid(conn, ids, day0, n_days)
+    if rows:
+        pos = {u: i for i, u in enumerate(ids)}
+        ui = np.fromiter((pos[r[0]] for r in rows), dtype=np.intp, count=len(rows))
+        di = np.fromiter((r[1] - day0 for r in rows), dtype=np.intp, count=len(rows))
+        bits = np.frombuffer(b"".join(bytes(r[2]) for r in rows), dtype=np.uint8).reshape(len(rows), BITMAP_BYTES)
+        grid[ui, di] = np.unpackbits(bits, axis=1).astype(bool)
+    if series is not None:
+        grid |= series
+    return grid
+
+def _free_runs(busy, min_slots):
+    # un cuarto "ocupado" de relleno al final de cada día: los huecos no cruzan de un día a otro
+    n_days = busy.shape[0]
+    flat = np.concatenate([~busy, np.zeros((n_days, 1), dtype=bool)], axis=1).ravel()
+    edges = np.diff(np.concatenate([[0], flat.astype(np.int8), [0]]))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    keep = ends - starts >= min_slots
+    return starts[keep], ends[keep]
+
+@timed("freebusy.common_free")
+def common_free_slots(requester, user_ids, date_from, date_to, min_minutes=60, day_start="08:00", day_end="22:00"):
+    """DataFrame (date, start, end, minutes) of the slots where every user is free, within day_start-day_end each day.
+
+    requester must be one of user_ids and the others must share their free/busy (ValueError otherwise).
+    Slots are whole quarter-hours at least min_minutes long; a run is reported once, at full length."""
+    if not user_ids:
+        raise ValueError("elige al menos un usuario")
+    ids = {int(u) for u in user_ids}
+    if len(ids) > GROUP_MAX_USERS:
+        raise ValueError(f"como máximo {GROUP_MAX_USERS} usuarios por consulta")
+    day0, day1 = epoch_day(date_from), epoch_day(date_to)
+    if day1 < day0 or day1 - day0 + 1 > GROUP_MAX_DAYS:
+        raise ValueError(f"el rango debe tener entre 1 y {GROUP_MAX_DAYS} días")
+    _check_group(requester, ids)
+    busy = busy_grid(user_ids, date_from, date_to).any(axis=0)
+    first = -(-time_to_minutes(parse_time_str_safe(day_start)) // SLOT_MINUTES)
+    last = time_to_minutes(parse_time_str_safe(day_end)) // SLOT_MINUTES or SLOTS_PER_DAY   # 00:00 = fin del día
+    busy[:, :first] = True
+    busy[:, last:] = True
+    min_slots = max(1, -(-int(min_minutes) // SLOT_MINUTES))
+    starts, ends = _free_runs(busy, min_slots)
+    if not len(starts):
+        return pd.DataFrame(columns=FREE_COLUMNS)
+    day, slot = np.divmod(starts, SLOTS_PER_DAY + 1)
+    n = ends - starts
+    return pd.DataFrame({
+        "date": pd.to_datetime(day0 + day, unit="D").strftime("%Y-%m-%d"),
+        "start": [minutes_to_hhmm(s * SLOT_MINUTES) for s in slot],
+        "end": [minutes_to_hhmm((s + k) * SLOT_MINUTES) if s + k < SLOTS_PER_DAY else "24:00" for s, k in zip(slot, n)],
+        "minutes": n * SLOT_MINUTES,
+    })
@@ -0,0 +1,275 @@
+import contextlib
+import contextvars
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ----------------------------
+# Instrumentation (opt-in)
+# ----------------------------
+# AGENDA_INSTRUMENT=1 activa timers/contadores en las funciones decoradas con
+# @timed y en cada consulta SQL del engine. Desactivado, @timed solo añade
+# una comprobación de un booleano por llamada.
+# - por rerun: begin_rerun()/end_rerun() en app.py (ContextVar: cada sesión
+#   de Streamlit corre en su propio hilo)
+# - por proceso: totales en formato Prometheus (prometheus_text, o servidor
+#   HTTP en AGENDA_METRICS_PORT)
+# - logs estructurados (JSON) en el logger "agenda.perf"; las consultas más
+#   lentas que SLOW_QUERY_MS salen como WARNING con la sesión que las lanzó
+ENABLED = os.environ.get("AGENDA_INSTRUMENT", os.environ.get("AGENDA_DEBUG", "0")) == "1"
+DEBUG_PANEL = os.environ.get("AGENDA_DEBUG", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("AGENDA_SLOW_QUERY_MS", "200"))
+SLOW_OP_MS = float(os.environ.get("AGENDA_SLOW_OP_MS", "1000"))
+METRICS_PORT = int(os.environ.get("AGENDA_METRICS_PORT", "0"))
+
+log = logging.getLogger("agenda.perf")
+
+def _log(level, event, **fields):
+    if log.isEnabledFor(level):
+        log.log(level, json.dumps(dict(fields, event=event, ts=round(time.time(), 3)), ensure_ascii=False, default=str))
+
+class RerunStats:
+    def __init__(self, session=None):
+        self.session = session
+        self.started = time.perf_counter()
+        self.ops = {}          # nombre -> [llamadas, segundos, filas]
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.slow_queries = 0
+
+    def add_op(self, name, seconds, rows):
+        op = self.ops.setdefault(name, [0, 0.0, 0])
+        op[0] += 1
+        op[1] += seconds
+        op[2] += rows
+
+    def fetched_rows(self):
+        # filas leídas de la base (no de la caché): operaciones db.fetch_*
+        return sum(op[2] for name, op in self.ops.items() if name.startswith("db.fetch"))
+
+_rerun = contextvars.ContextVar("agenda_rerun", default=None)
+_session = contextvars.ContextVar("agenda_session", default=None)
+
+# totales del proceso (todas las sesiones y los hilos de jobs)
+_lock = threading.Lock()
+_ops_total = {}            # nombre -> [llamadas, segundos, filas]
+_queries_total = [0, 0.0, 0]   # consultas, segundos, lentas
+_reruns_total = [0, 0.0]       # reruns, segundos
+
+def _rows_of(result):
+    if isinstance(result, tuple):
+        return sum(_rows_of(r) for r in result)
+    try:
+        return len(result) if hasattr(result, "__len__") and not isinstance(result, (str, bytes, dict)) else 0
+    except TypeError:
+        return 0
+
+def _record(name, seconds, rows):
+    with _lock:
+        op = _ops_total.setdefault(name, [0, 0.0, 0])
+        op[0] += 1
+        op[1] += seconds
+        op[2] += rows
+    stats = _rerun.get()
+    if stats is not None:
+        stats.add_op(name, seconds, rows)
+    level = logging.WARNING if seconds * 1000 >= SLOW_OP_MS else logging.DEBUG
+    _log(level, "op", op=name, ms=round(seconds * 1000, 2), rows=rows, session=_session.get(), thread=threading.current_thread().name)
+
+def timed(name):
+    """Decorator: time calls (and row counts of the result) under `name` when instrumentation is on.
+
+    Generator functions are timed over their whole iteration (e.g. streaming exports)."""
+    def deco(fn):
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    yield from fn(*args, **kwargs)
+                    return
+                elapsed, chunks, it = 0.0, 0, fn(*args, **kwargs)   # chunks: filas (o trozos de bytes)
+                try:
+                    while True:
+                        t0 = time.perf_counter()
+                        try:
+                            chunk = next(it)
+                        except StopIteration:
+                            elapsed += time.perf_counter() - t0
+                            return
+                        elapsed += time.perf_counter() - t0
+                        chunks += _rows_of(chunk) or 1
+                        yield chunk
+                finally:
+                    _record(name, elapsed, chunks)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            result = fn(*args, **kwargs)
+            _record(name, time.perf_counter() - t0, _rows_of(result))
+            return result
+        return wrapper
+    return deco
+
+# ----------------------------
+# Imports diferidos
+# ----------------------------
+# plotly, ics o google.generativeai solo se importan en la sección que los usa
+# (import_module) y el coste del primer import queda medido siempre (una vez por
+# módulo y proceso, así que no depende de ENABLED): sale en el log, en
+# import_table() y en Prometheus como agenda_import_seconds.
+_imports = {}   # módulo -> segundos del primer import
+
+def record_import(name, seconds):
+    with _lock:
+        if name in _imports:
+            return
+        _imports[name] = seconds
+    _log(logging.INFO, "import", module=name, ms=round(seconds * 1000, 2), thread=threading.current_thread().name)
+
+def import_module(name):
+    """importlib.import_module that records how long the first (cold) import took."""
+    mod = sys.modules.get(name)
+    if mod is not None:
+        return mod
+    t0 = time.perf_counter()
+    mod = importlib.import_module(name)
+    record_import(name, time.perf_counter() - t0)
+    return mod
+
+@contextlib.contextmanager
+def timed_imports(name):
+    """Time a block of import statements under `name` (only the first, cold run counts)."""
+    t0 = time.perf_counter()
+    yield
+    record_import(name, time.perf_counter() - t0)
+
+def import_table():
+    """Rows (módulo, ms) of the timed imports of this process, slowest first."""
+    with _lock:
+        items = list(_imports.items())
+    return sorted(({"módulo": k, "ms": round(v * 1000, 2)} for k, v in items), key=lambda row: -row["ms"])
+
+# ----------------------------
+# SQL (eventos del engine de SQLAlchemy)
+# ----------------------------
+def instrument_engine(engine):
+    """Count/time every SQL statement of engine (only attached when ENABLED)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("agenda_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("agenda_t0")
+        if not starts:
+            return
+        seconds = time.perf_counter() - starts.pop()
+        slow = seconds * 1000 >= SLOW_QUERY_MS
+        with _lock:
+            _queries_total[0] += 1
+            _queries_total[1] += seconds
+            _queries_total[2] += int(slow)
+        stats = _rerun.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += seconds
+            stats.slow_queries += int(slow)
+        if slow:
+            # sin parámetros: pueden llevar hashes de contraseña o notas privadas
+            _log(logging.WARNING, "slow_query", ms=round(seconds * 1000, 2), sql=" ".join(statement.split())[:300],
+                 executemany=executemany, session=_session.get(), thread=threading.current_thread().name)
+
+# ----------------------------
+# Reruns
+# ----------------------------
+def begin_rerun(session=None):
+    _session.set(session)
+    if not ENABLED:
+        return None
+    stats = RerunStats(session)
+    _rerun.set(stats)
+    return stats
+
+def end_rerun():
+    """Close the current rerun and return its RerunStats (None if instrumentation is off)."""
+    stats = _rerun.get()
+    if stats is None:
+        return None
+    _rerun.set(None)
+    seconds = time.perf_counter() - stats.started
+    with _lock:
+        _reruns_total[0] += 1
+        _reruns_total[1] += seconds
+    _log(logging.INFO, "rerun", session=stats.session, ms=round(seconds * 1000, 2), queries=stats.queries,
+         rows=stats.fetched_rows(), slow_queries=stats.slow_queries)
+    return stats
+
+def rerun_table(stats):
+    """Rows (op, calls, ms, rows) of a RerunStats, slowest first."""
+    return sorted(({"op": name, "llamadas": c, "ms": round(s * 1000, 2), "filas": r} for name, (c, s, r) in stats.ops.items()),
+                  key=lambda row: -row["ms"])
+
+def prometheus_text():
+    """Process-wide totals in Prometheus text exposition format."""
+    with _lock:
+        ops = {k: list(v) for k, v in _ops_total.items()}
+        q, r = list(_queries_total), list(_reruns_total)
+        imports = dict(_imports)
+    lines = [
+        "# HELP agenda_op_calls_total Calls of instrumented helpers.", "# TYPE agenda_op_calls_total counter",
+        *(f'agenda_op_calls_total{{op="{k}"}} {v[0]}' for k, v in sorted(ops.items())),
+        "# HELP agenda_op_seconds_total Time spent in instrumented helpers.", "# TYPE agenda_op_seconds_total counter",
+        *(f'agenda_op_seconds_total{{op="{k}"}} {v[1]:.6f}' for k, v in sorted(ops.items())),
+        "# HELP agenda_op_rows_total Rows returned by instrumented helpers.", "# TYPE agenda_op_rows_total counter",
+        *(f'agenda_op_rows_total{{op="{k}"}} {v[2]}' for k, v in sorted(ops.items())),
+        "# HELP agenda_db_queries_total SQL statements executed.", "# TYPE agenda_db_queries_total counter",
+        f"agenda_db_queries_total {q[0]}",
+        "# HELP agenda_db_query_seconds_total Time spent executing SQL.", "# TYPE agenda_db_query_seconds_total counter",
+        f"agenda_db_query_seconds_total {q[1]:.6f}",
+        "# HELP agenda_db_slow_queries_total SQL statements slower than the slow-query threshold.", "# TYPE agenda_db_slow_queries_total counter",
+        f"agenda_db_slow_queries_total {q[2]}",
+        "# HELP agenda_reruns_total Streamlit reruns.", "# TYPE agenda_reruns_total counter",
+        f"agenda_reruns_total {r[0]}",
+        "# HELP agenda_rerun_seconds_total Time spent in reruns.", "# TYPE agenda_rerun_seconds_total counter",
+        f"agenda_rerun_seconds_total {r[1]:.6f}",
+        "# HELP agenda_import_seconds Time of the first import of lazily imported modules.", "# TYPE agenda_import_seconds gauge",
+        *(f'agenda_import_seconds{{module="{k}"}} {v:.6f}' for k, v in sorted(imports.items())),
+    ]
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = prometheus_text().encode("utf-8")
+        self.send_response(200 if self.path.rstrip("/") in ("", "/metrics") else 404)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on `port` in a daemon thread (once per process); no-op if port is 0."""
+    global _server
+    with _lock:
+        if _server is not None or not port:
+            return _server
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, name="agenda-metrics", daemon=True).start()
+    return _server
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from db import events_version
+from optimizer import local_optimizer_impl
+
+# ----------------------------
+# Background optimization jobs
+# ----------------------------
+# El pool vive a nivel de proceso: los reruns de Streamlit solo guardan el
+# job_id en session_state y consultan estado/progreso/resultado aquí.
+# Hilos (no procesos): el resultado queda en memoria sin serializar y la
+# cancelación es un threading.Event que los solvers revisan junto al deadline.
+JOB_WORKERS = int(os.environ.get("AGENDA_JOB_WORKERS", "2"))
+JOBS_KEEP = 200          # trabajos terminados que se conservan en memoria
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="agenda-opt")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+class Job:
+    def __init__(self, user_id, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.params = params
+        self.status = "queued"      # queued | running | done | cancelled | error
+        self.progress = 0.0
+        self.message = ""
+        self.result = None
+        self.error = None
+        self.version = events_version(user_id)   # versión de la agenda usada para el plan
+        self.created = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "cancelled", "error")
+
+    def is_stale(self):
+        """True if the user's agenda changed after this plan was computed."""
+        return events_version(self.user_id) != self.version
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _report(self, fraction, message=""):
+        self.progress = fraction
+        self.message = message
+
+def _run(job):
+    if job._cancel.is_set():
+        job.status, job.finished_at = "cancelled", time.time()
+        return
+    job.status = "running"
+    try:
+        job.result = local_optimizer_impl(job.user_id, cancel=job._cancel, progress=job._report, **job.params)
+        job.status = "cancelled" if job._cancel.is_set() else "done"
+    except Exception as e:
+        job.error = f"{e}"
+        job.message = traceback.format_exc(limit=3)
+        job.status = "error"
+    job.finished_at = time.time()
+
+def submit_optimization(user_id, **params):
+    """Queue local_optimizer_impl(user_id, **params) and return the job id."""
+    job = Job(user_id, params)
+    with _jobs_lock:
+        # un trabajo activo por usuario: el anterior se cancela
+        for other in _jobs.values():
+            if other.user_id == user_id and not other.finished:
+                other.cancel()
+        _jobs[job.id] = job
+        _prune()
+    _executor.submit(_run, job)
+    return job.id
+
+def get_job(job_id):
+    if not job_id:
+        return None
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def cancel_job(job_id):
+    job = get_job(job_id)
+    if job is not None:
+        job.cancel()
+
+def _prune():
+    done = sorted((j for j in _jobs.values() if j.finished), key=lambda j: j.finished_at)
+    for j in done[:max(0, len(done) - JOBS_KEEP)]:
+        del _jobs[j.id]
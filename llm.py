@@ -0,0 +1,203 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from aggregates import LOAD_GROUPS, load_trend, week_hours
+from db import get_event_set
+from instrumentation import import_module, timed
+from metrics import burnout_from_load
+
+# ----------------------------
+# Análisis con LLM (Gemini opcional)
+# ----------------------------
+# El prompt no lleva la agenda entera: horas por semana (week_load) de las
+# últimas semanas + los eventos de los próximos 7 días, recortado a
+# PROMPT_MAX_CHARS. Las llamadas corren en un pool pequeño (límite de
+# concurrencia) fuera del hilo del rerun; las respuestas se guardan por hash
+# del prompt con TTL, así el mismo análisis repetido no vuelve a llamar al modelo.
+# AGENDA_LLM_BACKEND: "gemini", "stub" (respuesta local, sin red) o vacío =
+# gemini si hay GEMINI_API_KEY.
+LLM_BACKEND = os.environ.get("AGENDA_LLM_BACKEND", "").lower()
+LLM_MODEL = os.environ.get("AGENDA_LLM_MODEL", "gemini-2.5-flash")
+LLM_WORKERS = int(os.environ.get("AGENDA_LLM_WORKERS", "2"))
+LLM_TIMEOUT = float(os.environ.get("AGENDA_LLM_TIMEOUT", "60"))
+LLM_CACHE_TTL = float(os.environ.get("AGENDA_LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = 256
+LLM_USER_INTERVAL = float(os.environ.get("AGENDA_LLM_USER_INTERVAL", "30"))   # segundos entre llamadas nuevas por usuario
+MAX_OUTPUT_TOKENS = 600
+PROMPT_MAX_CHARS = 6000      # ~1500 tokens
+SUMMARY_WEEKS = 8
+GOALS_MAX_CHARS = 600
+
+class LLMRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"espera {int(retry_after) + 1} s antes de pedir otro análisis")
+        self.retry_after = retry_after
+
+def backend_name():
+    """Active backend ("gemini" or "stub") or None if none is configured."""
+    if LLM_BACKEND in ("gemini", "stub"):
+        return LLM_BACKEND
+    return "gemini" if os.environ.get("GEMINI_API_KEY") else None
+
+# ----------------------------
+# Prompt compacto
+# ----------------------------
+DAY_ABBR = ["Lu", "Ma", "Mi", "Ju", "Vi", "Sa", "Do"]
+
+@timed("llm.build_prompt")
+def build_prompt(user_id, goals="", today=None):
+    today = today or date.today()
+    trend = load_trend(user_id, until=today, weeks=SUMMARY_WEEKS)
+    burn = burnout_from_load(week_hours(user_id, today))
+    lines = ["HORAS POR SEMANA (lunes; " + "/".join(LOAD_GROUPS) + "):"]
+    lines += [f"{wk}: " + "/".join(f"{row[g]:.1f}" for g in LOAD_GROUPS) for wk, row in trend.iterrows()]
+    lines.append(f"RIESGO DE BURNOUT (semana actual): {burn['risk']} ({burn['score']:.2f})")
+    upcoming = get_event_set(user_id, today, today + timedelta(days=6))
+    events = []
+    for i in range(len(upcoming)):
+        r = upcoming.row(i)
+        d = date.fromisoformat(r["date"])
+        events.append(f"{DAY_ABBR[d.weekday()]} {d:%d/%m} {r['start']}-{r['end']} {r['category']}·{r['title']}" + (" [fijo]" if r["fixed"] else ""))
+    goals = (goals or "").strip()[:GOALS_MAX_CHARS] or "(sin objetivos indicados)"
+    head = (
+        "Eres un asistente experto en productividad para estudiantes universitarios de carreras TIC.\n"
+        "Analiza el resumen de la agenda y los objetivos.\n\n" + "\n".join(lines) + "\n\nPRÓXIMOS 7 DÍAS:\n"
+    )
+    tail = (
+        f"\n\nOBJETIVOS:\n{goals}\n\n"
+        "Devuelve: diagnóstico (breve), riesgos de burnout, recomendaciones priorizadas y un calendario alternativo de bloques (formato tabla)."
+    )
+    budget = PROMPT_MAX_CHARS - len(head) - len(tail)
+    kept, used = [], 0
+    for ev in events:
+        if used + len(ev) + 1 > budget - 40:
+            kept.append(f"(+{len(events) - len(kept)} eventos omitidos)")
+            break
+        kept.append(ev)
+        used += len(ev) + 1
+    return head + ("\n".join(kept) or "(sin eventos)") + tail
+
+# ----------------------------
+# Backends
+# ----------------------------
+_gemini_lock = threading.Lock()
+_gemini_model = None
+
+def _gemini(prompt):
+    global _gemini_model
+    with _gemini_lock:
+        # import + configure una vez por proceso, no en cada clic
+        if _gemini_model is None:
+            genai = import_module("google.generativeai")
+            genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+            _gemini_model = genai.GenerativeModel(LLM_MODEL)
+        model = _gemini_model
+    resp = model.generate_content(prompt, generation_config={"max_output_tokens": MAX_OUTPUT_TOKENS},
+                                  request_options={"timeout": LLM_TIMEOUT})
+    return getattr(resp, "text", None) or str(resp)
+
+def _stub(prompt):
+    # determinista y sin red: para pruebas y desarrollo sin clave
+    risk = next((l for l in prompt.splitlines() if l.startswith("RIESGO")), "")
+    n_events = prompt.split("PRÓXIMOS 7 DÍAS:\n", 1)[-1].split("\n\nOBJETIVOS:", 1)[0].count("\n") + 1
+    return (f"**Diagnóstico (stub):** {risk or 'sin datos de carga'}.\n\n"
+            f"- Próximos 7 días: {n_events} líneas de agenda revisadas.\n"
+            f"- Prompt de {len(prompt)} caracteres (hash {prompt_key('stub', prompt)[:8]}).")
+
+BACKENDS = {"gemini": _gemini, "stub": _stub}
+
+# ----------------------------
+# Peticiones asíncronas + caché por contenido
+# ----------------------------
+_executor = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="agenda-llm")
+_lock = threading.Lock()
+_requests = OrderedDict()   # key (hash) -> Analysis; hace de caché de respuestas
+_last_call = {}             # user_id -> time.monotonic() de la última llamada no cacheada
+
+class Analysis:
+    def __init__(self, key, backend):
+        self.key = key
+        self.backend = backend
+        self.status = "queued"      # queued | running | done | error
+        self.text = None
+        self.error = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished_at = None
+        self.hits = 0               # veces servido desde la caché
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def expired(self, now):
+        return self.status == "done" and now - self.finished_at > LLM_CACHE_TTL
+
+def prompt_key(backend, prompt):
+    return hashlib.sha256(f"{backend}\0{LLM_MODEL}\0{prompt}".encode("utf-8")).hexdigest()
+
+@timed("llm.call")
+def _call(backend, prompt):
+    return BACKENDS[backend](prompt)
+
+def _run(a, prompt):
+    a.status, a.started = "running", time.monotonic()
+    try:
+        out, err = _call(a.backend, prompt), None
+    except Exception as e:
+        out, err = None, f"{e}"
+    with _lock:
+        if a.status != "running":
+            return   # ya se dio por vencida (timeout): se descarta
+        a.text, a.error = out, err
+        a.status = "error" if err else "done"
+        a.finished_at = time.monotonic()
+
+def submit_analysis(user_id, goals="", today=None):
+    """Key of the analysis for this user's summary + goals; queued unless cached or already running.
+
+    Raises LLMRateLimited if the user asked for a new (uncached) analysis too recently,
+    RuntimeError if no backend is configured."""
+    backend = backend_name()
+    if backend is None:
+        raise RuntimeError("GEMINI_API_KEY no configurada en el entorno.")
+    prompt = build_prompt(user_id, goals, today)
+    key = prompt_key(backend, prompt)
+    now = time.monotonic()
+    with _lock:
+        a = _requests.get(key)
+        if a is not None and a.status != "error" and not a.expired(now):
+            if a.finished:
+                a.hits += 1
+            _requests.move_to_end(key)
+            return key
+        last = _last_call.get(user_id)
+        if last is not None and now - last < LLM_USER_INTERVAL:
+            raise LLMRateLimited(LLM_USER_INTERVAL - (now - last))
+        _last_call[user_id] = now
+        a = _requests[key] = Analysis(key, backend)
+        _prune(now)
+    _executor.submit(_run, a, prompt)
+    return key
+
+def get_analysis(key):
+    """Analysis for key (None if unknown or evicted); running calls past LLM_TIMEOUT become errors."""
+    if not key:
+        return None
+    with _lock:
+        a = _requests.get(key)
+        if a is not None and not a.finished and a.started is not None and time.monotonic() - a.started > LLM_TIMEOUT:
+            a.status, a.error, a.finished_at = "error", f"tiempo agotado ({LLM_TIMEOUT:.0f} s)", time.monotonic()
+        return a
+
+def _prune(now):
+    for k in [k for k, a in _requests.items() if a.expired(now)]:
+        del _requests[k]
+    finished = [k for k, a in _requests.items() if a.finished]
+    for k in finished[:max(0, len(_requests) - LLM_CACHE_MAX_ENTRIES)]:
+        del _requests[k]
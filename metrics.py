@@ -0,0 +1,155 @@
+from datetime import datetime, date, time, timedelta
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import timed
+
+# ----------------------------
+# HELPERS: parse time / durations / energy / burnout
+# ----------------------------
+STUDY_CATEGORIES = ["Estudio","Tarea","Tesis","Clase","Proyecto TI","Investigación"]
+
+def parse_time_str_safe(s):
+    """Return datetime.time from multiple input formats, fallback to 00:00."""
+    if isinstance(s, time):
+        return s
+    if not isinstance(s, str):
+        return datetime.strptime("00:00", "%H:%M").time()
+    # try likely formats
+    for fmt in ("%H:%M", "%H:%M:%S"):
+        try:
+            return datetime.strptime(s, fmt).time()
+        except:
+            pass
+    try:
+        return datetime.fromisoformat(s).time()
+    except:
+        return datetime.strptime("00:00", "%H:%M").time()
+
+def dur_hours(start_s, end_s):
+    s = parse_time_str_safe(start_s)
+    e = parse_time_str_safe(end_s)
+    start_dt = datetime.combine(date.min, s)
+    end_dt = datetime.combine(date.min, e)
+    if end_dt <= start_dt:
+        end_dt += timedelta(days=1)
+    return (end_dt - start_dt).total_seconds()/3600.0
+
+def hour_energy(h):
+    # heuristic energy factor (0..1)
+    if 9 <= h < 12: return 0.95
+    if 16 <= h < 20: return 0.92
+    if 6 <= h < 9: return 0.75
+    if 12 <= h < 16: return 0.78
+    if 20 <= h < 23: return 0.6
+    return 0.35
+
+# energía por minuto del día, duplicada para cubrir eventos que cruzan medianoche;
+# la media de un intervalo [s, s+d) es (CUM[s+d] - CUM[s]) / d
+MINUTE_ENERGY = np.array([hour_energy(m // 60) for m in range(1440)], dtype=np.float64)
+_ENERGY_CUM = np.concatenate([[0.0], np.cumsum(np.tile(MINUTE_ENERGY, 2))])
+
+def mean_energy(start_m, dur_m):
+    """Mean hour_energy over [start_m, start_m+dur_m) minutes (scalars or arrays)."""
+    return (_ENERGY_CUM[start_m + dur_m] - _ENERGY_CUM[start_m]) / dur_m
+
+def event_energy_score(row):
+    s = time_to_minutes(parse_time_str_safe(row["start"]))
+    d = _wrap_duration(s, time_to_minutes(parse_time_str_safe(row["end"])))
+    return float(mean_energy(s, d))
+
+def time_to_minutes(t):
+    return t.hour*60 + t.minute
+
+def minutes_to_hhmm(m):
+    m = int(m) % 1440
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+EPOCH = date(1970, 1, 1)
+
+def epoch_span(date_s, start_s, end_s):
+    """(start_at, end_at) in epoch minutes (local wall time); end wraps past midnight."""
+    day = (date.fromisoformat(str(date_s).strip()[:10]) - EPOCH).days
+    s = time_to_minutes(parse_time_str_safe(start_s))
+    d = _wrap_duration(s, time_to_minutes(parse_time_str_safe(end_s)))
+    return day*1440 + s, day*1440 + s + d
+
+def _wrap_duration(start_m, end_m):
+    # fin <= inicio => el evento termina al día siguiente (igual que dur_hours)
+    return (end_m - start_m - 1) % 1440 + 1
+
+# ----------------------------
+# Column-level engine (sin apply por fila)
+# ----------------------------
+def minutes_of_day(values):
+    """Vectorized parse_time_str_safe: minute-of-day int32 array."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    # cada hora distinta se parsea una sola vez (son pocas: a lo sumo 1440)
+    table = np.array([time_to_minutes(parse_time_str_safe(u)) for u in uniques] + [0], dtype=np.int32)
+    return table[codes]   # el centinela -1 (NaN/None) cae en el 0 final
+
+def _has_epoch(df):
+    return "start_at" in df.columns and len(df) and df["start_at"].notna().all() and df["end_at"].notna().all()
+
+def span_minutes(df):
+    """(start_minute, duration_minutes) arrays for an events frame."""
+    if _has_epoch(df):
+        # columnas tipadas (migración 3): sin parseo de strings
+        start_at = df["start_at"].to_numpy(dtype=np.int64)
+        return (start_at % 1440).astype(np.int32), (df["end_at"].to_numpy(dtype=np.int64) - start_at).astype(np.int32)
+    start_m = minutes_of_day(df["start"])
+    end_m = minutes_of_day(df["end"])
+    return start_m, _wrap_duration(start_m, end_m)
+
+def event_datetimes(df):
+    """(start_dt, end_dt) datetime64 Series; end wraps past midnight."""
+    if _has_epoch(df):
+        return (pd.Series(pd.to_datetime(df["start_at"].to_numpy(dtype=np.int64), unit="m"), index=df.index),
+                pd.Series(pd.to_datetime(df["end_at"].to_numpy(dtype=np.int64), unit="m"), index=df.index))
+    day = pd.to_datetime(df["date"], errors="coerce")
+    start_m, dur_m = span_minutes(df)
+    start_dt = day + pd.to_timedelta(start_m, unit="m")
+    return start_dt, start_dt + pd.to_timedelta(dur_m, unit="m")
+
+def durations_hours(df):
+    _, dur_m = span_minutes(df)
+    return pd.Series(dur_m / 60.0, index=df.index)
+
+def energy_scores(df):
+    start_m, dur_m = span_minutes(df)
+    return pd.Series(mean_energy(start_m, dur_m), index=df.index)
+
+@timed("metrics.burnout_score")
+def burnout_score(events_df):
+    """Burnout from an events DataFrame or an EventSet (eventset.py)."""
+    if not len(events_df):
+        return {"score": 0.2, "risk": "Bajo", "notes": "No hay datos."}
+    if hasattr(events_df, "category_mask"):
+        ev = events_df
+        return burnout_from_hours(ev.hours(ev.category_mask(STUDY_CATEGORIES)), ev.hours(ev.category_mask(["Trabajo"])),
+                                  ev.hours(ev.category_mask(["Sueño"])))
+    dur = durations_hours(events_df)
+    return burnout_from_hours(dur[events_df["category"].isin(STUDY_CATEGORIES)].sum(),
+                              dur[events_df["category"]=="Trabajo"].sum(),
+                              dur[events_df["category"]=="Sueño"].sum())
+
+@timed("metrics.burnout_from_load")
+def burnout_from_load(hours):
+    """burnout_score from one week of aggregates.week_hours()."""
+    if not any(hours.values()):
+        return {"score": 0.2, "risk": "Bajo", "notes": "No hay datos."}
+    return burnout_from_hours(hours["study"], hours["work"], hours["sleep"])
+
+def burnout_from_hours(total_study, total_work, sleep):
+    desired_sleep = 7 * 7.0  # 49h/week -> 7h/night
+    sleep_factor = min(1.0, sleep / desired_sleep)
+    study_factor = min(1.0, total_study / 20.0)
+    work_factor = min(1.0, total_work / 30.0)
+    score = 0.5*(1 - sleep_factor) + 0.3*(study_factor) + 0.2*(work_factor)
+    score = float(max(0.0, min(1.0, score)))
+    if score < 0.3: risk = "Bajo"
+    elif score < 0.6: risk = "Medio"
+    else: risk = "Alto"
+    notes = f"Semana: Estudio {total_study:.1f}h, Trabajo {total_work:.1f}h, Sueño {sleep:.1f}h."
+    return {"score": score, "risk": risk, "notes": notes}
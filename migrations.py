@@ -0,0 +1,300 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+# ----------------------------
+# Schema migrations
+# ----------------------------
+# Cada migración es (versión, descripción, función(conn)). La versión aplicada
+# se guarda en schema_version; migrate() aplica en orden las pendientes, cada
+# una en su propia transacción. Para cambiar el esquema: añadir una nueva
+# entrada al final de MIGRATIONS (nunca editar una ya publicada).
+# Las migraciones de datos importan sus helpers (pandas/numpy) dentro de la
+# función: migrate() sobre una base al día no los carga (pantalla de acceso).
+
+def _columns(conn, table):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+def _pk(conn):
+    if conn.dialect.name == "sqlite":
+        return "INTEGER PRIMARY KEY AUTOINCREMENT"
+    return "SERIAL PRIMARY KEY"
+
+def _m1_base_tables(conn):
+    # esquema original de app.py (las bases existentes ya lo tienen)
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS users (
+        id {_pk(conn)},
+        username TEXT UNIQUE,
+        password TEXT
+    )
+    """))
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS events (
+        id {_pk(conn)},
+        user_id INTEGER,
+        title TEXT,
+        category TEXT,
+        date TEXT,
+        start TEXT,
+        "end" TEXT,
+        fixed INTEGER,
+        notes TEXT,
+        priority TEXT
+    )
+    """))
+
+def _m2_user_profile(conn):
+    # columnas que crear_base.py añadía y app.py no
+    cols = _columns(conn, "users")
+    for name, kind in (("nombre", "TEXT"), ("carrera", "TEXT"), ("semestre", "INTEGER")):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} {kind}"))
+
+def _m3_typed_events(conn):
+    # reconstruye events con restricciones + start_at/end_at en minutos epoch
+    conn.execute(text(f"""
+    CREATE TABLE events_new (
+        id {_pk(conn)},
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        category TEXT,
+        date TEXT NOT NULL,
+        start TEXT NOT NULL,
+        "end" TEXT NOT NULL,
+        fixed INTEGER NOT NULL DEFAULT 0 CHECK (fixed IN (0, 1)),
+        notes TEXT,
+        priority TEXT DEFAULT 'Media',
+        start_at INTEGER,
+        end_at INTEGER,
+        CONSTRAINT fk_user FOREIGN KEY (user_id) REFERENCES users(id),
+        CHECK (end_at > start_at)
+    )
+    """))
+    conn.execute(text("""
+    INSERT INTO events_new (id, user_id, title, category, date, start, "end", fixed, notes, priority)
+    SELECT id, user_id, COALESCE(title, ''), category, COALESCE(date, ''), COALESCE(start, '00:00'), COALESCE("end", '00:00'),
+           CASE WHEN fixed IS NULL OR fixed = 0 THEN 0 ELSE 1 END, notes, COALESCE(priority, 'Media')
+    FROM events WHERE user_id IS NOT NULL
+    """))
+    conn.execute(text("DROP TABLE events"))
+    conn.execute(text("ALTER TABLE events_new RENAME TO events"))
+    if conn.dialect.name == "postgresql":
+        # los ids se copiaron explícitamente: la secuencia debe seguir desde el máximo
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('events', 'id'), COALESCE(MAX(id), 1)) FROM events"))
+    backfill_epoch_columns(conn)
+
+def backfill_epoch_columns(conn, batch_size=5000):
+    """Fill start_at/end_at from the TEXT date/start/end columns where missing."""
+    from metrics import epoch_span
+    last = 0
+    while True:
+        rows = conn.execute(text("""
+        SELECT id, date, start, "end" FROM events WHERE start_at IS NULL AND id > :last ORDER BY id LIMIT :n
+        """), {"last": last, "n": batch_size}).all()
+        if not rows:
+            return
+        params = []
+        for eid, d, s, e in rows:
+            try:
+                a, b = epoch_span(d, s, e)
+            except (ValueError, TypeError):
+                continue   # fecha inválida: queda NULL y los lectores usan el texto
+            params.append({"id": eid, "a": a, "b": b})
+        if params:
+            conn.execute(text("UPDATE events SET start_at=:a, end_at=:b WHERE id=:id"), params)
+        last = rows[-1][0]
+
+def _m4_indexes(conn):
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_user_date ON events (user_id, date, start)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_user_start_at ON events (user_id, start_at)"))
+
+def _m5_week_load(conn):
+    # agregados semanales por grupo de categoría (ver aggregates.py)
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS week_load (
+        user_id INTEGER NOT NULL,
+        week_start TEXT NOT NULL,
+        grp TEXT NOT NULL,
+        minutes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, week_start, grp)
+    )
+    """))
+    from aggregates import rebuild_week_load
+    rebuild_week_load(conn)
+
+def _m6_recurrence(conn):
+    # series: una fila con la regla; until_date = última ocurrencia (NULL si no tiene fin)
+    cols = _columns(conn, "events")
+    for name in ("rrule", "exdates", "until_date"):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE events ADD COLUMN {name} TEXT"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_user_series ON events (user_id, date) WHERE rrule IS NOT NULL"))
+
+def _m7_batch_results(conn):
+    # resultados del lote nocturno (batch.py); la UI solo los lee
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS batch_runs (
+        id {_pk(conn)},
+        run_date TEXT NOT NULL,
+        mode TEXT,
+        started_at TEXT,
+        finished_at TEXT,
+        n_users INTEGER,
+        n_errors INTEGER
+    )
+    """))
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS batch_results (
+        run_id INTEGER NOT NULL REFERENCES batch_runs(id),
+        user_id INTEGER NOT NULL,
+        week_start TEXT,
+        score REAL,
+        risk TEXT,
+        notes TEXT,
+        existing_study REAL,
+        target_week REAL,
+        objective REAL,
+        error TEXT,
+        PRIMARY KEY (run_id, user_id)
+    )
+    """))
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS batch_suggestions (
+        run_id INTEGER NOT NULL REFERENCES batch_runs(id),
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        event_id INTEGER,
+        date TEXT,
+        start TEXT,
+        "end" TEXT,
+        detail TEXT
+    )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_batch_results_user ON batch_results (user_id, run_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_batch_suggestions_run_user ON batch_suggestions (run_id, user_id)"))
+
+def _m8_full_text(conn):
+    # búsqueda por título/notas (db.search_text). SQLite: FTS5 de contenido
+    # externo sincronizada por triggers; PostgreSQL: índice GIN de tsvector.
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_events_fts ON events
+        USING GIN (to_tsvector('simple', COALESCE(title, '') || ' ' || COALESCE(notes, '')))
+        """))
+        return
+    try:
+        conn.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+            title, notes, content='events', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """))
+    except OperationalError:
+        return   # SQLite sin FTS5: search_text cae a LIKE
+    conn.execute(text("""
+    CREATE TRIGGER IF NOT EXISTS events_fts_ai AFTER INSERT ON events BEGIN
+        INSERT INTO events_fts (rowid, title, notes) VALUES (new.id, new.title, new.notes);
+    END
+    """))
+    conn.execute(text("""
+    CREATE TRIGGER IF NOT EXISTS events_fts_ad AFTER DELETE ON events BEGIN
+        INSERT INTO events_fts (events_fts, rowid, title, notes) VALUES ('delete', old.id, old.title, old.notes);
+    END
+    """))
+    conn.execute(text("""
+    CREATE TRIGGER IF NOT EXISTS events_fts_au AFTER UPDATE OF title, notes ON events BEGIN
+        INSERT INTO events_fts (events_fts, rowid, title, notes) VALUES ('delete', old.id, old.title, old.notes);
+        INSERT INTO events_fts (rowid, title, notes) VALUES (new.id, new.title, new.notes);
+    END
+    """))
+    conn.execute(text("INSERT INTO events_fts (events_fts) VALUES ('rebuild')"))
+
+def _m9_change_feed(conn):
+    # sincronización incremental (db.changes_since, feed.py): rev por usuario
+    # que sube con cada escritura, lápidas para los borrados, SEQUENCE de iCal
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    cols = _columns(conn, "events")
+    for name, kind in (("created_at", "TEXT"), ("updated_at", "TEXT"), ("rev", "INTEGER NOT NULL DEFAULT 1"),
+                       ("sequence", "INTEGER NOT NULL DEFAULT 0")):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE events ADD COLUMN {name} {kind}"))
+    conn.execute(text("UPDATE events SET created_at=:t, updated_at=:t WHERE created_at IS NULL"), {"t": now})
+    cols = _columns(conn, "users")
+    for name, kind in (("events_rev", "INTEGER NOT NULL DEFAULT 1"), ("events_modified", "TEXT"), ("feed_key", "TEXT")):
+        if name not in cols:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} {kind}"))
+    conn.execute(text("UPDATE users SET events_modified=:t WHERE events_modified IS NULL"), {"t": now})
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS event_tombstones (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        rev INTEGER NOT NULL,
+        sequence INTEGER NOT NULL DEFAULT 0,
+        deleted_at TEXT NOT NULL
+    )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_events_user_rev ON events (user_id, rev)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_tombstones_user_rev ON event_tombstones (user_id, rev)"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_feed_key ON users (feed_key)"))
+
+def _m10_day_busy(conn):
+    # mapas de ocupación por usuario y día, 96 cuartos de hora (ver freebusy.py)
+    blob = "BYTEA" if conn.dialect.name == "postgresql" else "BLOB"
+    conn.execute(text(f"""
+    CREATE TABLE IF NOT EXISTS day_busy (
+        user_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        bits {blob} NOT NULL,
+        PRIMARY KEY (user_id, day)
+    )
+    """))
+    from freebusy import rebuild_busy
+    rebuild_busy(conn)
+
+def _m11_share_freebusy(conn):
+    # opt-in: solo quien lo activa aparece en el buscador de huecos comunes de otros
+    if "share_freebusy" not in _columns(conn, "users"):
+        conn.execute(text("ALTER TABLE users ADD COLUMN share_freebusy INTEGER NOT NULL DEFAULT 0"))
+
+MIGRATIONS = [
+    (1, "tablas base users/events", _m1_base_tables),
+    (2, "columnas de perfil en users", _m2_user_profile),
+    (3, "events con restricciones y start_at/end_at (minutos epoch)", _m3_typed_events),
+    (4, "índices de events", _m4_indexes),
+    (5, "tabla week_load (horas por semana y grupo)", _m5_week_load),
+    (6, "eventos recurrentes (rrule, exdates, until_date)", _m6_recurrence),
+    (7, "tablas de resultados del lote nocturno", _m7_batch_results),
+    (8, "búsqueda de texto en título/notas (FTS5 / GIN)", _m8_full_text),
+    (9, "created_at/updated_at, rev y lápidas para sincronización incremental", _m9_change_feed),
+    (10, "tabla day_busy (ocupación por cuartos de hora)", _m10_day_busy),
+    (11, "users.share_freebusy (compartir disponibilidad, opt-in)", _m11_share_freebusy),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def current_version(conn):
+    conn.execute(text("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TEXT
+    )
+    """))
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def migrate(engine, target=SCHEMA_VERSION):
+    """Apply pending migrations up to target; returns the list of versions applied."""
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        if version > target:
+            break
+        with engine.begin() as conn:
+            # se vuelve a leer dentro de la transacción por si otro proceso ya migró
+            if current_version(conn) >= version:
+                continue
+            fn(conn)
+            conn.execute(text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                         {"v": version, "d": description, "t": datetime.now().isoformat(timespec="seconds")})
+        applied.append(version)
+    return applied
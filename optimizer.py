@@ -0,0 +1,432 @@
+import math
+import random
+import time as _time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from aggregates import week_hours
+from db import get_event_set
+from eventset import EventSet
+from instrumentation import timed
+from metrics import EPOCH, STUDY_CATEGORIES, mean_energy, minutes_to_hhmm
+
+DAY_START = 6*60    # 06:00
+DAY_END = 22*60     # 22:00
+
+# ----------------------------
+# Per-day busy interval index
+# ----------------------------
+def as_event_set(events):
+    # el optimizador trabaja sobre EventSet; un DataFrame (p.ej. del lote) se convierte una vez
+    return EventSet.from_frame(events) if isinstance(events, pd.DataFrame) else events
+
+class DayIntervalIndex:
+    """Sorted, merged busy intervals (minute-of-day) per date, built once per run."""
+
+    def __init__(self, events):
+        self._days = {}
+        events = as_event_set(events)
+        if not len(events):
+            return
+        end_m = events.start_m.astype(np.int32) + events.dur_m
+        raw = {}
+        for day, s, e in zip(events.day.tolist(), events.start_m.tolist(), end_m.tolist()):
+            d = EPOCH + timedelta(days=day)
+            raw.setdefault(d, []).append((s, min(e, 1440)))
+            if e > 1440:
+                # cruza medianoche: el resto ocupa la mañana del día siguiente
+                raw.setdefault(d + timedelta(days=1), []).append((0, e - 1440))
+        for d, intervals in raw.items():
+            self._days[d] = _merge(intervals)
+
+    def busy(self, d):
+        return self._days.get(d, [])
+
+    def free_gaps(self, d, min_len, lo=DAY_START, hi=DAY_END):
+        """Free [a, b) gaps of length >= min_len inside [lo, hi) by a merge sweep."""
+        gaps = []
+        cur = lo
+        for a, b in self._days.get(d, []):
+            if b <= cur:
+                continue
+            if a >= hi:
+                break
+            if a - cur >= min_len:
+                gaps.append((cur, a))
+            cur = max(cur, b)
+        if hi - cur >= min_len:
+            gaps.append((cur, hi))
+        return gaps
+
+    def candidates(self, d, dur_m, lo=DAY_START, hi=DAY_END, step=15):
+        """Candidate start minutes (multiples of step from lo) where dur_m fits."""
+        starts = []
+        for a, b in self.free_gaps(d, dur_m, lo, hi):
+            first = lo + -(-(a - lo) // step) * step
+            if first + dur_m <= b:
+                starts.append(np.arange(first, b - dur_m + 1, step))
+        return np.concatenate(starts) if starts else np.empty(0, dtype=np.int64)
+
+def _merge(intervals):
+    intervals.sort()
+    merged = [list(intervals[0])]
+    for a, b in intervals[1:]:
+        if a <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return [(a, b) for a, b in merged]
+
+# ----------------------------
+# Global week optimizer
+# ----------------------------
+# Todos los eventos flexibles de los próximos 7 días y los bloques de estudio
+# nuevos se asignan en conjunto: nada se solapa y se maximiza
+# sum(peso_prioridad * horas * energía). Los solvers se registran en SOLVERS.
+HORIZON_DAYS = 7
+PRIORITY_WEIGHT = {"Baja": 1.0, "Media": 2.0, "Alta": 3.0}
+MOVE_MARGIN = 0.15          # solo se mueve un evento si la energía mejora al menos esto
+STUDY_MIN_ENERGY = 0.6
+TIME_BUDGET = 2.0           # segundos
+UNSET = -2                  # tarea aún sin decidir (branch and bound): no ocupa nada
+
+class Budget:
+    """Wall-clock deadline plus optional cancel event and progress callback."""
+
+    def __init__(self, seconds, cancel=None, progress=None):
+        self.deadline = _time.perf_counter() + seconds
+        self.cancel = cancel
+        self._progress = progress
+
+    def expired(self):
+        return _time.perf_counter() > self.deadline or (self.cancel is not None and self.cancel.is_set())
+
+    def report(self, fraction, message=""):
+        if self._progress is not None:
+            self._progress(min(1.0, max(0.0, fraction)), message)
+
+class _Task:
+    def __init__(self, kind, dur, weight, starts, energy, stay=None, stay_energy=None, row=None):
+        self.kind = kind            # "event" | "block"
+        self.dur = dur
+        self.weight = weight
+        self.starts = starts        # minutos absolutos desde el día 0
+        self.energy = energy
+        self.values = weight * (dur/60.0) * energy
+        self.stay = stay            # (a, b) absolutos del evento sin mover
+        self.stay_energy = stay_energy
+        self.default_value = weight * (dur/60.0) * (stay_energy + MOVE_MARGIN) if kind == "event" else 0.0
+        self.row = row
+
+    def value(self, c):
+        if c == UNSET:
+            return 0.0
+        return self.default_value if c < 0 else float(self.values[c])
+
+    def best_value(self):
+        return max(self.default_value, float(self.values.max()) if len(self.values) else 0.0)
+
+class Problem:
+    """Flexible events + study blocks over a week, with static busy time pre-filtered."""
+
+    def __init__(self, events, today, block_hours=1.5, target_week=12.0, step=15, existing_study=None):
+        self.today = today
+        self.tasks = []
+        self.n_blocks = 0
+        self.existing_study = 0.0
+        self.target_week = target_week
+        events = as_event_set(events)
+        offset = events.day.astype(np.int64) - (today - EPOCH).days
+        in_week = (offset >= 0) & (offset < HORIZON_DAYS)
+        # las ocurrencias de una serie comparten fila: se tratan como fijas
+        movable = in_week & ~events.fixed & ~events.recurring
+        start_m = events.start_m.astype(np.int32)
+        dur_m = events.dur_m.astype(np.int32)
+        energy = mean_energy(start_m, dur_m)
+        if existing_study is None:
+            existing_study = events.hours(in_week & events.category_mask(STUDY_CATEGORIES))
+        self.existing_study = float(existing_study)
+        self.target_week = max(target_week, self.existing_study)
+        index = DayIntervalIndex(events.take(~movable))
+        for pos in np.flatnonzero(movable):
+            row = events.row(pos)
+            day = int(offset[pos]); s = int(start_m[pos]); dur = int(dur_m[pos]); e = float(energy[pos])
+            starts = index.candidates(today + timedelta(days=day), dur, step=step)
+            cand_e = mean_energy(starts, dur)
+            keep = cand_e >= e + MOVE_MARGIN
+            self.tasks.append(_Task("event", dur, PRIORITY_WEIGHT.get(row["priority"], 2.0), starts[keep] + day*1440, cand_e[keep],
+                                    stay=(day*1440 + s, day*1440 + s + dur), stay_energy=e, row=row))
+        remaining = max(0.0, self.target_week - self.existing_study)
+        block_m = int(block_hours*60)
+        if remaining > 0 and block_m > 0:
+            # una tarea de bloque por día (máximo un bloque diario); el total se limita a n_blocks
+            self.n_blocks = int(np.ceil(remaining / block_hours))
+            for day in range(HORIZON_DAYS):
+                # cualquier hueco entre DAY_START y DAY_END con energía suficiente: decide el objetivo
+                cand = index.candidates(today + timedelta(days=day), block_m, step=step)
+                block_e = mean_energy(cand, block_m)
+                keep = block_e >= STUDY_MIN_ENERGY
+                if keep.any():
+                    self.tasks.append(_Task("block", block_m, PRIORITY_WEIGHT["Media"], cand[keep] + day*1440, block_e[keep]))
+
+    def upper_bounds(self):
+        return [t.best_value() for t in self.tasks]
+
+class Schedule:
+    """Mutable assignment: choice[i] = candidate index, -1 (stay / no block) or UNSET."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        n = (HORIZON_DAYS + 1) * 1440
+        self.occ_all = np.zeros(n, dtype=np.int16)     # todo lo asignado
+        self.occ_moved = np.zeros(n, dtype=np.int16)   # solo eventos movidos y bloques nuevos
+        self.blocks_used = 0
+        self.choice = [-1] * len(problem.tasks)
+        self.total = 0.0
+        for i in range(len(problem.tasks)):
+            self._place(i, -1)
+
+    def _interval(self, i, c):
+        t = self.problem.tasks[i]
+        if c == UNSET:
+            return None
+        if c < 0:
+            return t.stay
+        a = int(t.starts[c])
+        return a, a + t.dur
+
+    def _place(self, i, c, sign=1):
+        t = self.problem.tasks[i]
+        iv = self._interval(i, c)
+        if iv is not None:
+            a, b = iv
+            self.occ_all[a:b] += sign
+            if c >= 0:
+                self.occ_moved[a:b] += sign
+                if t.kind == "block":
+                    self.blocks_used += sign
+        self.choice[i] = c if sign > 0 else UNSET
+        self.total += sign * t.value(c)
+
+    def _fits(self, i, c):
+        iv = self._interval(i, c)
+        if iv is None:
+            return True
+        a, b = iv
+        if c < 0:
+            # el evento sin mover puede pisar solapes previos, pero no algo movido
+            return not self.occ_moved[a:b].any()
+        if self.problem.tasks[i].kind == "block" and self.blocks_used >= self.problem.n_blocks:
+            return False
+        return not self.occ_all[a:b].any()
+
+    def try_set(self, i, c):
+        old = self.choice[i]
+        if c == old:
+            return True
+        self._place(i, old, sign=-1)
+        if self._fits(i, c):
+            self._place(i, c)
+            return True
+        self._place(i, old)
+        return False
+
+    def load(self, choice):
+        """Force a consistent assignment ({task: candidate} or full list) without checks."""
+        items = choice.items() if isinstance(choice, dict) else enumerate(choice)
+        items = list(items)
+        for i, _ in items:
+            self._place(i, self.choice[i], sign=-1)
+        for i, c in items:
+            self._place(i, c)
+
+def solve_greedy(problem, budget, **opts):
+    sched = Schedule(problem)
+    pairs = []
+    for i, t in enumerate(problem.tasks):
+        gains = t.values - t.default_value
+        for c in np.flatnonzero(gains > 0):
+            pairs.append((float(gains[c]), i, int(c)))
+    pairs.sort(key=lambda p: (-p[0], p[1], p[2]))   # empate -> el más temprano
+    done = set()
+    for k, (gain, i, c) in enumerate(pairs):
+        if k % 256 == 0:
+            if budget.expired():
+                break
+            budget.report(k / len(pairs), "greedy")
+        if i not in done and sched.try_set(i, c):
+            done.add(i)
+    sched.optimal = False
+    return sched
+
+def solve_anneal(problem, budget, seed=0, max_iter=50000, t0=0.5, cooling=0.9995, **opts):
+    sched = solve_greedy(problem, budget)
+    n = len(problem.tasks)
+    if n == 0:
+        return sched
+    rng = random.Random(seed)
+    best, best_total = list(sched.choice), sched.total
+    temp = t0 * max(problem.upper_bounds())
+    for it in range(max_iter):
+        if it % 256 == 0:
+            if budget.expired():
+                break
+            budget.report(it / max_iter, "recocido simulado")
+        i = rng.randrange(n)
+        t = problem.tasks[i]
+        c = rng.randrange(-1, len(t.starts))
+        delta = t.value(c) - t.value(sched.choice[i])
+        if delta >= 0 or (temp > 1e-9 and rng.random() < math.exp(delta / temp)):
+            if sched.try_set(i, c) and sched.total > best_total + 1e-9:
+                best, best_total = list(sched.choice), sched.total
+        temp *= cooling
+    sched.load(best)
+    sched.optimal = False
+    return sched
+
+class _Timeout(Exception):
+    pass
+
+def _components(problem):
+    """Groups of tasks whose footprints (stay + candidates) can overlap."""
+    tasks = problem.tasks
+    parent = list(range(len(tasks)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    pieces = []
+    for i, t in enumerate(tasks):
+        if t.stay is not None:
+            pieces.append((t.stay[0], t.stay[1], i))
+        pieces.extend((int(a), int(a) + t.dur, i) for a in t.starts)
+    pieces.sort()
+    run_end, run_task = -1, None
+    for a, b, i in pieces:
+        if a < run_end:
+            parent[find(i)] = find(run_task)
+            run_end = max(run_end, b)
+        else:
+            run_end, run_task = b, i
+    groups = {}
+    for i in range(len(tasks)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+def _branch_and_bound(problem, sched, comp, max_blocks, incumbent, budget):
+    """Best {task: candidate} for one component using at most max_blocks blocks."""
+    tasks = problem.tasks
+    order = sorted(comp, key=lambda i: -tasks[i].best_value())
+    ub = [tasks[i].best_value() for i in order]
+    suffix = np.concatenate([np.cumsum(ub[::-1])[::-1], [0.0]])
+    best = {"choice": incumbent, "total": sum(tasks[i].value(c) for i, c in incumbent.items())}
+    if best["total"] >= suffix[0] - 1e-9:
+        return best   # ya alcanza la cota
+    options = [sorted(range(-1, len(tasks[i].starts)), key=lambda c, t=tasks[i]: -t.value(c)) for i in order]
+    nodes = [0]
+
+    def dfs(k, acc, used):
+        nodes[0] += 1
+        if nodes[0] % 512 == 0 and budget.expired():
+            raise _Timeout()
+        if k == len(order):
+            if acc > best["total"] + 1e-9:
+                best["choice"], best["total"] = {i: sched.choice[i] for i in comp}, acc
+            return
+        i = order[k]
+        t = tasks[i]
+        for c in options[k]:
+            v = t.value(c)
+            if acc + v + suffix[k+1] <= best["total"] + 1e-9:
+                break   # opciones ordenadas por valor: las siguientes tampoco sirven
+            extra = 1 if (t.kind == "block" and c >= 0) else 0
+            if used + extra > max_blocks:
+                continue
+            if sched.try_set(i, c):
+                dfs(k + 1, acc + v, used + extra)
+                sched.try_set(i, UNSET)
+
+    sched.load({i: UNSET for i in comp})
+    try:
+        dfs(0, 0.0, 0)
+    finally:
+        sched.load({i: -1 for i in comp})
+    return best
+
+def solve_exact(problem, budget, **opts):
+    """Branch and bound per independent component + knapsack over the block budget.
+
+    Optimal unless the time budget runs out (then returns the greedy plan)."""
+    greedy = solve_greedy(problem, budget)
+    plan = list(greedy.choice)
+    sched = Schedule(problem)   # todo en -1: cada componente se resuelve aislada
+    tasks = problem.tasks
+    # dp[k] = (valor, elección) usando k bloques en las componentes ya vistas
+    dp = {0: (0.0, {})}
+    comps = _components(problem)
+    try:
+        for n_done, comp in enumerate(comps):
+            budget.report(n_done / len(comps), "branch and bound")
+            n_comp_blocks = min(problem.n_blocks, sum(1 for i in comp if tasks[i].kind == "block"))
+            greedy_used = sum(1 for i in comp if tasks[i].kind == "block" and plan[i] >= 0)
+            results = []
+            for j in range(n_comp_blocks + 1):
+                incumbent = {i: plan[i] for i in comp} if greedy_used <= j else {i: -1 for i in comp}
+                results.append(_branch_and_bound(problem, sched, comp, j, incumbent, budget))
+            new_dp = {}
+            for k, (val, choice) in dp.items():
+                for j, res in enumerate(results):
+                    if k + j > problem.n_blocks:
+                        break
+                    cand = (val + res["total"], {**choice, **res["choice"]})
+                    if k + j not in new_dp or cand[0] > new_dp[k + j][0]:
+                        new_dp[k + j] = cand
+            dp = new_dp
+    except _Timeout:
+        greedy.optimal = False
+        return greedy
+    _, choice = max(dp.values(), key=lambda x: x[0])
+    sched.load(choice)
+    sched.optimal = True
+    return sched
+
+SOLVERS = {"greedy": solve_greedy, "anneal": solve_anneal, "exact": solve_exact}
+
+def optimize_schedule(events, today=None, mode="greedy", block_hours=1.5, target_week=12.0, step=15, time_budget=TIME_BUDGET,
+                      cancel=None, progress=None, existing_study=None, **opts):
+    today = today or date.today()
+    budget = Budget(time_budget, cancel=cancel, progress=progress)
+    problem = Problem(events, today, block_hours=block_hours, target_week=target_week, step=step, existing_study=existing_study)
+    sched = SOLVERS[mode](problem, budget, **opts)
+    budget.report(1.0, "listo")
+    suggestions, study_blocks = [], []
+    for i, c in enumerate(sched.choice):
+        t = problem.tasks[i]
+        if c < 0:
+            continue
+        a = int(t.starts[c]); d = today + timedelta(days=a // 1440)
+        if t.kind == "event":
+            r = t.row
+            suggestions.append({"event_id": int(r["id"]), "from": f"{r['date']} {r['start']}-{r['end']}", "to": f"{d} {minutes_to_hhmm(a)}-{minutes_to_hhmm(a + t.dur)}", "reason": f"Mejor energía ({t.energy[c]:.2f} vs {t.stay_energy:.2f})",
+                                "date": d, "start": minutes_to_hhmm(a), "end": minutes_to_hhmm(a + t.dur)})
+        else:
+            study_blocks.append({"date":d,"start":minutes_to_hhmm(a),"end":minutes_to_hhmm(a + t.dur),"avg_energy":float(t.energy[c])})
+    study_blocks.sort(key=lambda b: (b["date"], b["start"]))
+    return {"suggestions": suggestions, "study_blocks": study_blocks, "target_week": problem.target_week, "existing_study": problem.existing_study,
+            "mode": mode, "objective": sched.total, "optimal": sched.optimal}
+
+@timed("optimizer.local_optimizer_impl")
+def local_optimizer_impl(user_id, goals_text="", block_hours=1.5, mode="greedy", time_budget=TIME_BUDGET, step=15, target_week=12.0,
+                         cancel=None, progress=None):
+    # horizonte (más el día anterior, por eventos que cruzan medianoche) con las series expandidas;
+    # horas de estudio ya hechas en la semana ISO actual: lectura O(1) de week_load
+    today = date.today()
+    events = get_event_set(user_id, today - timedelta(days=1), today + timedelta(days=HORIZON_DAYS - 1))
+    return optimize_schedule(events, today=today, mode=mode, block_hours=block_hours, target_week=target_week, step=step,
+                             time_budget=time_budget, cancel=cancel, progress=progress,
+                             existing_study=week_hours(user_id, today)["study"])
@@ -0,0 +1,150 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from metrics import EPOCH
+
+# ----------------------------
+# Recurrence rules (subconjunto de RRULE, RFC 5545)
+# ----------------------------
+# Una serie es una sola fila de events: date/start/end son la primera
+# ocurrencia (DTSTART), rrule la regla y exdates las fechas excluidas
+# (ISO, separadas por coma). Las ocurrencias no se guardan: se expanden
+# solo para la ventana de fechas que se pide (ver db.get_events_range).
+# Soportado: FREQ=DAILY|WEEKLY, INTERVAL, BYDAY, UNTIL o COUNT.
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+MAX_COUNT = 5000
+
+# series con alguna ocurrencia posible en [:a, :b] (usa idx_events_user_series)
+SERIES_WINDOW = "rrule IS NOT NULL AND date <= :b AND (until_date IS NULL OR until_date >= :a)"
+SERIES_IN_WINDOW = "SELECT * FROM events WHERE user_id=:id AND " + SERIES_WINDOW
+
+def _parse_date(s):
+    s = str(s).strip()
+    return date.fromisoformat(s[:10]) if "-" in s else date(int(s[:4]), int(s[4:6]), int(s[6:8]))
+
+def parse_rrule(s):
+    """{freq, interval, byday, until, count} from an RRULE string; ValueError if unsupported."""
+    body = str(s).strip()
+    if body.upper().startswith("RRULE:"):
+        body = body[6:]
+    try:
+        parts = dict(p.split("=", 1) for p in body.upper().split(";") if p)
+    except ValueError:
+        raise ValueError(f"regla inválida: {s!r}")
+    unknown = set(parts) - {"FREQ", "INTERVAL", "BYDAY", "UNTIL", "COUNT", "WKST"}
+    if unknown:
+        raise ValueError(f"regla no soportada: {', '.join(sorted(unknown))}")
+    freq = parts.get("FREQ")
+    if freq not in ("DAILY", "WEEKLY"):
+        raise ValueError(f"FREQ no soportada: {freq!r}")
+    try:
+        interval = int(parts.get("INTERVAL", 1))
+        byday = tuple(sorted({WEEKDAYS.index(d.strip()) for d in parts["BYDAY"].split(",")})) if "BYDAY" in parts else None
+        until = _parse_date(parts["UNTIL"]) if "UNTIL" in parts else None
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except (ValueError, IndexError):
+        raise ValueError(f"regla inválida: {s!r}")
+    if interval < 1 or (count is not None and not 1 <= count <= MAX_COUNT):
+        raise ValueError(f"regla inválida: {s!r}")
+    if until is not None and count is not None:
+        raise ValueError("UNTIL y COUNT son excluyentes")
+    return {"freq": freq, "interval": interval, "byday": byday, "until": until, "count": count}
+
+def format_rrule(rule):
+    parts = [f"FREQ={rule['freq']}"]
+    if rule["interval"] != 1:
+        parts.append(f"INTERVAL={rule['interval']}")
+    if rule["byday"]:
+        parts.append("BYDAY=" + ",".join(WEEKDAYS[d] for d in rule["byday"]))
+    if rule["until"] is not None:
+        parts.append(f"UNTIL={rule['until']:%Y%m%d}")
+    if rule["count"] is not None:
+        parts.append(f"COUNT={rule['count']}")
+    return ";".join(parts)
+
+def parse_exdates(s):
+    if s is None or (isinstance(s, float) and pd.isna(s)):
+        return []
+    return sorted({_parse_date(x) for x in str(s).replace(";", ",").split(",") if x.strip()})
+
+def format_exdates(days):
+    return ",".join(d.isoformat() for d in sorted(set(days))) or None
+
+def _days(dtstart, rule, first, last):
+    # días epoch en [first, last] que cumplen la regla, sin límites UNTIL/COUNT
+    start = (dtstart - EPOCH).days
+    days = np.arange(max(first, start), last + 1, dtype=np.int64)
+    weekday = (days + 3) % 7   # 1970-01-01 fue jueves
+    if rule["freq"] == "DAILY":
+        keep = (days - start) % rule["interval"] == 0
+        if rule["byday"]:
+            keep &= np.isin(weekday, rule["byday"])
+    else:
+        byday = rule["byday"] or (dtstart.weekday(),)
+        week0 = start - (start + 3) % 7
+        keep = np.isin(weekday, byday) & (((days - week0) // 7) % rule["interval"] == 0)
+    return days[keep]
+
+def series_end(dtstart, rule):
+    """Last occurrence date (None if the series is open-ended)."""
+    if rule["until"] is not None:
+        days = _days(dtstart, rule, (dtstart - EPOCH).days, (rule["until"] - EPOCH).days)
+        return EPOCH + timedelta(days=int(days[-1])) if len(days) else dtstart
+    if rule["count"] is not None:
+        # COUNT cuenta también las fechas excluidas (RFC 5545)
+        start = (dtstart - EPOCH).days
+        days = _days(dtstart, rule, start, start + rule["count"] * 7 * rule["interval"])
+        if not len(days):
+            return dtstart
+        return EPOCH + timedelta(days=int(days[min(rule["count"], len(days)) - 1]))
+    return None
+
+def occurrence_days(dtstart, rule, exdates=(), date_from=None, date_to=None, end=None):
+    """Epoch-day int array of occurrences within [date_from, date_to] (both inclusive)."""
+    end = end if end is not None else series_end(dtstart, rule)
+    if date_to is None or (end is not None and end < date_to):
+        date_to = end
+    if date_to is None:
+        raise ValueError("serie sin fin: hace falta date_to")
+    first = (date_from - EPOCH).days if date_from is not None else (dtstart - EPOCH).days
+    days = _days(dtstart, rule, first, (date_to - EPOCH).days)
+    if exdates:
+        days = days[~np.isin(days, [(d - EPOCH).days for d in exdates])]
+    return days
+
+def ics_rrule(rrule):
+    """RRULE value for an export with floating DTSTART (UNTIL as local date-time, RFC 5545)."""
+    rule = parse_rrule(rrule)
+    value = format_rrule(dict(rule, until=None))
+    return value + (f";UNTIL={rule['until']:%Y%m%d}T235959" if rule["until"] is not None else "")
+
+def expand_series(df, date_from=None, date_to=None):
+    """One row per occurrence of each series row in df (same columns; date/start_at/end_at per occurrence)."""
+    if df.empty:
+        return df
+    date_from = _parse_date(date_from) if date_from is not None else None
+    date_to = _parse_date(date_to) if date_to is not None else None
+    counts, day_lists = [], []
+    for r in df.itertuples(index=False):
+        try:
+            dtstart = _parse_date(r.date)
+            days = occurrence_days(dtstart, parse_rrule(r.rrule), parse_exdates(r.exdates), date_from, date_to,
+                                   end=_parse_date(r.until_date) if isinstance(r.until_date, str) else None)
+        except (ValueError, TypeError):
+            days = np.empty(0, dtype=np.int64)   # serie inválida: no aporta ocurrencias
+        if pd.isna(r.start_at):
+            days = np.empty(0, dtype=np.int64)
+        counts.append(len(days))
+        day_lists.append(days)
+    out = df.loc[df.index.repeat(counts)].reset_index(drop=True)
+    if out.empty:
+        return out
+    days = np.concatenate(day_lists)
+    start_at = out["start_at"].to_numpy(dtype=np.int64)
+    dur = out["end_at"].to_numpy(dtype=np.int64) - start_at
+    out["start_at"] = days * 1440 + start_at % 1440
+    out["end_at"] = out["start_at"] + dur
+    out["date"] = pd.to_datetime(days, unit="D").strftime("%Y-%m-%d")
+    return out
@@ -0,0 +1,50 @@
+import os
+
+from sqlalchemy import create_engine, event
+
+from instrumentation import ENABLED as INSTRUMENT, instrument_engine
+
+# ----------------------------
+# Storage backend (SQLite local / PostgreSQL)
+# ----------------------------
+# AGENDA_DB_URL elige el backend; por defecto el archivo SQLite del repo.
+# Con PostgreSQL (p.ej. postgresql+psycopg2://user:pw@host/agenda) se usan los
+# mismos helpers de db.py; el driver se instala aparte.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(BASE_DIR, "agenda_pro.db")
+DATABASE_URL = os.environ.get("AGENDA_DB_URL", f"sqlite:///{DB_FILE}")
+
+POOL_SIZE = int(os.environ.get("AGENDA_DB_POOL_SIZE", "8"))
+MAX_OVERFLOW = int(os.environ.get("AGENDA_DB_MAX_OVERFLOW", "16"))
+
+# SQLite: WAL deja leer mientras otra sesión escribe; busy_timeout espera el
+# lock en vez de fallar con "database is locked".
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("AGENDA_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.environ.get("AGENDA_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.environ.get("AGENDA_SQLITE_SYNCHRONOUS", "NORMAL")
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cur.close()
+
+def create_storage_engine(url=None):
+    url = url or DATABASE_URL
+    if url.startswith("sqlite"):
+        in_memory = url in ("sqlite://", "sqlite:///:memory:")
+        kwargs = {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+        if not in_memory:
+            kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW)
+        eng = create_engine(url, echo=False, future=True, **kwargs)
+        if not in_memory:
+            event.listen(eng, "connect", _sqlite_pragmas)
+    else:
+        eng = create_engine(url, echo=False, future=True, pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=True)
+    if INSTRUMENT:
+        instrument_engine(eng)
+    return eng
+
+engine = create_storage_engine()
@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from storage import engine
+
+# ----------------------------
+# Users (pantalla de acceso)
+# ----------------------------
+# Solo SQLAlchemy: auth.py importa esto y no db.py, así la pantalla de acceso
+# no carga pandas/numpy (db, aggregates, freebusy...).
+def add_user(username, password_hash):
+    """Insert a user (password already hashed, see auth.py); False if the username exists."""
+    with engine.begin() as conn:
+        res = conn.execute(text("""
+        INSERT INTO users (username, password) VALUES (:u, :p) ON CONFLICT (username) DO NOTHING
+        """), {"u": username, "p": password_hash})
+    return res.rowcount == 1
+
+def set_password_hash(user_id, password_hash):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE users SET password=:p WHERE id=:id"), {"p": password_hash, "id": user_id})
+
+def get_user_by_name(username):
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT * FROM users WHERE username=:u"), {"u": username}).mappings().first()
+    return dict(row) if row is not None else None